@@ -1,10 +1,16 @@
 import pandas as pd
 import os
 import sys
+import matplotlib
+import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
 from blood_pressure import CategoricalStats, Htn_definition
 from outcome_stats import OutcomeStats
 from bp_over_time_plots import build_time_series_multiplot
 from build_dataframe import build_dataframe
+from shared_dataset import (
+    load_working_dataframe, WORKING_PICKLE, SHARED_DATASET)
+from cutoff_sweep import CutoffSweep
 
 # read exported dataset
 
@@ -14,58 +20,59 @@ from build_dataframe import build_dataframe
 # build states for categorical differences for 3 different blood pressure cutoffs.
 
 
-def main(df, htn_def):
+categorical_queries = {
+    'AGE_BIN': 'multinomial',
+    'SEX': 'multinomial',
+    'HX_HTN': 'binomial',
+    'VDAYR': 'multinomial',
+    'VTIMER': 'multinomial',
+    'ANTIHYPERTENSIVE_RX': 'binomial',
+    'ANTIHYPERTENSIVE_GIVEN': 'binomial',
+    'TRIAGE_TACHYCARDIA': 'binomial',
+    'TYLENOL_GIVEN': 'binomial',
+    'NO_TRIAGE_BP': 'binomial',
+    'DIED': 'binomial',
+    'PAYTYPER': 'multinomial',
+    'ADMITHOS': 'binomial',
+    'LEFT_AMA': 'binomial',
+    'LWBS': 'binomial',
+    'ADMITS_COMBINED': 'binomial',
+    'DISCHARGED_COMBINED': 'binomial',
+    'ARREMS': 'multinomial',
+    'RACERETH': 'multinomial',
+    'REGION': 'multinomial',
+    'IMMEDR': 'multinomial',
+    'CHEST_PAIN_VISIT': 'binomial',
+    'DYSPNEA_VISIT': 'binomial',
+    'ABDOMINAL_PAIN_VISIT': 'binomial',
+    'ATTPHYS': 'multinomial',
+    'RESINT': 'multinomial',
+    'MIDLEVEL': 'binomial',
+    'XRAY': 'binomial',
+    'CATSCAN': 'binomial',
+    'MRI': 'binomial',
+    'CBC': 'binomial',
+    'TROPONIN': 'binomial',
+}
+outcome_queries = [
+    ['DIED', 'categorical'],
+    ['ADMITHOS', 'categorical'],
+    ['HTN_COMPLICATION', 'categorical'],
+    ['ANTIHYPERTENSIVE_GIVEN', 'categorical'],
+    ['ANTIHYPERTENSIVE_RX', 'categorical'],
+    ['TYLENOL_GIVEN', 'categorical'],
+    ['CBC', 'categorical'],
+    ['TROPONIN', 'categorical'],
+    ['XRAY', 'categorical'],
+    ['CATSCAN', 'categorical'],
+    ['BPSYS', 'numeric'],
+    ['ED_LOS', 'numeric'],
+    ['HOSP_LOS', 'numeric'],
 
-    categorical_queries = {
-        'AGE_BIN': 'multinomial',
-        'SEX': 'multinomial',
-        'HX_HTN': 'binomial',
-        'VDAYR': 'multinomial',
-        'VTIMER': 'multinomial',
-        'ANTIHYPERTENSIVE_RX': 'binomial',
-        'ANTIHYPERTENSIVE_GIVEN': 'binomial',
-        'TRIAGE_TACHYCARDIA': 'binomial',
-        'TYLENOL_GIVEN': 'binomial',
-        'NO_TRIAGE_BP': 'binomial',
-        'DIED': 'binomial',
-        'PAYTYPER': 'multinomial',
-        'ADMITHOS': 'binomial',
-        'LEFT_AMA': 'binomial',
-        'LWBS': 'binomial',
-        'ADMITS_COMBINED': 'binomial',
-        'DISCHARGED_COMBINED': 'binomial',
-        'ARREMS': 'multinomial',
-        'RACERETH': 'multinomial',
-        'REGION': 'multinomial',
-        'IMMEDR': 'multinomial',
-        'CHEST_PAIN_VISIT': 'binomial',
-        'DYSPNEA_VISIT': 'binomial',
-        'ABDOMINAL_PAIN_VISIT': 'binomial',
-        'ATTPHYS': 'multinomial',
-        'RESINT': 'multinomial',
-        'MIDLEVEL': 'binomial',
-        'XRAY': 'binomial',
-        'CATSCAN': 'binomial',
-        'MRI': 'binomial',
-        'CBC': 'binomial',
-        'TROPONIN': 'binomial',
-    }
-    outcome_queries = [
-        ['DIED', 'categorical'],
-        ['ADMITHOS', 'categorical'],
-        ['HTN_COMPLICATION', 'categorical'],
-        ['ANTIHYPERTENSIVE_GIVEN', 'categorical'],
-        ['ANTIHYPERTENSIVE_RX', 'categorical'],
-        ['TYLENOL_GIVEN', 'categorical'],
-        ['CBC', 'categorical'],
-        ['TROPONIN', 'categorical'],
-        ['XRAY', 'categorical'],
-        ['CATSCAN', 'categorical'],
-        ['BPSYS', 'numeric'],
-        ['ED_LOS', 'numeric'],
-        ['HOSP_LOS', 'numeric'],
+]
 
-    ]
+
+def main(df, htn_def):
     categorical_stats = CategoricalStats(df, categorical_queries, htn_def)
     outcome_stats = OutcomeStats(df, htn_def, outcome_queries)
     outcome_fig, _ = outcome_stats.plot_queries()
@@ -74,7 +81,7 @@ def main(df, htn_def):
     return categorical_stats.get_stats(), outcome_stats.get_stats(), outcome_fig, time_series_fig
 
 
-def export_cutoff(df, sbp_cutoff, dbp_cutoff):
+def export_cutoff(df, sbp_cutoff, dbp_cutoff, save_category_plot=True):
     # set HTN definition
     htn_def = Htn_definition(df, sbp_cutoff, dbp_cutoff)
 
@@ -88,22 +95,109 @@ def export_cutoff(df, sbp_cutoff, dbp_cutoff):
         os.makedirs(dir_path)
     stats[0].to_csv(os.path.join(dir_path, 'baseline_characteristics.csv'))
     stats[1].to_csv(os.path.join(dir_path, 'outcome_stats.csv'))
-    outcome_fig.savefig(os.path.join('./outputs', 'category_by_bp.png'))
+    # category_by_bp.png is shared by all the cutoffs
+    if save_category_plot:
+        outcome_fig.savefig(os.path.join('./outputs', 'category_by_bp.png'))
     time_series_fig.savefig(os.path.join(dir_path, 'time_series.png'))
+    plt.close(outcome_fig)
+    plt.close(time_series_fig)
+
+
+def print_cutoff_header(sbp, dbp):
+    print(
+        f'''
+    ---------------------------------------------------------
+    Generating baseline characteristics and outcome stats for
+    exposure of blood pressure >{sbp}/{dbp}
+    ---------------------------------------------------------
+    ''')
+
+
+# working dataframe of an export worker process, see init_export_worker
+worker_df = None
+
+
+def init_export_worker():
+    '''
+    runs once in each export worker: draw without a display and attach to
+    the memory-mapped working dataset, so every worker shares the same
+    read-only pages instead of holding its own copy
+    '''
+    global worker_df
+    matplotlib.use('Agg')
+    worker_df = load_working_dataframe()
+
+
+def export_cutoff_in_worker(sbp, dbp, save_category_plot):
+    print_cutoff_header(sbp, dbp)
+    export_cutoff(worker_df, sbp, dbp, save_category_plot)
+    return sbp, dbp
+
+
+def export_cutoffs(cutoffs, df=None, max_workers=1):
+    '''
+    export_cutoff for each [sbp, dbp] in cutoffs. With max_workers > 1
+    (None is one per cutoff, up to the number of cores) the cutoffs are
+    exported in parallel by worker processes that open the shared working
+    dataset themselves (see the shared_dataset module), df is only used by
+    the serial export.
+
+    Only the last cutoff saves category_by_bp.png, the same file a serial
+    run ends up with.
+    '''
+    last = len(cutoffs) - 1
+    if max_workers is None:
+        max_workers = min(len(cutoffs), os.cpu_count())
+    if max_workers == 1 or len(cutoffs) < 2:
+        df = load_working_dataframe() if df is None else df
+        for idx, (sbp, dbp) in enumerate(cutoffs):
+            print_cutoff_header(sbp, dbp)
+            export_cutoff(df, sbp, dbp, save_category_plot=idx == last)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(cutoffs)),
+                             initializer=init_export_worker) as executor:
+        futures = [
+            executor.submit(export_cutoff_in_worker, sbp, dbp, idx == last)
+            for idx, (sbp, dbp) in enumerate(cutoffs)
+        ]
+        for future in futures:
+            sbp, dbp = future.result()
+            print(f'Exported blood pressure >{sbp}/{dbp}')
+
+
+def export_sweep(df, dir_path='./outputs/cutoff_sweep'):
+    '''
+    RR/DIFF of every outcome query over the full grid of SBP x DBP cutoffs
+    (see the cutoff_sweep module)
+    '''
+    sweep = CutoffSweep(df, outcome_queries)
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+    sweep.to_frame().to_csv(os.path.join(dir_path, 'cutoff_sweep.csv'), index=False)
+    sweep.plot_surfaces().savefig(os.path.join(dir_path, 'rr_surfaces.png'))
+    sweep.plot_dose_response().savefig(
+        os.path.join(dir_path, 'dose_response.png'))
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 0:
-        force_download = False
-    else:
-        force_download = sys.argv[1] in ['force', 'Force', '--force', '--Force']
-    if os.path.exists('./outputs/working_dataframe.pkl') and not force_download:
-        df = pd.read_pickle('./outputs/working_dataframe.pkl')
+    # python NHAMCS_hypertension.py [force] [sweep] [parallel]
+    args = [arg.lower().lstrip('-') for arg in sys.argv[1:]]
+    force_download = 'force' in args
+    # a memory budgeted build only writes the Arrow file
+    built = os.path.exists(WORKING_PICKLE) or os.path.exists(SHARED_DATASET)
+    if built and not force_download:
+        df = load_working_dataframe()
     else:
         build_dataframe(force_download=force_download)
-        df = pd.read_pickle('./outputs/working_dataframe.pkl')
+        df = load_working_dataframe()
     for col in df.columns:
         print(col)
+    if 'sweep' in args:
+        print('Generating outcome stats for the full grid of BP cutoffs')
+        export_sweep(df)
+        sys.exit()
+
     cutoffs = [
         [180, 110],
         [160, 100],
@@ -111,12 +205,6 @@ if __name__ == "__main__":
         [120, 80]
     ]
 
-    for sbp, dbp in cutoffs:
-        print(
-            f'''
-        ---------------------------------------------------------
-        Generating baseline characteristics and outcome stats for
-        exposure of blood pressure >{sbp}/{dbp}
-        ---------------------------------------------------------
-        ''')
-        export_cutoff(df, sbp, dbp)
+    # one worker process per cutoff with the parallel flag
+    max_workers = None if 'parallel' in args else 1
+    export_cutoffs(cutoffs, df, max_workers)
@@ -1,20 +1,42 @@
 import pandas as pd
 from blood_pressure import Htn_definition
-import matplotlib.pyplot as plt
 from antihypertensive_list import import_modified_hypertensive_list
+from build_dataframe import GPMED_STATUS
+from medication_index import MedicationIndex
+from shared_dataset import load_working_dataframe
 
-class MedCounts()
-    def __init__(df, htn_def):
+
+class MedCounts():
+    '''
+    Weighted number of visits (in millions) with each antihypertensive, for
+    visits with and without triage hypertension. The counts come from the
+    medication index that build_dataframe saves, so the MED columns aren't
+    scanned.
+
+    Example use:
+    med_counts = MedCounts(df, htn_definition)
+    med_counts.med_counts('given')
+    '''
+
+    def __init__(self, df, htn_def, index=None):
         self.df = df
         self.htn_def = htn_def
+        self.index = MedicationIndex.load() if index is None else index
 
-
-    def med_counts(self):
+    def med_counts(self, status=None):
+        '''
+        status - 'given', 'rx' or None for any mention of the medication
+        '''
         meds = import_modified_hypertensive_list()
-
+        gp_labels = None if status is None else GPMED_STATUS[status]
+        counts = self.index.weighted_counts(
+            self.df['PATWT'], self.htn_def.get_triage_htn(), meds, gp_labels)
+        return counts.sort_values('n_total', ascending=False)
 
 
 if __name__ == "__main__":
-    df = pd.read_pickle(
-        ('./outputs/working_dataframe.pkl'))
-    htn_definition = Htn_definition(df, sbp_cutoff=90, dbp_cutoff=50)
\ No newline at end of file
+    df = load_working_dataframe()
+    htn_definition = Htn_definition(df, sbp_cutoff=90, dbp_cutoff=50)
+    med_counts = MedCounts(df, htn_definition)
+    print(med_counts.med_counts('given'))
+    print(med_counts.med_counts('rx'))
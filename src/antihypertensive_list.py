@@ -4,9 +4,69 @@
 3) create a importable csv or text file for other scripts
 '''
 from utility_functions import get_regex_cols
+from vocabulary_matching import code_matrix, match_vocabulary
 import pandas as pd
 import numpy as np
-import re
+
+NUM_MED_SLOTS = 30
+CV_regex = r'Cardiovascular agents|Cardiovas agents'
+# each medication RX{i} has up to 16 category columns (4 multum categories
+# at each of the 4 levels)
+RX_CATEGORY_SUFFIXES = [
+    'CAT1', 'CAT2', 'CAT3', 'CAT4',
+    'V1C1', 'V1C2', 'V1C3', 'V1C4',
+    'V2C1', 'V2C2', 'V2C3', 'V2C4',
+    'V3C1', 'V3C2', 'V3C3', 'V3C4',
+]
+
+
+def get_category_codes(raw_df):
+    '''
+    Encode all the RX category columns against one shared vocabulary of
+    category labels.
+
+    Returns (codes, vocabulary) where codes has shape
+    len(raw_df) x 30 x len(RX_CATEGORY_SUFFIXES), codes[:, slot, k] being
+    RX{slot + 1}{RX_CATEGORY_SUFFIXES[k]}. Columns missing from raw_df are
+    coded -1 (no match).
+    '''
+    columns = [f'RX{slot}{suffix}'
+               for slot in range(1, NUM_MED_SLOTS + 1)
+               for suffix in RX_CATEGORY_SUFFIXES]
+    present = [idx for idx, col in enumerate(columns) if col in raw_df.columns]
+    codes = np.full((len(raw_df), len(columns)), -1, dtype=np.int32)
+    if not present:
+        return (codes.reshape(len(raw_df), NUM_MED_SLOTS, -1),
+                pd.Index([], dtype=object))
+    found_codes, vocabulary = code_matrix(
+        raw_df, [columns[idx] for idx in present])
+    codes[:, present] = found_codes
+    return codes.reshape(len(raw_df), NUM_MED_SLOTS, -1), vocabulary
+
+
+def build_drug_class_filters(raw_df, drug_classes):
+    '''
+    For a dict of {name: regex} over the RX category labels return a dict
+    of {name: boolean filter} with shape len(raw_df) x 30, true where
+    medication slot MED1-MED30 has any category matching the regex.
+
+    Each regex is run once per distinct category label, so adding drug
+    classes is almost free.
+
+    Example use:
+    filters = build_drug_class_filters(raw_df, {
+        'ANTICOAGULANT': r'Anticoagulants',
+        'OPIOID': r'Narcotic analgesics',
+    })
+    '''
+    codes, vocabulary = get_category_codes(raw_df)
+    # case sensitive, like str.contains
+    hits = match_vocabulary(vocabulary, list(drug_classes.values()), case=True)
+    matched = np.zeros((len(raw_df), NUM_MED_SLOTS, len(drug_classes)),
+                       dtype=bool)
+    for k in range(codes.shape[2]):
+        matched |= hits[codes[:, :, k]]
+    return {name: matched[:, :, j] for j, name in enumerate(drug_classes)}
 
 
 def build_cardiovascular_med_filter(raw_df):
@@ -14,39 +74,8 @@ def build_cardiovascular_med_filter(raw_df):
     Returns a boolean filter for cardovascular meds
     with shape len(raw_df) x 30 
     '''
-    # for each of the 30 med cols, check if it is a cv med
-    num_rows, num_cols = len(raw_df), 30
-    CV_regex = r'Cardiovascular agents|Cardiovas agents'
-    category_cols = [
-        r'RX\d*CAT1',
-        r'RX\d*CAT2',
-        r'RX\d*CAT3',
-        r'RX\d*CAT4',
-        r'RX\d*V1C1',
-        r'RX\d*V1C2',
-        r'RX\d*V1C3',
-        r'RX\d*V1C4',
-        r'RX\d*V2C1',
-        r'RX\d*V2C2',
-        r'RX\d*V2C3',
-        r'RX\d*V2C4',
-        r'RX\d*V3C1',
-        r'RX\d*V3C2',
-        r'RX\d*V3C3',
-        r'RX\d*V3C4',
-    ]
-    # start with a filter that is all False
-    F = np.full((num_rows, num_cols), False)
-    for rx_col in category_cols:
-        # each regex 'rx_col' is going to match 30 columns (for each med)
-        # category_cols contains all the different category options
-        # for each medication
-        cols = get_regex_cols(raw_df, rx_col)
-        rx_df = raw_df[cols]  # get the cols for this category (30 of them)
-        bool_df = rx_df.apply(lambda ser: ser.str.contains(
-            CV_regex, regex=True), axis=1).to_numpy()
-        F = bool_df | F
-    return F
+    return build_drug_class_filters(
+        raw_df, {'CARDIOVASCULAR': CV_regex})['CARDIOVASCULAR']
 
 
 def export_antihypertensive_list(raw_df):
@@ -76,12 +105,14 @@ def get_drug_info(raw_df, drug_name):
     are for a medication. Enter the DF and a drug name and it will return
     the RX info for that drug. 
     '''
-    meds = raw_df[get_regex_cols(raw_df, r'^MED\d+$')]
-    F = meds.apply(lambda ser: ser.str.contains(
-        drug_name, regex=True, flags=re.IGNORECASE), axis=1)
-    F_filtered = F[F.any(axis=1)]
-    row_idx = F_filtered.index[0]
-    col_idx = F_filtered.loc[row_idx].idxmax()
+    med_cols = get_regex_cols(raw_df, r'^MED\d+$')
+    # match the drug once per distinct medication name
+    codes, vocabulary = code_matrix(raw_df, med_cols)
+    hits = match_vocabulary(vocabulary, [drug_name])[:, 0]
+    F = hits[codes]
+    row_pos = np.flatnonzero(F.any(axis=1))[0]
+    row_idx = raw_df.index[row_pos]
+    col_idx = med_cols[F[row_pos].argmax()]
     med_number = col_idx[3:]  # intentially left a string
     empty_category_cols = [
         r'RX_CAT1',
@@ -109,8 +140,8 @@ def get_drug_info(raw_df, drug_name):
 
 
 if __name__ == "__main__":
-    # raw_df = pd.read_pickle(
-    #     ('./outputs/working_raw_dataframe.pkl'))
+    # from build_dataframe import load_dfs
+    # raw_df = load_dfs()
     # raw_df = raw_df.query("YEAR >= 2015")
     # export_antihypertensive_list(raw_df)
     print(import_modified_hypertensive_list())
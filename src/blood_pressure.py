@@ -1,7 +1,9 @@
 import pandas as pd
 import numpy as np
 from scipy.stats import chi2_contingency
-from stats import weighted_proportion, weighted_chi2, weighted_contingency
+from stats import chi2_2x2, weighted_category_counts
+from shared_dataset import load_working_dataframe
+from feature_registry import select_columns
 
 pd.set_option('display.max_columns', None)  # None means unlimited
 pd.set_option('display.width', None)
@@ -11,7 +13,8 @@ class CategoricalStats():
     '''
     Contains methods for generating the base characteristics tables
     Args:
-    # df - working dataframe
+    # df - working dataframe, or a FeatureFrame in which case only the
+    query columns are computed
 
     # htn_definition - from Htn_definition class, gives BP cutoff values
     and has a function to get the patients with hypertension by the definition
@@ -28,7 +31,7 @@ class CategoricalStats():
     '''
 
     def __init__(self, df, query_dict, htn_definition):
-        self.df = df
+        self.df = select_columns(df, list(query_dict) + ['PATWT'])
         self.htn_definition = htn_definition
         self.queries = self.build_queries(query_dict)
         self.stats_table = self.build_stats_table()
@@ -41,75 +44,104 @@ class CategoricalStats():
         return queries
 
     def process_binomial_query(self, query):
-        print(f'Processing query - {query.column_name}, {query.kind}')
-        has_htn = self.htn_definition.get_triage_htn()
-        weights = self.get_weights()
-
-        # column to calculate stats on
-        col = self.df[query.column_name]
+        return self.process_binomial_queries([query])
 
-        # make sure it's a binary column of 0/1 values
-        assert set(col) == {
-            0, 1}, f"{query.column_name}, does not seem to be binary"
-
-        # patiehts with htn
-        ser1 = col[has_htn]
-        weights1 = weights[ser1.index]
-        # patiehts without htn
-        ser2 = col[~has_htn]
-        weights2 = weights[ser2.index]
-
-        # calculate p value with chi2
-        # indexing weights is addressed in the weighted_chi2 function
-        p_value = weighted_chi2(ser1, ser2, weights)
+    def process_binomial_queries(self, queries):
+        '''
+        Stats rows for any number of binomial queries at once. The 0/1
+        columns are stacked into one (rows x queries) matrix, so the
+        weighted counts of the total, no HTN and HTN groups are a single
+        matrix product and every chi2 test is done in one vectorized step.
+        '''
+        names = [query.column_name for query in queries]
+        print(f'Processing binomial queries - {", ".join(names)}')
+        has_htn = self.htn_definition.get_triage_htn().to_numpy(dtype=bool)
+        weights = self.get_weights().to_numpy(dtype=float)
+
+        # columns to calculate stats on
+        X = self.df[names].to_numpy(dtype=float)
+
+        # make sure they're binary columns of 0/1 values
+        for j, name in enumerate(names):
+            assert set(np.unique(X[:, j])) == {
+                0, 1}, f"{name}, does not seem to be binary"
+
+        # (3 x rows) weights of all patients, patients without htn and
+        # patients with htn
+        group_weights = np.stack(
+            [weights, weights * ~has_htn, weights * has_htn])
+        positives = group_weights @ X  # 3 x queries
+        group_totals = group_weights.sum(axis=1)[:, None]
+        n_total, n_nohtn, n_htn = positives
+        proportions = positives / group_totals
+
+        # chi2 of htn vs no htn
+        p_values = chi2_2x2(
+            n_htn, group_totals[2] - n_htn, n_nohtn, group_totals[1] - n_nohtn)
 
         # all values reported as millions or proportions
-        table = pd.DataFrame({
-            'n_total': sum(col * weights) / 1e6,
-            'n_nohtn': sum(ser2 * weights[ser2.index]) / 1e6,
-            'n_htn': sum(ser1 * weights[ser1.index]) / 1e6,
+        return pd.DataFrame({
+            'n_total': n_total / 1e6,
+            'n_nohtn': n_nohtn / 1e6,
+            'n_htn': n_htn / 1e6,
             # proportion of patients of the category
-            'proportion_total': weighted_proportion(col, weights),
+            'proportion_total': proportions[0],
             # proportion of patients of the category and no HTN
-            'proportion_nohtn': weighted_proportion(ser2, weights2),
+            'proportion_nohtn': proportions[1],
             # proportion of patients of the category and WITH HTN
-            'proportion_htn': weighted_proportion(ser1, weights1),
-            'p_value': p_value
-        }, index=[query.column_name])
-        return table
+            'proportion_htn': proportions[2],
+            'p_value': p_values
+        }, index=names)
 
     def process_multinomial_query(self, query):
+        '''
+        Stats rows for each category of a column, in the order the
+        categories first appear (a missing value gets an all zero row).
+        Everything comes from the category codes: one weighted bincount
+        per group gives the whole contingency table.
+        '''
         print(f'Processing query - {query.column_name}, {query.kind}')
         col = self.df[query.column_name]
-        weights = self.get_weights()
-        has_htn = self.htn_definition.get_triage_htn()
-        # htn patients
-        ser1 = self.df.loc[has_htn, query.column_name]
-        weights1 = weights[ser1.index]
-        # no htn patients
-        ser2 = self.df.loc[~has_htn, query.column_name]
-        weights2 = weights[ser2.index]
-        # indexing weights is addressed in the weighted_chi2 function
-        contingency_table = weighted_contingency(ser1, ser2, weights)
-        _, p_value, _, _ = chi2_contingency(contingency_table)
-
-        table = pd.DataFrame()
-
-        for category in col.unique():
-            new_row = pd.DataFrame({
-                'n_total': sum((col == category) * weights) / 1e6,
-                'n_nohtn': sum((ser2 == category) * weights[ser2.index]) / 1e6,
-                'n_htn': sum((ser1 == category) * weights[ser1.index]) / 1e6,
-                # proportion of patients of the category
-                'proportion_total': weighted_proportion((col == category), weights),
-                # proportion of patients of the category and WITHOUT HTN
-                'proportion_nohtn': weighted_proportion((ser2 == category), weights2),
-                # proportion of patients of the category and WITH HTN
-                'proportion_htn': weighted_proportion((ser1 == category), weights1),
-                'p_value': p_value
-            }, index=[query.column_name + '_' + str(category)])
-            table = pd.concat([table, new_row])
-        return table
+        if not isinstance(col.dtype, pd.CategoricalDtype):
+            col = col.astype('category')
+        categories = col.cat.categories
+        codes = col.cat.codes.to_numpy()
+        weights = self.get_weights().to_numpy(dtype=float)
+        has_htn = self.htn_definition.get_triage_htn().to_numpy(dtype=bool)
+
+        # weighted counts per category of all, htn and no htn patients
+        n_total = weighted_category_counts(codes, weights, len(categories))
+        n_htn = weighted_category_counts(
+            codes[has_htn], weights[has_htn], len(categories))
+        n_nohtn = weighted_category_counts(
+            codes[~has_htn], weights[~has_htn], len(categories))
+
+        contingency_table = pd.DataFrame(
+            {'ser1': n_htn, 'ser2': n_nohtn}, index=categories)
+        # categories nobody is in would make chi2_contingency fail
+        _, p_value, _, _ = chi2_contingency(
+            contingency_table[contingency_table.sum(axis=1) > 0])
+
+        # rows in order of appearance, code -1 (missing) picks the
+        # trailing zero
+        order = pd.unique(codes)
+        labels = np.append(np.asarray(categories, dtype=object), np.nan)
+        n_total, n_htn, n_nohtn = [
+            np.append(counts, 0.0)[order] for counts in [n_total, n_htn, n_nohtn]]
+
+        return pd.DataFrame({
+            'n_total': n_total / 1e6,
+            'n_nohtn': n_nohtn / 1e6,
+            'n_htn': n_htn / 1e6,
+            # proportion of patients of the category
+            'proportion_total': n_total / weights.sum(),
+            # proportion of patients of the category and WITHOUT HTN
+            'proportion_nohtn': n_nohtn / weights[~has_htn].sum(),
+            # proportion of patients of the category and WITH HTN
+            'proportion_htn': n_htn / weights[has_htn].sum(),
+            'p_value': p_value
+        }, index=[query.column_name + '_' + str(category)
+                  for category in labels[order]])
 
     def build_stats_table(self):
         '''
@@ -136,14 +168,19 @@ class CategoricalStats():
             'p_value': np.NAN
         }, index=['TOTALS'])
 
+        # all the binomial queries in one batch, the rows are put back in
+        # the order of the queries
+        binomial = [q for q in self.queries if q.kind == 'binomial']
+        if binomial:
+            binomial_rows = self.process_binomial_queries(binomial)
+
+        tables = [table]
         for q in self.queries:
             if q.kind == 'binomial':
-                new_rows = self.process_binomial_query(q)
-                table = pd.concat([table, new_rows])
+                tables.append(binomial_rows.loc[[q.column_name]])
             else:
-                new_rows = self.process_multinomial_query(q)
-                table = pd.concat([table, new_rows])
-        return table
+                tables.append(self.process_multinomial_query(q))
+        return pd.concat(tables)
 
     def get_stats(self):
         return self.stats_table
@@ -176,8 +213,7 @@ class Query():
 
 
 if __name__ == "__main__":
-    df = pd.read_pickle(
-        ('./outputs/working_dataframe.pkl'))
+    df = load_working_dataframe()
 
     queries = {
         'SEX': 'multinomial',
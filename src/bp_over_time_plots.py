@@ -7,6 +7,8 @@ from stats import (
     weighted_proportion
 )
 from blood_pressure import Htn_definition
+from shared_dataset import load_working_dataframe
+from feature_registry import select_columns
 
 pd.set_option('display.max_columns', None)  # None means unlimited
 pd.set_option('display.width', None)
@@ -143,6 +145,7 @@ def plot_htn_proportion_over_time(df, htn_definition, ax):
 
 
 def build_time_series_multiplot(df, htn_definition):
+    df = select_columns(df, ['YEAR', 'BPSYS', 'BPDIAS', 'PATWT'])
     fig = plt.figure(figsize=(14, 10))
     gspec = gs.GridSpec(2, 2)
     ax0 = plt.subplot(gspec[0, :])
@@ -157,7 +160,7 @@ def build_time_series_multiplot(df, htn_definition):
 
 
 if __name__ == "__main__":
-    df = pd.read_pickle('./outputs/working_dataframe.pkl')
+    df = load_working_dataframe()
     htn_definition = Htn_definition(df, sbp_cutoff=120, dbp_cutoff=80)
 
     build_time_series_multiplot(df, htn_definition)
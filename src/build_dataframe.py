@@ -16,14 +16,31 @@ https://www.cdc.gov/nchs/ahcd/datasets_documentation_related.htm
 '''
 import pandas as pd
 import numpy as np
-import re
+import os
 import glob
+import re
+import hashlib
+import json
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
 from antihypertensive_list import import_modified_hypertensive_list
 from download_and_unzip_NHAMCS_files import FileDownloader
-if __name__ == "__main__":
-    from utility_functions import map_timerange, diagnosis_filter
-else:
-    from src.utility_functions import map_timerange, diagnosis_filter
+from column_cache import ColumnCache
+from feature_registry import FeatureRegistry, FeatureFrame
+from row_filters import RowFilter, filter_expression
+from vocabulary_matching import (
+    vocabulary_indicators, code_matrix, any_match, PrefixClassifier)
+from schema import WORKING_SCHEMA, apply_schema, memory_audit
+from shared_dataset import (
+    export_shared_dataset, export_shared_batches, WORKING_PICKLE)
+from medication_index import MedicationIndex
+from medication_table import (
+    MedicationTable, EMPTY_SLOT_LABELS, get_slot_columns)
+from utility_functions import (
+    bin_timerange, parse_distinct, recode_categories, concat_categorical,
+    concat_memory_report)
 
 cardiac_arrest_ICD = [
     r'^Cardiac arrest',
@@ -60,57 +77,316 @@ hypertensive_emergency_ICD = [
     r'^Hypertensive crisis'
 ]
 
+# diagnosis outcome groups, each is a list of anchored prefixes of the DIAG
+# labels (case insensitive). A new outcome group only needs a new entry.
+outcome_ICD = {
+    'STROKE': stroke_ICD,
+    'MI': cardiac_arrest_ICD,
+    'HTNEMERGENCY': hypertensive_emergency_ICD,
+}
+
+# reason for visit regexes (case insensitive) for the visit type columns
+visit_type_RFV = {
+    'DYSPNEA_VISIT': 'shortness of breath|dyspnea',
+    'CHEST_PAIN_VISIT': 'chest pain',
+    'ABDOMINAL_PAIN_VISIT': 'abdominal pain',
+}
+
+# GPMED values that mean a medication was given in the ED / prescribed
+GPMED_STATUS = {
+    'given': ['Given in  ED', 'Both given and RX marked'],
+    'rx': ['RX at discharge', 'Both given and RX marked'],
+}
+
+
+DIAG_COLUMNS = ['DIAG1', 'DIAG2', 'DIAG3', 'DIAG4', 'DIAG5']
+RFV_COLUMNS = ['RFV1', 'RFV2', 'RFV3', 'RFV4', 'RFV5']
+# med columns (MED1-MED30)
+MED_COLUMNS = [f'MED{i}' for i in range(1, 31)]
+# given/prescribed indicator (GPMED1-GPMED30)
+GPMED_COLUMNS = [f'GPMED{i}' for i in range(1, 31)]
 
-def validate_data():
-    expected_files = [
-        'ed2015-spss.pkl', 'ed2016-spss.pkl', 'ED2017-spss.pkl',
-        'ED2018-spss.pkl', 'ED2019-spss.pkl', 'ed2020-spss.pkl',
-        'ed2021-spss.pkl'
+# raw columns used to build the working dataframe
+keep_columns = [
+    'YEAR', 'VMONTH', 'VDAYR', 'ARRTIME', 'AGE', 'SEX', 'RACERETH', 'CPR',
+    'ADMITHOS', 'ADISP', 'REGION', 'MSA', 'PAYTYPER', 'BPSYS', 'BPSYSD', 'PULSE',
+    'BPDIAS', 'BPDIASD', 'XRAY', 'HTN', 'ARREMS', 'HDSTAT', 'DOA', 'DIEDED', 'LOS', 'LOV',
+    'LUMBAR', 'MRI', 'CATSCAN', 'CBC', 'CARDENZ', 'PAINSCALE', 'IMMEDR',
+    'ATTPHYS',
+    'RESINT', 'NURSEPR', 'PHYSASST', 'CSTRATM', 'CPSUM', 'PATWT',
+    'DIAG1', 'DIAG2', 'DIAG3', 'DIAG4', 'DIAG5', 'RFV1', 'RFV2', 'RFV3', 'RFV4', 'RFV5',
+    'NOFU', 'RETRNED', 'RETREFFU', 'LEFTAMA', 'LWBS', 'TRANNH','TRANPSYC','TRANOTH','OBSHOS','OBSDIS','OTHDISP'
     ]
-    globbed_files = glob.glob('./data/pickled_files/*')
-    val = True
-    for file in expected_files:
-        is_in_glob = False
-        for gfile in globbed_files:
-            if file in gfile:
-                is_in_glob = True
-        val = is_in_glob & val
-    return val
+
+raw_columns = keep_columns + MED_COLUMNS + GPMED_COLUMNS
+
+# labels that are spelled differently between years, harmonised when the
+# years are concatenated so the columns keep a single category set
+category_codebook = {
+    'PAYTYPER': {
+        'No charge/charity': 'No charge/Charity',
+        'All sources for payment are blank': 'All sources of payment are blank',
+    },
+    'IMMEDR': {
+        'Visit occured in ESA that does not conduct nursing triage':
+            'Visit occurred in ESA that does not conduct nursing triage',
+    },
+    'BPDIAS': {'P, Palp, DOP or DOPPLER': 'P, Palp, DOPP or DOPPLER'},
+    'BPDIASD': {'P, Palp, DOP or DOPPLER': 'P, Palp, DOPP or DOPPLER'},
+}
+
+# columns that were renamed (with some coding changes) in 2008, the old name
+# is read as the new one for years that have it. Old spellings of the labels
+# go in category_codebook.
+COLUMN_ALIASES = {
+    'RACEETH': 'RACERETH',
+    'IMMED': 'IMMEDR',
+    'PAYTYPE': 'PAYTYPER',
+}
+
+# how the labels of the raw categorical columns are cleaned for the working
+# dataframe, {column: {label: new label}} applied to the categories with
+# recode_categories. NaN means missing, the key None fills missing values.
+BP_BLANKS = {
+    'Blank': np.nan,
+    'P, Palp, DOP or DOPPLER': np.nan,
+    'P, Palp, DOPP or DOPPLER': np.nan,
+}
+RECODES = {
+    'BPSYS': {'Blank': np.nan},
+    'BPSYSD': {'Blank': np.nan},
+    'BPDIAS': BP_BLANKS,
+    'BPDIASD': BP_BLANKS,
+    'PULSE': {'DOPP or DOPPLER': np.nan, 'Blank': np.nan},
+    # LOV is ED length of stay - even for admitted patients in mins
+    'LOV': {'Blank': np.nan},
+    # LOS is hospital lenght of stay in days
+    # replacing blank AND NA with nans. Might need to investigate further.
+    'LOS': {'Not Applicable': np.nan, 'Blank': np.nan},
+    # arrived by EMS
+    'ARREMS': {'Blank': 'Unknown', None: 'Unknown'},
+    'PAYTYPER': {
+        'No charge/Charity': 'No charge',
+        'No charge/charity': 'No charge',
+        'All sources for payment are blank': 'Blank',
+        'All sources of payment are blank': 'Blank',
+        'Medicaid':  'Medicaid or CHIP or other state-based program',
+        'Medicaid or CHIP':  'Medicaid or CHIP or other state-based program'},
+    'IMMEDR': {
+        '1-14 min': 'Emergent',
+        '15-60 min': 'Urgent',
+        '>1hr-2hrs': 'Semi-urgent',
+        '>2hrs-24hrs': 'Nonurgent',
+        'Blank': 'Unknown',
+        'No triage': 'Unknown',
+        'No triage for this visit but ESA does conduct triage': 'Unknown',
+        'Visit occured in ESA that does not conduct nursing triage': 'Unknown',
+        'Visit occurred in ESA that does not conduct nursing triage': 'Unknown'
+    },
+}
+
+
+# NHAMCS release for each year, adding a year here is all that is needed to
+# ingest it (see build_dataframe)
+BASE_URL = "https://ftp.cdc.gov/pub/Health_Statistics/NCHS/dataset_documentation/nhamcs/spss/"
+NHAMCS_FILES = {
+    2015: 'ed2015-spss.zip',
+    2016: 'ed2016-spss.zip',
+    2017: 'ED2017-spss.zip',
+    2018: 'ED2018-spss.zip',
+    2019: 'ED2019-spss.zip',
+    2020: 'ed2020-spss.zip',
+    2021: 'ed2021-spss.zip',
+}
+DOWNLOAD_DIRECTORY = './data/'
+PARQUET_DIRECTORY = os.path.join(DOWNLOAD_DIRECTORY, 'parquet_files')
+WORKING_DIRECTORY = './outputs/working_partitions'
+# rough number of copies of a raw chunk tweak_df holds in memory at once
+TRANSFORM_OVERHEAD = 4
+
+
+def get_parquet_file(year):
+    return os.path.join(
+        PARQUET_DIRECTORY, NHAMCS_FILES[year].replace('.zip', '.parquet'))
+
+
+def validate_data(years=None):
+    '''
+    True if the parquet file of every year (default all NHAMCS_FILES) exists
+    '''
+    years = sorted(NHAMCS_FILES) if years is None else years
+    return all(os.path.exists(get_parquet_file(year)) for year in years)
+
+
+def download_years(years):
+    '''
+    download and convert the given years, years that are already on disk
+    are skipped by the FileDownloader
+    '''
+    downloader = FileDownloader(
+        BASE_URL, [NHAMCS_FILES[year] for year in years], DOWNLOAD_DIRECTORY)
+    downloader.run()
+
+
+def resolve_columns(file, columns=None):
+    '''
+    returns (columns to read from the parquet file, {old name: new name}
+    renames for the columns in COLUMN_ALIASES)
+    '''
+    available = pq.read_schema(file).names
+    renames = {
+        old: new for old, new in COLUMN_ALIASES.items()
+        if old in available and new not in available
+    }
+    if columns is not None:
+        current_names = {new: old for old, new in renames.items()}
+        columns = [
+            current_names.get(col, col) for col in columns
+            if col in available or col in current_names
+        ]
+    return columns, renames
 
 
-def load_dfs(as_list=False, force_download=False):
+def read_year(file, columns=None, row_filters=None):
     '''
-    Load the data from the pickled files. The pickled files load and are
-    processed faster than the raw spss ones - so this is mainly an efficiency
-    convenience.
+    read a single year parquet file. If columns is given only those columns
+    are read from disk (columns a year doesn't have are skipped). Columns
+    in COLUMN_ALIASES are read under their current name.
+
+    row_filters (see the row_filters module) are applied by the parquet
+    reader, only the rows that pass them are loaded.
+    '''
+    columns, renames = resolve_columns(file, columns)
+    expression = plan_row_filters(file, row_filters, renames)
+    return pd.read_parquet(file, columns=columns, filters=expression).rename(
+        columns=renames)
+
+
+def plan_row_filters(file, row_filters, renames):
+    if not row_filters:
+        return None
+    disk_names = {new: old for old, new in renames.items()}
+    return filter_expression(file, row_filters, disk_names)
+
+
+def load_dfs(columns=None, years=None, as_list=False, force_download=False,
+             row_filters=None):
+    '''
+    Load the data from the yearly parquet files (default all years in
+    NHAMCS_FILES). Pass a list of columns to read only those columns rather
+    than the full survey (e.g. raw_columns for building the working
+    dataframe).
+
+    The years are concatenated with concat_categorical so that categorical
+    columns stay categorical even though their labels vary between years
+    (see concat_memory_report for the memory difference).
+
+    row_filters is an optional list of RowFilters (e.g. STUDY_FILTERS) that
+    are pushed down into the parquet reader.
 
     If the files are not found in the directory, then they are downloaded
     and unzipped first
     '''
-    if validate_data() and not force_download:
-        files = glob.glob('./data/pickled_files/*')
+    years = sorted(NHAMCS_FILES) if years is None else sorted(years)
+    if validate_data(years) and not force_download:
         dfs = []
-        for file in files:
-            df = pd.read_pickle(file)
-            df = df.dropna(axis=1, how='all')
+        for year in years:
+            file = get_parquet_file(year)
+            df = read_year(file, columns, row_filters)
+            if row_filters:
+                # all missing in the year, not just in the filtered rows
+                df = df.drop(columns=get_empty_columns(file) & set(df.columns))
+            else:
+                df = df.dropna(axis=1, how='all')
             dfs.append(df)
         if as_list:
             return dfs
-        return pd.concat(dfs, axis=0)
+        return concat_categorical(dfs, category_codebook)
     else:
         # if the files don't exist, then download them and then rerun the function
-        base_url = "https://ftp.cdc.gov/pub/Health_Statistics/NCHS/dataset_documentation/nhamcs/spss/"
-        files_to_download = [
-            'ed2015-spss.zip', 'ed2016-spss.zip', 'ED2017-spss.zip',
-            'ED2018-spss.zip', 'ED2019-spss.zip', 'ed2020-spss.zip',
-            'ed2021-spss.zip'
-        ]
-        download_directory = './data/'
+        download_years(years)
+        return load_dfs(columns=columns, years=years, as_list=as_list,
+                        row_filters=row_filters)
 
-        downloader = FileDownloader(
-            base_url, files_to_download, download_directory)
-        downloader.run()
-        return load_dfs()
+
+def get_empty_columns(file):
+    '''
+    columns that are missing in every row of the parquet file, from the row
+    group statistics (the same columns load_dfs drops with dropna)
+    '''
+    metadata = pq.ParquetFile(file).metadata
+    null_counts = {}
+    for rg in range(metadata.num_row_groups):
+        row_group = metadata.row_group(rg)
+        for idx in range(row_group.num_columns):
+            column = row_group.column(idx)
+            name = column.path_in_schema
+            stats = column.statistics
+            if stats is None or not stats.has_null_count:
+                null_counts[name] = -1  # unknown, keep it
+            elif null_counts.get(name, 0) >= 0:
+                null_counts[name] = null_counts.get(name, 0) + stats.null_count
+    # columns that were all None when written are stored with a null type
+    null_typed = {field.name for field in pq.read_schema(file)
+                  if pa.types.is_null(field.type)}
+    return null_typed | {name for name, nulls in null_counts.items()
+                         if nulls == metadata.num_rows}
+
+
+def get_chunk_rows(file, columns, memory_budget):
+    '''
+    number of raw rows per chunk so that building a chunk stays within
+    memory_budget bytes. The size of a row is measured on a sample of the
+    file, tweak_df holds about TRANSFORM_OVERHEAD copies of it at once.
+    '''
+    parquet_file = pq.ParquetFile(file)
+    sample = next(parquet_file.iter_batches(batch_size=1000, columns=columns))
+    sample_df = sample.to_pandas()
+    bytes_per_row = sample_df.memory_usage(deep=True).sum() / len(sample_df)
+    return max(1000, int(memory_budget / (TRANSFORM_OVERHEAD * bytes_per_row)))
+
+
+def iter_raw_chunks(year, columns=None, memory_budget=None, row_filters=None):
+    '''
+    Generator of the raw data of a year in chunks of rows, each chunk has
+    the columns and labels load_dfs would give. With memory_budget=None the
+    whole year is a single chunk.
+
+    row_filters are pushed down into the reader, rows that don't pass them
+    are never loaded.
+    '''
+    if memory_budget is None:
+        yield load_dfs(columns=columns, years=[year], row_filters=row_filters)
+        return
+
+    file = get_parquet_file(year)
+    columns, renames = resolve_columns(file, columns)
+    empty = get_empty_columns(file)
+    columns = [col for col in (columns or pq.read_schema(file).names)
+               if col not in empty]
+    batch_size = get_chunk_rows(file, columns, memory_budget)
+    batches = ds.dataset(file, format='parquet').to_batches(
+        columns=columns, batch_size=batch_size,
+        filter=plan_row_filters(file, row_filters, renames))
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        df = batch.to_pandas().rename(columns=renames)
+        yield concat_categorical([df], category_codebook)
+
+
+def get_visit_types(df, visit_types):
+    '''
+    takes as input the NHAMCS dataframe and a dict of {column name: regex}
+    and returns a 0/1 dataframe with a column per visit type that is 1 where
+    the regex matches any of the reason for visit columns.
+
+    Each regex is evaluated once per distinct RFV value (see the
+    vocabulary_matching module), not once per row.
+    '''
+    rfv_columns = [
+        col for col in df.columns if re.search(r'RFV\d+(?![^$])', col)]
+    return vocabulary_indicators(df, rfv_columns, visit_types).astype(int)
 
 
 def get_RFV_filter(df, regex):
@@ -118,18 +394,69 @@ def get_RFV_filter(df, regex):
     takes as input the NHAMCS dataframe and a regex that should indicate a
     diagnosis, such as back pain, and it will return a binary filter where
     this is matching over all of the reason for visit columns
+    '''
+    return get_visit_types(df, {'match': regex})['match'].astype(bool)
 
-    Note that this is quite an inefficient function (string searching over
-    many many rows)
+
+def get_diagnoses(df, outcome_groups):
     '''
-    return (
-        df
-        # get the RFV columns
-        .loc[:, [col for col in df.columns if re.search(r'RFV\d+(?![^$])', col)]]
-        # search strings for the regex and combine columns such that any are true
-        .apply(lambda row: row.str.contains(regex, regex=True, case=False))
-        .any(axis=1)
-    )
+    takes as input the NHAMCS dataframe and a dict of {column name: list of
+    ICD prefix patterns} and returns a boolean dataframe with a column per
+    outcome group that is true where any DIAG column starts with one of
+    the group's patterns.
+
+    All groups are compiled into one PrefixClassifier and evaluated once per
+    distinct diagnosis.
+    '''
+    codes, vocabulary = code_matrix(df, DIAG_COLUMNS)
+    hits = PrefixClassifier(outcome_groups).classify(vocabulary)
+    return pd.DataFrame(any_match(codes, hits), index=df.index,
+                        columns=list(outcome_groups))
+
+
+def get_medication_indicators(df, medication_queries,
+                              gpmed_status=GPMED_STATUS,
+                              empty_labels=EMPTY_SLOT_LABELS):
+    '''
+    Based on a dict of {column name: (rx_type, med_list)} this function
+    takes as input the NHAMCS dataset and returns a 0/1 dataframe with a
+    column per query that is 1 if a medication in med_list was given or
+    prescribed (based on rx_type, a key of gpmed_status e.g. 'rx' or
+    'given'). empty_labels are the MED labels that mean an empty slot.
+
+    Each med list is matched once per distinct medication name, GPMED is
+    encoded as a small integer code, and all queries are then answered in
+    one vectorized pass over the filled medication slots (see the
+    medication_table module).
+
+    df can also be a MedicationTable of the visits.
+    '''
+    if isinstance(df, MedicationTable):
+        table, index = df, pd.RangeIndex(df.n_visits)
+    else:
+        table = MedicationTable.from_dataframe(df, empty_labels)
+        index = df.index
+
+    # one regex per distinct med list used by the queries
+    med_patterns = list(dict.fromkeys(
+        '|'.join(med_list) for _, med_list in medication_queries.values()))
+    rx_types = list(gpmed_status)
+
+    med_hits = table.match_meds(med_patterns)
+    gp_hits = np.column_stack([
+        table.match_status(gpmed_status[rx_type]) for rx_type in rx_types])
+
+    # (rows x med lists x rx types)
+    matched = table.any_given(med_hits, gp_hits)
+
+    indicators = pd.DataFrame(index=index)
+    for name, (rx_type, med_list) in medication_queries.items():
+        indicators[name] = matched[
+            :,
+            med_patterns.index('|'.join(med_list)),
+            rx_types.index(rx_type)
+        ].astype(int)
+    return indicators
 
 
 def get_MED_filter(df, rx_type, med_list):
@@ -138,240 +465,552 @@ def get_MED_filter(df, rx_type, med_list):
     and returns a binary indicator about if a medication was given or
     prescribed (based on the rx_type argument ('rx' or 'given')).
     '''
-    # med cols
-    MED = df[[col for col in df.columns if re.search(r'^MED\d', col)]]
-    # med rx/given cols
-    GPMED = df[[col for col in df.columns if re.search(r'GPMED\d', col)]]
-    # first figure out where each med number (e.g. MED1) was prescibed
-    # or given
-    # rx_filter is a boolean indicator for given/rx
-    if rx_type == 'rx':
-        rx_filter = (
-            (GPMED == 'RX at discharge')
-            |
-            (GPMED == 'Both given and RX marked')
-        )
-    elif rx_type == 'given':
-        rx_filter = (
-            (GPMED == 'Given in  ED')
-            |
-            (GPMED == 'Both given and RX marked')
-        )
+    return get_medication_indicators(
+        df, {'match': (rx_type, med_list)})['match'].astype(bool)
 
-    # where a med was rx/given, keep the med, otherwise change to a
-    # null value ('NO ENTRY MADE')
-    med_filter = np.where(rx_filter, MED, 'NO ENTRY MADE')
-    F = (
-        # make the dataframe
-        pd.DataFrame(med_filter, index=df.index)
-        # rename the columns since we used a numpy method here
-        .rename(columns={x: y for x, y in enumerate(MED)})
-        # return true only if the med is in the med list
-        .apply(
-            lambda row: row.str.contains('|'.join(med_list),
-                                         case=False,
-                                         regex=True),
-            axis=1)
-        # return the row true if the med was given for a patient/observation
-        .any(axis=1)
-    )
 
-    return F
+def get_medication_queries():
+    '''
+    {column name: (rx_type, med_list)} for the medication indicators
+    '''
+    # get the med list based on antihypertensive_med module
+    ANTIHYPERTENSIVE_MEDS = import_modified_hypertensive_list()
+    return {
+        'TYLENOL_GIVEN': ('given', ['tylenol', 'acetaminophen']),
+        'ANTIHYPERTENSIVE_GIVEN': ('given', ANTIHYPERTENSIVE_MEDS),
+        'ANTIHYPERTENSIVE_RX': ('rx', ANTIHYPERTENSIVE_MEDS),
+    }
+
+
+def recoded(df, column):
+    '''
+    column with its RECODES applied, as a categorical
+    '''
+    return recode_categories(df[column], RECODES[column])
+
+
+def recoded_numeric(df, column):
+    '''
+    column with its RECODES applied (which drop the sentinel labels) as
+    floats, converted once per category
+    '''
+    return parse_distinct(recoded(df, column),
+                          lambda ser: ser.astype('float'))
+
+
+# Derived columns of the working dataframe, see the feature_registry module.
+# They are registered in the order they are added to the working dataframe,
+# a feature sees a column as it was at that point (e.g. ADMITS_COMBINED reads
+# the raw 'Yes'/'No' ADMITHOS, which is made a bool further down).
+FEATURES = FeatureRegistry()
+# ARRTIME, AGE, PULSE, the BPs and LOV have few distinct labels, each label
+# is parsed once (see parse_distinct)
+FEATURES.add('VTIME', ['ARRTIME'], lambda df: parse_distinct(
+    df.ARRTIME, lambda ser: pd.to_datetime(ser.replace({
+        'Unknown': np.NaN,
+        '12:00 Midnight': '00:00 a.m.',
+        '12:00 noon': '12:00 p.m.'}), format='mixed')))
+FEATURES.add('VTIMER', ['VTIME'], lambda df: pd.Series(
+    bin_timerange(df.VTIME.dt.hour), index=df.index).astype('category'))
+FEATURES.add('CBC', ['CBC'], lambda df: (df.CBC == 'Yes').astype(int))
+FEATURES.add('TROPONIN', ['CARDENZ'],
+             lambda df: (df.CARDENZ == 'Yes').astype(int))
+FEATURES.add('XRAY', ['XRAY'], lambda df: (df.XRAY == 'Yes').astype(int))
+FEATURES.add('MRI', ['MRI'], lambda df: (df.MRI == 'Yes').astype(int))
+FEATURES.add('CATSCAN', ['CATSCAN'],
+             lambda df: (df.CATSCAN == 'Yes').astype(int))
+FEATURES.add('ATTENDING', ['ATTPHYS'],
+             lambda df: (df.ATTPHYS == 'Yes').astype(int))
+FEATURES.add('RESIDENT', ['RESINT'],
+             lambda df: (df.RESINT == 'Yes').astype(int))
+FEATURES.add('AGE_BIN', ['AGE'], lambda df: pd.cut(
+    df.AGE,
+    bins=[17, 25, 44, 65, 110],
+    labels=['Age 18-25', 'Age 26-44', 'Age 45-65', 'Age over 65']
+).astype('category'))
+FEATURES.add(
+    'ADMITS_COMBINED',
+    ['ADMITHOS', 'TRANNH', 'TRANPSYC', 'TRANOTH', 'OBSHOS', 'OBSDIS'],
+    lambda df: (
+        (df.ADMITHOS == 'Yes') |
+        (df.TRANNH == 'Yes') |
+        (df.TRANPSYC == 'Yes') |
+        (df.TRANOTH == 'Yes') |
+        (df.OBSHOS == 'Yes') |
+        (df.OBSDIS == 'Yes')
+    ))
+FEATURES.add(
+    'DISCHARGED_COMBINED',
+    ['ADMITS_COMBINED', 'NOFU', 'RETRNED', 'RETREFFU', 'DIEDED'],
+    lambda df: ~df.ADMITS_COMBINED & (
+        (df.NOFU == 'Yes') |
+        (df.RETRNED == 'Yes') |
+        (df.RETREFFU == 'Yes') |
+        (df.DIEDED == 'Yes')
+    ))
+FEATURES.add('LEFT_AMA', ['LEFTAMA'], lambda df: df.LEFTAMA == 'Yes')
+FEATURES.add('LWBS', ['LWBS'], lambda df: df.LWBS == 'Yes')
+# make ADMITHOS a binary variable
+FEATURES.add('ADMITHOS', ['ADMITHOS'], lambda df: df.ADMITHOS.replace(
+    {'Yes': 1, 'No': 0}).astype(bool))
+FEATURES.add('PULSE', ['PULSE'], lambda df: recoded_numeric(df, 'PULSE'))
+FEATURES.add('TRIAGE_TACHYCARDIA', ['PULSE'], lambda df: df.PULSE > 100)
+# drop the 'Blank' values in BPSYS, BPSYSD, BPDIAS, BPDIASD, PULSE
+# also fix the type to be float
+for column in ['BPSYS', 'BPSYSD', 'BPDIAS', 'BPDIASD']:
+    FEATURES.add(column, [column],
+                 lambda df, column=column: recoded_numeric(df, column))
+FEATURES.add('SBP_BIN', ['BPSYS'], lambda df: pd.cut(
+    df.BPSYS,
+    bins=[59, 79, 99, 119, 139, 159, 179, 199, 219],
+    labels=[
+        'SBP 60-80',
+        'SBP 80-100',
+        'SBP 100-120',
+        'SBP 120-140',
+        'SBP 140-160',
+        'SBP 160-180',
+        'SBP 180-200',
+        'SBP 200-220',
+        ]
+).astype('category'))
+# if pt has history of hypertension
+FEATURES.add('HX_HTN', ['HTN'], lambda df: (df.HTN == 'Yes').astype(int))
+# if the patient has a null value for triage blood pressure
+# (systolic or diastolic)
+FEATURES.add('NO_TRIAGE_BP', ['BPSYS', 'BPDIAS'],
+             lambda df: df.BPSYS.isna() | df.BPDIAS.isna())
+# CREATE CARDIOVASCULAR OUTCOME INDICATOR COLUMN
+# Create binary indicator for diagnosis of stroke, MI, or hypertensive
+# emergency, all outcome groups in one pass over the DIAGs. They share one
+# cache entry, so editing any ICD list recomputes the three (as cheap as one)
+FEATURES.add(list(outcome_ICD), DIAG_COLUMNS, get_diagnoses,
+             args=(outcome_ICD,), cached=True, name='DIAGNOSES')
+FEATURES.add('HTN_COMPLICATION', ['STROKE', 'MI', 'HTNEMERGENCY'],
+             lambda df: df.STROKE | df.MI | df.HTNEMERGENCY)
+# arrived by EMS
+FEATURES.add('ARREMS', ['ARREMS'], lambda df: recoded(df, 'ARREMS'))
+# pt died if they died in ED or died after admission
+# HDSTAT = hospital discharge status (blank, unknown, not avail,
+#     alive, dead
+# DOA = dead on arrival - removing this I don't think it's relavent
+FEATURES.add('DIED', ['HDSTAT', 'DIEDED'],
+             lambda df: (df.HDSTAT == 'Dead') | (df.DIEDED == 'Yes'))
+FEATURES.add('ED_LOS', ['LOV'], lambda df: recoded_numeric(df, 'LOV'))
+FEATURES.add('HOSP_LOS', ['LOS'], lambda df: recoded(df, 'LOS'))
+# combine 'NURSEPR','PHYSASST' to make midlevel filter
+FEATURES.add('MIDLEVEL', ['NURSEPR', 'PHYSASST'], lambda df: (
+    (df.NURSEPR == 'Yes') | (df.PHYSASST == 'Yes')).astype(int))
+FEATURES.add('PAYTYPER', ['PAYTYPER'], lambda df: recoded(df, 'PAYTYPER'))
+FEATURES.add('IMMEDR', ['IMMEDR'], lambda df: recoded(df, 'IMMEDR'))
+FEATURES.add('RACERETH', ['RACERETH'],
+             lambda df: df.RACERETH.astype('category'))
+# create visit type columns, all of them in one pass over the RFVs
+FEATURES.add(list(visit_type_RFV), RFV_COLUMNS, get_visit_types,
+             args=(visit_type_RFV,), cached=True, name='VISIT_TYPES')
+# create medication columns, all of them in one pass over MED/GPMED. The
+# label sets are passed as args so that they are part of the cache key.
+FEATURES.add(
+    ['TYLENOL_GIVEN', 'ANTIHYPERTENSIVE_GIVEN', 'ANTIHYPERTENSIVE_RX'],
+    MED_COLUMNS + GPMED_COLUMNS, get_medication_indicators,
+    args=lambda: (get_medication_queries(), GPMED_STATUS, EMPTY_SLOT_LABELS),
+    cached=True, name='MEDICATIONS')
+
+
+def parse_age(ser):
+    '''
+    fix categorical values in age and make dtype -> float
+    '''
+    return ser.replace({'93 years and over': 94.0,
+                        '94 years and over': 94.0,
+                        'Under one year': 0.0,
+                        '100 years and over': 100.0}).pipe(pd.to_numeric)
+
+
+def is_adult(age):
+    return age >= 18
+
 
+def is_study_year(year):
+    return year >= 2015
 
-def tweak_df(df):
+
+# the rows of the study, pushed down into the parquet reader when the
+# working dataframe is built so that the features are only computed for
+# these rows (prepare_base applies the same conditions again). The
+# predicates are module level functions so the filters can be sent to the
+# worker processes of a parallel build.
+STUDY_FILTERS = [
+    RowFilter('AGE', is_adult, parse=parse_age),
+    RowFilter('YEAR', is_study_year, parse=pd.to_numeric),
+]
+
+
+def prepare_base(df):
+    '''
+    Select the raw columns, fix YEAR and AGE and drop the rows that aren't
+    part of the study. The derived columns in FEATURES are computed from
+    this.
+    '''
     # med columns (MED1-MED30)
     MED = [col for col in df.columns if re.search(r'^MED\d', col)]
     # given/prescribed indicator (GPMED1-GPMED30)
     GPMED = [col for col in df.columns if re.search(r'GPMED\d', col)]
-    keep_columns = [
-        'YEAR', 'VMONTH', 'VDAYR', 'ARRTIME', 'AGE', 'SEX', 'RACERETH', 'CPR',
-        'ADMITHOS', 'ADISP', 'REGION', 'MSA', 'PAYTYPER', 'BPSYS', 'BPSYSD', 'PULSE',
-        'BPDIAS', 'BPDIASD', 'XRAY', 'HTN', 'ARREMS', 'HDSTAT', 'DOA', 'DIEDED', 'LOS', 'LOV',
-        'LUMBAR', 'MRI', 'CATSCAN', 'CBC', 'CARDENZ', 'PAINSCALE', 'IMMEDR',
-        'ATTPHYS',
-        'RESINT', 'NURSEPR', 'PHYSASST', 'CSTRATM', 'CPSUM', 'PATWT',
-        'DIAG1', 'DIAG2', 'DIAG3', 'DIAG4', 'DIAG5', 'RFV1', 'RFV2', 'RFV3', 'RFV4', 'RFV5',
-        'NOFU', 'RETRNED', 'RETREFFU', 'LEFTAMA', 'LWBS', 'TRANNH','TRANPSYC','TRANOTH','OBSHOS','OBSDIS','OTHDISP'
-        ] + MED + GPMED
-
-    # get the med list based on antihypertensive_med module
-    ANTIHYPERTENSIVE_MEDS = import_modified_hypertensive_list()
-
     return (
         df
-        .loc[:, keep_columns]
+        .loc[:, keep_columns + MED + GPMED]
         .assign(
             # fix types and replace values as needed
-            YEAR=lambda df: df.YEAR.astype(int),
-            VTIME=pd.to_datetime(
-                df.ARRTIME.replace({
-                    'Unknown': np.NaN,
-                    '12:00 Midnight': '00:00 a.m.',
-                    '12:00 noon': '12:00 p.m.'}), format='mixed'),
-            VTIMER=lambda df: df.VTIME.dt.hour.map(
-                map_timerange).astype('category'),
-            CBC=lambda df_: (df_.CBC == 'Yes').astype(int),
-            TROPONIN=lambda df: (df.CARDENZ == 'Yes').astype(int),
-            XRAY=lambda df_: (df_.XRAY == 'Yes').astype(int),
-            MRI=lambda df_: (df_.MRI == 'Yes').astype(int),
-            CATSCAN=lambda df_: (df_.CATSCAN == 'Yes').astype(int),
-            ATTENDING=lambda df: (df.ATTPHYS == 'Yes').astype(int),
-            RESIDENT=lambda df: (df.RESINT == 'Yes').astype(int),
-            # fix categorical values in age and make dtype -> int
-            AGE=lambda df: df.AGE.replace({'93 years and over': 94.0,
-                                           '94 years and over': 94.0,
-                                           'Under one year': 0.0,
-                                           '100 years and over': 100.0})
-            .pipe(pd.to_numeric),
-            AGE_BIN=lambda df: pd.cut(
-                df.AGE,
-                bins=[17, 25, 44, 65, 110],
-                labels=['Age 18-25', 'Age 26-44', 'Age 45-65', 'Age over 65']
-            ).astype('category'),
-            # make ADMITHOS a binary variable
-            ADMITS_COMBINED=lambda df: (
-                (df.ADMITHOS == 'Yes') |
-                (df.TRANNH == 'Yes') |
-                (df.TRANPSYC == 'Yes') |
-                (df.TRANOTH == 'Yes') |
-                (df.OBSHOS == 'Yes') |
-                (df.OBSDIS == 'Yes')
-            ),
-            DISCHARGED_COMBINED = lambda df: ~df.ADMITS_COMBINED & (
-                (df.NOFU == 'Yes') |
-                (df.RETRNED == 'Yes') |
-                (df.RETREFFU == 'Yes') |
-                (df.DIEDED == 'Yes')
-            ),
-            LEFT_AMA = lambda df: df.LEFTAMA == 'Yes',
-            LWBS = lambda df: df.LWBS == 'Yes',
-            ADMITHOS=lambda df: df.ADMITHOS.replace({'Yes': 1, 'No': 0}).astype(bool),
-            PULSE = lambda df: df.PULSE.replace(
-
-                {'DOPP or DOPPLER':np.nan, 'Blank':np.nan}
-            ),
-            TRIAGE_TACHYCARDIA = lambda df: df.PULSE > 100,
-            # replace 'Blank' values in BPSYS, BPSYSD, BPDIAS, BPDIASD, PULSE
-            # also fix the type to be float
-            BPSYS=lambda df: df.BPSYS.replace('Blank', np.nan).astype('float'),
-            BPSYSD=lambda df: df.BPSYSD.replace(
-                'Blank', np.nan).astype('float'),
-            BPDIAS=lambda df: df.BPDIAS.replace({
-                'Blank': np.nan,
-                'P, Palp, DOP or DOPPLER': np.nan,
-                'P, Palp, DOPP or DOPPLER': np.nan}).astype('float'),
-            BPDIASD=lambda df: df.BPDIASD.replace({
-                'Blank': np.nan,
-                'P, Palp, DOP or DOPPLER': np.nan,
-                'P, Palp, DOPP or DOPPLER': np.nan}).astype('float'),
-            SBP_BIN=lambda df: pd.cut(
-                df.BPSYS,
-                bins=[59, 79, 99, 119, 139, 159, 179, 199, 219],
-                labels=[
-                    'SBP 60-80',
-                    'SBP 80-100',
-                    'SBP 100-120',
-                    'SBP 120-140',
-                    'SBP 140-160',
-                    'SBP 160-180',
-                    'SBP 180-200',
-                    'SBP 200-220',
-                    ]
-            ).astype('category'),
-            # if pt has history of hypertension
-            HX_HTN=lambda df: (df.HTN == 'Yes').astype(int),
-            # if the patient has a null value for triage blood pressure
-            # (systolic or diastolic)
-            NO_TRIAGE_BP=lambda df: df.BPSYS.isna() | df.BPDIAS.isna(),
-            # CREATE CARDIOVASCULAR OUTCOME INDICATOR COLUMN
-            # Create binary indicator for diagnosis of stroke, MI, or hypertensive emergency
-            STROKE=lambda df: diagnosis_filter(df, '|'.join(stroke_ICD)),
-            MI=lambda df: diagnosis_filter(df, '|'.join(cardiac_arrest_ICD)),
-            HTNEMERGENCY=lambda df: diagnosis_filter(
-                df, '|'.join(hypertensive_emergency_ICD)),
-            HTN_COMPLICATION=lambda df: df.STROKE | df.MI | df.HTNEMERGENCY,
-            # arrived by EMS
-            ARREMS=lambda df: df.ARREMS.replace({
-                'Blank': 'Unknown'
-            }).fillna('Unknown').astype('category'),
-            # pt died if they died in ED or died after admission
-            # HDSTAT = hospital discharge status (blank, unknown, not avail,
-            #     alive, dead
-            # DOA = dead on arrival - removing this I don't think it's relavent
-            DIED=lambda df: (df.HDSTAT == 'Dead') | (df.DIEDED == 'Yes'),
-            # LOV is ED length of stay - even for admitted patients in mins
-            ED_LOS=lambda df: df.LOV.replace({'Blank': np.nan}).astype(float),
-            # LOS is hospital lenght of stay in days
-            # replacing blank AND NA with nans. Might need to investigate further.
-            HOSP_LOS=lambda df: df.LOS.replace({
-                'Not Applicable': np.nan,
-                'Blank': np.nan
-            }),
-            # combine 'NURSEPR','PHYSASST' to make midlevel filter
-            MIDLEVEL=lambda df: ((df.NURSEPR == 'Yes') | (
-                df.PHYSASST == 'Yes')).astype(int),
-            PAYTYPER=lambda df: (
-                df.PAYTYPER
-                .replace({
-                    'No charge/Charity': 'No charge',
-                    'No charge/charity': 'No charge',
-                    'All sources for payment are blank': 'Blank',
-                    'All sources of payment are blank': 'Blank',
-                    'Medicaid':  'Medicaid or CHIP or other state-based program',
-                    'Medicaid or CHIP':  'Medicaid or CHIP or other state-based program'})
-            ).astype('category'),
-            IMMEDR=lambda df: (
-                df.IMMEDR
-                .replace({
-                    '1-14 min': 'Emergent',
-                    '15-60 min': 'Urgent',
-                    '>1hr-2hrs': 'Semi-urgent',
-                    '>2hrs-24hrs': 'Nonurgent',
-                    'Blank': 'Unknown',
-                    'No triage': 'Unknown',
-                    'No triage for this visit but ESA does conduct triage': 'Unknown',
-                    'Visit occured in ESA that does not conduct nursing triage': 'Unknown',
-                    'Visit occurred in ESA that does not conduct nursing triage': 'Unknown'
-                })
-            ).astype('category'),
-
-            RACERETH=lambda df: df.RACERETH.astype('category'),
-            # create visit type columns
-            DYSPNEA_VISIT=lambda df_: get_RFV_filter(
-                df_, 'shortness of breath|dyspnea').astype(int),
-            CHEST_PAIN_VISIT=lambda df_: get_RFV_filter(
-                df_, 'chest pain').astype(int),
-            ABDOMINAL_PAIN_VISIT=lambda df_: get_RFV_filter(
-                df_, 'abdominal pain').astype(int),
-            TYLENOL_GIVEN=lambda df: get_MED_filter(
-                df, 'given', ['tylenol', 'acetaminophen']).astype(int),
-            ANTIHYPERTENSIVE_GIVEN=lambda df: get_MED_filter(
-                df, 'given', ANTIHYPERTENSIVE_MEDS).astype(int),
-            ANTIHYPERTENSIVE_RX=lambda df: get_MED_filter(
-                df, 'rx', ANTIHYPERTENSIVE_MEDS).astype(int),
-
+            YEAR=lambda df: pd.to_numeric(df.YEAR).astype(int),
+            AGE=lambda df: parse_distinct(df.AGE, parse_age),
         )
         .query('AGE >= 18')  # remove pediatric patients
         .query('YEAR >= 2015')  # remove years less than 2015
-        .drop(
-            ['NURSEPR', 'PHYSASST'], axis=1)
         # guarentee unique index values for future work/joins
         .reset_index(drop=True)
     )
 
 
-def build_dataframe(force_download=False):
-    raw_df = load_dfs(force_download=force_download)
-    df = tweak_df(raw_df)
-    raw_df.to_pickle('./outputs/working_raw_dataframe.pkl')
-    df.to_pickle('./outputs/working_dataframe.pkl')
+def tweak_df(df, cache=None, schema=WORKING_SCHEMA):
+    '''
+    Build the working dataframe from the raw concatenated years.
+
+    If a ColumnCache is given, the expensive RFV/MED/DIAG derived columns
+    are read from it when neither their definition nor their input columns
+    changed since the last build.
+
+    The result is cast to the compact dtypes in schema (see the schema
+    module), pass None to keep the dtypes pandas infers.
+    '''
+    return (
+        FeatureFrame(prepare_base(df), FEATURES, cache)
+        .to_frame()
+        .drop(
+            ['NURSEPR', 'PHYSASST'], axis=1)
+        .pipe(lambda df: df if schema is None else apply_schema(df, schema))
+    )
+
+
+def split_medications(df):
+    '''
+    move the wide MED/GPMED columns of a tweaked dataframe into a
+    MedicationTable, returns (df without them, table)
+    '''
+    table = MedicationTable.from_dataframe(df)
+    columns = get_slot_columns(df, 'MED') + get_slot_columns(df, 'GPMED')
+    return df.drop(columns, axis=1), table
+
+
+def load_feature_frame(years=None, cache_directory='./outputs/column_cache',
+                       row_filters=None):
+    '''
+    Lazy alternative to the working dataframe, a FeatureFrame over the raw
+    years that only computes the derived columns that are asked for.
+
+    row_filters is an optional list of RowFilters for a cohort, on top of
+    STUDY_FILTERS, e.g. [RowFilter('SEX', lambda sex: sex == 'Female')]
+
+    Example use:
+    frame = load_feature_frame()
+    htn_def = Htn_definition(frame, 160, 100)
+    stats = CategoricalStats(frame, {'CHEST_PAIN_VISIT': 'binomial'}, htn_def)
+    '''
+    years = sorted(NHAMCS_FILES) if years is None else sorted(years)
+    raw_df = load_dfs(columns=raw_columns, years=years,
+                      row_filters=STUDY_FILTERS + list(row_filters or []))
+    cache = None if cache_directory is None else get_column_cache(
+        os.path.join(cache_directory, '_'.join(str(year) for year in years)))
+    return FeatureFrame(prepare_base(raw_df), FEATURES, cache, WORKING_SCHEMA)
+
+
+# the modules tweak_df and split_medications compute the working partitions
+# with, besides this one. They all sit next to this module in src.
+PIPELINE_MODULES = [
+    'utility_functions', 'column_cache', 'feature_registry', 'row_filters',
+    'vocabulary_matching', 'schema', 'medication_table',
+    'antihypertensive_list',
+]
+PIPELINE_MODULE_FILES = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), f'{module}.py')
+    for module in PIPELINE_MODULES
+]
+PIPELINE_FILES = ([__file__] + PIPELINE_MODULE_FILES
+                  + ['./outputs/antihypertensive_list.xlsx'])
+
+
+def get_column_cache(cache_directory):
+    '''
+    ColumnCache whose entries also depend on the pipeline modules, the
+    helpers the cached features call (PrefixClassifier, code_matrix, ...)
+    live there. This module isn't one of them, so editing an ICD list only
+    invalidates the feature that uses it.
+    '''
+    return ColumnCache(cache_directory, PIPELINE_MODULE_FILES)
+
+
+def pipeline_hash(row_filters=()):
+    '''
+    hash of everything a working partition depends on besides its raw data:
+    the source of the PIPELINE_FILES (this module with tweak_df and the ICD
+    lists, the modules it builds the partitions with and the
+    antihypertensive list) and any extra row filters
+    '''
+    sha = hashlib.sha256()
+    for file in PIPELINE_FILES:
+        with open(file, 'rb') as f:
+            sha.update(f.read())
+    for row_filter in row_filters:
+        sha.update(row_filter.signature().encode())
+    return sha.hexdigest()
+
+
+def read_manifest():
+    manifest_file = os.path.join(WORKING_DIRECTORY, 'manifest.json')
+    if not os.path.exists(manifest_file):
+        return {'partitions': {}}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest):
+    manifest_file = os.path.join(WORKING_DIRECTORY, 'manifest.json')
+    with open(manifest_file + '.part', 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(manifest_file + '.part', manifest_file)
+
+
+def get_source_signature(year):
+    stat = os.stat(get_parquet_file(year))
+    return {'file': get_parquet_file(year), 'size': stat.st_size,
+            'mtime': stat.st_mtime}
+
+
+def partition_is_current(manifest, year, pipeline):
+    entry = manifest['partitions'].get(str(year))
+    if entry is None or 'medication_files' not in entry:
+        return False
+    return (
+        entry['pipeline'] == pipeline
+        and entry['source'] == get_source_signature(year)
+        and all(os.path.exists(os.path.join(WORKING_DIRECTORY, file))
+                for file in entry['files'] + entry['medication_files'])
+    )
+
+
+def build_partition(year, cache_directory=None, memory_budget=None,
+                    row_filters=STUDY_FILTERS):
+    '''
+    run tweak_df on a single year, chunk by chunk (see iter_raw_chunks),
+    and write each tweaked chunk to a part file in WORKING_DIRECTORY, with
+    its medications in a MedicationTable file next to it (see
+    split_medications). Returns the manifest entry of the year.
+
+    row_filters are pushed down into the reader (see iter_raw_chunks).
+    '''
+    files = []
+    medication_files = []
+    rows = 0
+    for part, raw_df in enumerate(
+            iter_raw_chunks(year, raw_columns, memory_budget, row_filters)):
+        if cache_directory is None:
+            cache = None
+        elif memory_budget is None:
+            cache = get_column_cache(os.path.join(cache_directory, str(year)))
+        else:
+            cache = get_column_cache(
+                os.path.join(cache_directory, str(year), f'part{part}'))
+        if len(raw_df) == 0:
+            continue
+        df, medications = split_medications(tweak_df(raw_df, cache))
+        del raw_df
+        file = f'working_{year}_{part}.pkl'
+        df.to_pickle(os.path.join(WORKING_DIRECTORY, file + '.part'))
+        os.replace(os.path.join(WORKING_DIRECTORY, file + '.part'),
+                   os.path.join(WORKING_DIRECTORY, file))
+        medication_file = f'medications_{year}_{part}.npz'
+        medications.save(os.path.join(WORKING_DIRECTORY, medication_file))
+        files.append(file)
+        medication_files.append(medication_file)
+        rows += len(df)
+        del df, medications
+
+    # parts left over from an earlier build with more chunks
+    for pattern in [f'working_{year}_*.pkl', f'medications_{year}_*.npz']:
+        for stale in glob.glob(os.path.join(WORKING_DIRECTORY, pattern)):
+            if os.path.basename(stale) not in files + medication_files:
+                os.remove(stale)
+    return {'files': files, 'medication_files': medication_files,
+            'rows': rows, 'source': get_source_signature(year)}
+
+
+def write_partition(manifest, year, entry, pipeline):
+    manifest['partitions'][str(year)] = {**entry, 'pipeline': pipeline}
+    write_manifest(manifest)
+
+
+def iter_partitions(years=None):
+    '''
+    generator of the working partitions listed in the manifest (default all
+    of them), one part file at a time
+    '''
+    manifest = read_manifest()
+    if years is None:
+        years = manifest['partitions']
+    years = sorted(int(year) for year in years)
+    for year in years:
+        for file in manifest['partitions'][str(year)]['files']:
+            yield pd.read_pickle(os.path.join(WORKING_DIRECTORY, file))
+
+
+def load_partitions(years=None):
+    '''
+    concatenate the working partitions listed in the manifest (default all
+    of them) into the working dataframe
+    '''
+    return concat_categorical(list(iter_partitions(years))).reset_index(
+        drop=True)
+
+
+def export_partitions(years=None):
+    '''
+    write the working partitions to the shared Arrow file one part file at
+    a time (see export_shared_batches), so the working dataframe is never
+    held in memory as a whole. Each part is cast to the dtypes
+    load_partitions gives, categoricals get the categories of every part.
+    '''
+    # copy, so the empty slices don't keep the parts alive
+    dtypes = concat_categorical(
+        [df.iloc[:0].copy() for df in iter_partitions(years)]).dtypes
+    export_shared_batches(
+        df[dtypes.index].astype(dtypes.to_dict())
+        for df in iter_partitions(years))
+
+
+def load_medication_partitions(years=None):
+    '''
+    MedicationTable of the working dataframe, concatenated from the
+    partitions in the same order as load_partitions
+    '''
+    manifest = read_manifest()
+    if years is None:
+        years = manifest['partitions']
+    years = sorted(int(year) for year in years)
+    return MedicationTable.concat([
+        MedicationTable.load(os.path.join(WORKING_DIRECTORY, file))
+        for year in years
+        for file in manifest['partitions'][str(year)]['medication_files']
+    ])
+
+
+def build_partitions(years, cache_directory=None, max_workers=1,
+                     memory_budget=None, row_filters=STUDY_FILTERS):
+    '''
+    generator of (year, manifest entry) in the order of years. With
+    max_workers > 1 each year is run through tweak_df in its own worker
+    process; the years don't depend on each other so the partitions are the
+    same as building them one at a time.
+    '''
+    if max_workers == 1 or len(years) < 2:
+        for year in years:
+            print(f'Building working partition for {year}')
+            yield year, build_partition(
+                year, cache_directory, memory_budget, row_filters)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(years))) as executor:
+        futures = [
+            executor.submit(build_partition, year, cache_directory,
+                            memory_budget, row_filters)
+            for year in years
+        ]
+        # collect in year order, not completion order, so the manifest and
+        # output are the same from run to run
+        for year, future in zip(years, futures):
+            yield year, future.result()
+            print(f'Built working partition for {year}')
+
+
+def build_dataframe(force_download=False, years=None,
+                    cache_directory='./outputs/column_cache', max_workers=1,
+                    memory_budget=None, row_filters=None):
+    '''
+    Build ./outputs/working_dataframe.pkl from the years in NHAMCS_FILES
+    (or the given years), plus the memory-mappable copy
+    ./outputs/working_dataframe.arrow (see the shared_dataset module).
+
+    The medications (MED1-MED30/GPMED1-GPMED30) aren't kept as wide
+    columns, they are stored as a long MedicationTable in
+    ./outputs/medication_table.npz (see the medication_table module) with
+    the inverted index ./outputs/medication_index.npz (see the
+    medication_index module).
+
+    The working dataset is kept as one tweaked partition per year in
+    WORKING_DIRECTORY with a manifest.json. Only years that are new, whose
+    source file changed or that were built by a different version of the
+    pipeline (see PIPELINE_FILES) are downloaded, converted and run
+    through tweak_df; the rest are read back from their partitions.
+
+    Expensive derived columns are cached in cache_directory, pass None to
+    recompute everything.
+
+    max_workers > 1 builds the stale years in parallel, one process per
+    year (max_workers=None uses every core). The output is identical to the
+    serial build.
+
+    memory_budget (bytes, per worker) streams each year through tweak_df in
+    chunks of rows sized to fit the budget instead of a whole year at a
+    time, each chunk is appended to the year's partition as a part file.
+    The parts are then streamed into working_dataframe.arrow one at a time
+    and no pickle is written (an old one is removed), so
+    load_working_dataframe reads the Arrow file.
+
+    Only adult visits from 2015 on are read (STUDY_FILTERS, pushed down into
+    the parquet reader). row_filters is an optional list of extra RowFilters
+    for a cohort, with max_workers > 1 their functions have to be picklable
+    (defined at module level, not lambdas).
+    '''
+    years = sorted(NHAMCS_FILES) if years is None else sorted(years)
+    if not os.path.exists(WORKING_DIRECTORY):
+        os.makedirs(WORKING_DIRECTORY)
+
+    if force_download or not validate_data(years):
+        download_years(years)
+
+    row_filters = list(row_filters or [])
+    manifest = read_manifest()
+    pipeline = pipeline_hash(row_filters)
+    stale_years = [
+        year for year in years
+        if not partition_is_current(manifest, year, pipeline)
+    ]
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    for year, entry in build_partitions(stale_years, cache_directory,
+                                        max_workers, memory_budget,
+                                        STUDY_FILTERS + row_filters):
+        write_partition(manifest, year, entry, pipeline)
+
+    if memory_budget is None:
+        df = load_partitions(years)
+        df.to_pickle(WORKING_PICKLE)
+        export_shared_dataset(df)
+        del df
+    else:
+        export_partitions(years)
+        # it would be out of date
+        if os.path.exists(WORKING_PICKLE):
+            os.remove(WORKING_PICKLE)
+    medications = load_medication_partitions(years)
+    medications.save()
+    MedicationIndex.from_table(medications).save()
 
 
 if __name__ == "__main__":
-    raw_df = load_dfs()
-    df = tweak_df(raw_df)
-    print(df)
-    raw_df.to_pickle('./outputs/working_raw_dataframe.pkl')
-    df.to_pickle('./outputs/working_dataframe.pkl')
-    # print(validate_data())
+    build_dataframe()
+    print(pd.read_pickle(WORKING_PICKLE))
+    # memory saved by the dtype schema, for the latest year
+    raw_df = load_dfs(columns=raw_columns, years=[max(NHAMCS_FILES)])
+    print(memory_audit(tweak_df(raw_df, schema=None), tweak_df(raw_df)))
+    # memory kept by concatenating the years with categorical dtypes
+    print(concat_memory_report(load_dfs(columns=raw_columns, as_list=True),
+                               category_codebook))
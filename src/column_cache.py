@@ -0,0 +1,112 @@
+'''
+Disk cache for the expensive derived columns of the working dataframe
+(regex filters over the RFV, MED and DIAG columns).
+
+Each cache entry is keyed by a hash of its definition (the source of the
+function that computes it and the arguments it is called with, e.g. the ICD
+lists) plus a hash of the content of its input columns. Changing a
+definition only invalidates the entry that uses it, everything else is read
+back from disk on the next build.
+
+An entry can hold several columns computed in one pass, e.g. the DIAGNOSES
+entry has STROKE, MI and HTNEMERGENCY. Editing one of their ICD lists
+recomputes all of them, which costs about the same as recomputing one
+because the time goes into the pass over the DIAG codes, not the groups.
+
+Only the source of the function itself is hashed, not of the helpers it
+calls. Pass the source files of those helpers as dependencies, a change to
+any of them invalidates every column.
+'''
+import glob
+import hashlib
+import inspect
+import os
+import numpy as np
+import pandas as pd
+
+
+def stable_repr(obj):
+    '''
+    repr that doesn't abbreviate long numpy arrays, so it can be hashed
+    '''
+    if isinstance(obj, np.ndarray):
+        return repr(obj.tolist())
+    if isinstance(obj, (list, tuple)):
+        return repr([stable_repr(x) for x in obj])
+    if isinstance(obj, dict):
+        return repr({k: stable_repr(v) for k, v in sorted(obj.items())})
+    if isinstance(obj, (set, frozenset)):
+        # set order changes between runs with string hash randomisation
+        return repr(sorted(stable_repr(x) for x in obj))
+    return repr(obj)
+
+
+class ColumnCache():
+    '''
+    Example use:
+    cache = ColumnCache('./outputs/column_cache', ['vocabulary_matching.py'])
+    diagnoses = cache.get_or_compute(
+        'DIAGNOSES', df, DIAG_COLUMNS, get_diagnoses, outcome_ICD)
+    '''
+
+    def __init__(self, cache_directory='./outputs/column_cache',
+                 dependencies=()):
+        self.cache_directory = cache_directory
+        if not os.path.exists(cache_directory):
+            os.makedirs(cache_directory)
+        sha = hashlib.sha256()
+        for file in dependencies:
+            with open(file, 'rb') as f:
+                sha.update(f.read())
+        self.dependencies_hash = sha.hexdigest()
+
+    def definition_hash(self, func, args):
+        definition = (inspect.getsource(func) + stable_repr(args)
+                      + self.dependencies_hash)
+        return hashlib.sha256(definition.encode()).hexdigest()
+
+    def input_hash(self, df, input_columns):
+        hashed_rows = pd.util.hash_pandas_object(
+            df[input_columns], index=True).to_numpy()
+        sha = hashlib.sha256(hashed_rows.tobytes())
+        sha.update(stable_repr(list(input_columns)).encode())
+        return sha.hexdigest()
+
+    def get_key(self, name, df, input_columns, func, args):
+        sha = hashlib.sha256(name.encode())
+        sha.update(self.definition_hash(func, args).encode())
+        sha.update(self.input_hash(df, input_columns).encode())
+        return sha.hexdigest()[:16]
+
+    def get_path(self, name, key):
+        return os.path.join(self.cache_directory, f'{name}-{key}.pkl')
+
+    def get_or_compute(self, name, df, input_columns, func, *args):
+        '''
+        return func(df, *args) from the cache if the definition and the
+        input columns are unchanged, otherwise compute and store it
+        '''
+        key = self.get_key(name, df, input_columns, func, args)
+        path = self.get_path(name, key)
+        if os.path.exists(path):
+            print(f'Loading {name} from cache')
+            return pd.read_pickle(path)
+
+        print(f'Computing {name}')
+        result = func(df, *args)
+        # drop stale entries for this column before writing the new one
+        for stale in glob.glob(self.get_path(name, '*')):
+            os.remove(stale)
+        part_file = path + '.part'
+        result.to_pickle(part_file)
+        os.replace(part_file, path)
+        return result
+
+
+def cached_column(cache, name, df, input_columns, func, *args):
+    '''
+    compute func(df, *args) through the cache, or directly when cache is None
+    '''
+    if cache is None:
+        return func(df, *args)
+    return cache.get_or_compute(name, df, input_columns, func, *args)
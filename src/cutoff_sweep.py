@@ -0,0 +1,241 @@
+'''
+Outcome effects over a whole grid of hypertension definitions.
+
+A patient is exposed at cutoff (sbp, dbp) when BPSYS > sbp or BPDIAS > dbp
+(see Htn_definition), so the patients that are NOT exposed are the ones at
+or below both cutoffs. Each row is put in a 2-d bin by the first SBP and DBP
+cutoff it is at or below, the weighted sums needed for the outcomes are
+histogrammed over those bins and a cumulative sum along both axes then gives
+the not exposed sums for every cutoff at once. Exposed sums are the totals
+minus those. RR (categorical outcomes) and mean differences (numeric
+outcomes) for every cutoff come from these prefix sums, the rows are only
+read once.
+
+Example use:
+sweep = CutoffSweep(df, outcome_queries)
+rr, lci, uci = sweep.effect('DIED')      # SBP cutoff x DBP cutoff
+curve = sweep.dose_response('DIED')      # SBP only (DBP at its top cutoff)
+fig = sweep.plot_surfaces()
+'''
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from stats import (
+    as_columns, relative_risks_from_counts, mean_differences_from_moments)
+from outcome_stats import OutcomeQuery
+from feature_registry import select_columns
+
+SBP_CUTOFFS = np.arange(100, 221)
+DBP_CUTOFFS = np.arange(60, 131)
+
+
+def cutoff_bins(values, cutoffs):
+    '''
+    index of the first (sorted) cutoff each value is at or below, so a row is
+    not exposed by the cutoffs from its bin on. Missing values are never
+    above a cutoff (bin 0), values above every cutoff get bin len(cutoffs).
+    '''
+    values = np.asarray(values, dtype=float)
+    bins = np.searchsorted(cutoffs, values, side='left')
+    return np.where(np.isnan(values), 0, bins)
+
+
+def prefix_sums(sbp_bins, dbp_bins, n_sbp, n_dbp, values):
+    '''
+    (n_sbp + 1 x n_dbp + 1 x n_values) cumulative sums of the columns of
+    values over the 2-d bins, [i, j] is the sum over the rows at or below
+    SBP cutoff i and DBP cutoff j. The last row/column (above every cutoff)
+    ends in the totals.
+    '''
+    values = as_columns(values)
+    flat_bins = sbp_bins * (n_dbp + 1) + dbp_bins
+    hist = np.stack([
+        np.bincount(flat_bins, weights=values[:, j],
+                    minlength=(n_sbp + 1) * (n_dbp + 1))
+        for j in range(values.shape[1])
+    ], axis=-1).reshape(n_sbp + 1, n_dbp + 1, values.shape[1])
+    return hist.cumsum(axis=0).cumsum(axis=1)
+
+
+class CutoffSweep():
+    '''
+    Effects of the outcome queries for every (SBP, DBP) cutoff pair.
+
+    Parameters:
+    df = working dataframe (or a FeatureFrame)
+    queries = [['outcome col name', 'categorical|numeric']], like
+    OutcomeStats
+    sbp_cutoffs, dbp_cutoffs = the grid, default SBP 100-220 x DBP 60-130 in
+    1 mmHg steps
+    '''
+
+    def __init__(self, df, queries, sbp_cutoffs=SBP_CUTOFFS,
+                 dbp_cutoffs=DBP_CUTOFFS):
+        self.queries = [OutcomeQuery(outcome, kind) for outcome, kind in queries]
+        self.sbp_cutoffs = np.sort(np.asarray(sbp_cutoffs, dtype=float))
+        self.dbp_cutoffs = np.sort(np.asarray(dbp_cutoffs, dtype=float))
+        df = select_columns(
+            df, [outcome for outcome, _ in queries] + ['PATWT', 'BPSYS', 'BPDIAS'])
+        weights = df['PATWT'].to_numpy(dtype=float)
+
+        # the weighted sums each kind of outcome needs
+        columns = {'PATWT': weights}
+        self.shifts = {}
+        for query in self.queries:
+            x = df[query.outcome].to_numpy(dtype=float)
+            if query.kind == 'categorical':
+                columns[query.outcome] = weights * x
+            elif query.kind == 'numeric':
+                present = ~np.isnan(x)
+                # centre on the plain mean so the variance keeps its precision
+                shift = x[present].mean() if present.any() else 0.0
+                centred = np.where(present, x - shift, 0.0)
+                columns[(query.outcome, 'n')] = weights * present
+                columns[(query.outcome, 'x')] = weights * centred
+                columns[(query.outcome, 'xx')] = weights * centred**2
+                self.shifts[query.outcome] = shift
+            else:
+                raise ValueError(f'unknown query kind {query.kind}')
+        self.columns = list(columns)
+
+        n_sbp, n_dbp = len(self.sbp_cutoffs), len(self.dbp_cutoffs)
+        sums = prefix_sums(
+            cutoff_bins(df['BPSYS'], self.sbp_cutoffs),
+            cutoff_bins(df['BPDIAS'], self.dbp_cutoffs),
+            n_sbp, n_dbp, np.column_stack(list(columns.values())))
+        self.not_exposed = sums[:n_sbp, :n_dbp]
+        self.totals = sums[-1, -1]
+
+    def get_sums(self, column):
+        '''
+        (exposed, not exposed) sums of a column for every cutoff, two
+        (n_sbp x n_dbp) arrays
+        '''
+        j = self.columns.index(column)
+        not_exposed = self.not_exposed[:, :, j]
+        return self.totals[j] - not_exposed, not_exposed
+
+    def get_moments(self, outcome, exposed):
+        '''
+        (sum of weights, mean, variance) of a numeric outcome in the exposed
+        or not exposed group for every cutoff
+        '''
+        group = 0 if exposed else 1
+        n = self.get_sums((outcome, 'n'))[group]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = self.get_sums((outcome, 'x'))[group] / n
+            xx = self.get_sums((outcome, 'xx'))[group] / n
+        return n, x + self.shifts[outcome], np.maximum(xx - x**2, 0)
+
+    def as_grid(self, values):
+        return pd.DataFrame(
+            values,
+            index=pd.Index(self.sbp_cutoffs, name='SBP'),
+            columns=pd.Index(self.dbp_cutoffs, name='DBP'))
+
+    def exposure_totals(self):
+        '''
+        weighted number of exposed patients (millions) for every cutoff
+        '''
+        return self.as_grid(self.get_sums('PATWT')[0] / 1e6)
+
+    def get_kind(self, outcome):
+        return next(q.kind for q in self.queries if q.outcome == outcome)
+
+    def effect(self, outcome):
+        '''
+        RR (categorical outcome) or mean difference, exposed - not exposed
+        (numeric outcome), with its LCI and UCI as three
+        (SBP cutoff x DBP cutoff) dataframes
+        '''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.get_kind(outcome) == 'categorical':
+                n_exposed, n_not_exposed = self.get_sums('PATWT')
+                a, b = self.get_sums(outcome)
+                values = relative_risks_from_counts(
+                    a, n_exposed, b, n_not_exposed)
+            else:
+                values = mean_differences_from_moments(
+                    *self.get_moments(outcome, exposed=False),
+                    *self.get_moments(outcome, exposed=True))
+        return tuple(self.as_grid(value) for value in values)
+
+    def surfaces(self):
+        '''
+        {outcome: (SBP cutoff x DBP cutoff) dataframe of RR/DIFF}
+        '''
+        return {q.outcome: self.effect(q.outcome)[0] for q in self.queries}
+
+    def dose_response(self, outcome, dbp_cutoff=None):
+        '''
+        RR/DIFF, LCI and UCI along the SBP cutoffs for one DBP cutoff, by
+        default the top one so that the exposure is (almost) SBP alone
+        '''
+        if dbp_cutoff is None:
+            dbp_cutoff = self.dbp_cutoffs[-1]
+        estimate, LCI, UCI = self.effect(outcome)
+        return pd.DataFrame({
+            'RR/DIFF': estimate[dbp_cutoff],
+            'LCI': LCI[dbp_cutoff],
+            'UCI': UCI[dbp_cutoff],
+        })
+
+    def to_frame(self):
+        '''
+        long table with a row per (outcome, SBP cutoff, DBP cutoff)
+        '''
+        n_exposed, n_not_exposed = self.get_sums('PATWT')
+        tables = []
+        for q in self.queries:
+            estimate, LCI, UCI = self.effect(q.outcome)
+            tables.append(pd.DataFrame({
+                'OUTCOME': q.outcome,
+                'KIND': q.kind,
+                'N_NOT_EXPOSED': (n_not_exposed / 1e6).ravel(),
+                'N_EXPOSED': (n_exposed / 1e6).ravel(),
+                'RR/DIFF': estimate.to_numpy().ravel(),
+                'LCI': LCI.to_numpy().ravel(),
+                'UCI': UCI.to_numpy().ravel(),
+            }, index=pd.MultiIndex.from_product(
+                [self.sbp_cutoffs, self.dbp_cutoffs], names=['SBP', 'DBP'])))
+        return pd.concat(tables).reset_index()
+
+    def plot_surfaces(self):
+        '''
+        heatmap of RR/DIFF over the cutoff grid, one panel per outcome
+        '''
+        nrows = int(np.ceil(len(self.queries) / 4))
+        fig, axes = plt.subplots(ncols=4, nrows=nrows, squeeze=False,
+                                 constrained_layout=True, figsize=(18, 4 * nrows))
+        extent = [self.dbp_cutoffs[0], self.dbp_cutoffs[-1],
+                  self.sbp_cutoffs[0], self.sbp_cutoffs[-1]]
+        for ax, (outcome, surface) in zip(axes.flatten(), self.surfaces().items()):
+            image = ax.imshow(surface.to_numpy(), origin='lower', aspect='auto',
+                              extent=extent, cmap='viridis')
+            fig.colorbar(image, ax=ax)
+            label = 'RR' if self.get_kind(outcome) == 'categorical' else 'DIFF'
+            ax.set_title(f'{outcome} {label} by BP cutoff', fontsize=8)
+            ax.set_xlabel('DBP cutoff')
+            ax.set_ylabel('SBP cutoff')
+        for ax in axes.flatten()[len(self.queries):]:
+            ax.set_visible(False)
+        return fig
+
+    def plot_dose_response(self, dbp_cutoff=None):
+        '''
+        RR/DIFF and CI along the SBP cutoffs, one panel per outcome
+        '''
+        nrows = int(np.ceil(len(self.queries) / 4))
+        fig, axes = plt.subplots(ncols=4, nrows=nrows, squeeze=False,
+                                 constrained_layout=True, figsize=(18, 4 * nrows))
+        for ax, q in zip(axes.flatten(), self.queries):
+            curve = self.dose_response(q.outcome, dbp_cutoff)
+            ax.plot(curve.index, curve['RR/DIFF'])
+            ax.fill_between(curve.index, curve.LCI, curve.UCI, alpha=0.3)
+            ax.axhline(1 if q.kind == 'categorical' else 0, color='grey',
+                       linewidth=0.5)
+            ax.set_title(f'{q.outcome} by SBP cutoff', fontsize=8)
+            ax.set_xlabel('SBP cutoff')
+        for ax in axes.flatten()[len(self.queries):]:
+            ax.set_visible(False)
+        return fig
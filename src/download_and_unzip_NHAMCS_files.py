@@ -1,60 +1,225 @@
 import os
+import shutil
+import tempfile
+import time
 import pandas as pd
 import requests
+from concurrent.futures import (
+    ProcessPoolExecutor, ThreadPoolExecutor, as_completed)
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from urllib.request import url2pathname
 from zipfile import ZipFile
 
+# rows per parquet row group, small enough that a chunked build (see
+# build_dataframe.iter_raw_chunks) only decodes part of a year at a time
+ROW_GROUP_SIZE = 10000
+
+
+def make_arrow_compatible(df):
+    '''
+    SPSS value labels turn numeric columns into categoricals with a mix of
+    number and string categories (e.g. 120.0 and 'Blank'), which parquet
+    can't store. Those categories are cast to strings, the numbers are
+    recovered with pd.to_numeric when the working dataframe is built.
+    '''
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            categories = df[col].cat.categories
+            if len(set(type(c) for c in categories)) > 1:
+                df[col] = df[col].cat.rename_categories(
+                    [str(c) for c in categories])
+    return df
+
+
+def convert_zipped_spss(zip_file, parquet_file):
+    '''
+    Unzip and convert a single year in one step. The .sav member is streamed
+    out of the zip into a temporary file (pyreadstat needs a path) rather
+    than being extracted next to the other years, and the parquet file is
+    renamed into place once it is fully written.
+
+    Runs in a worker process, returns (zip_file, rows, seconds, pid)
+    '''
+    start = time.perf_counter()
+    print(f'[worker {os.getpid()}] Converting {zip_file}...')
+    with ZipFile(zip_file, 'r') as zip_ref:
+        member = next(name for name in zip_ref.namelist()
+                      if name.lower().endswith('.sav'))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sav_file = os.path.join(tmp_dir, os.path.basename(member))
+            with zip_ref.open(member) as src, open(sav_file, 'wb') as dst:
+                shutil.copyfileobj(src, dst, length=1024 * 1024)
+            df = pd.read_spss(sav_file)
+
+    part_file = parquet_file + '.part'
+    make_arrow_compatible(df).to_parquet(
+        part_file, row_group_size=ROW_GROUP_SIZE)
+    os.replace(part_file, parquet_file)
+    return zip_file, len(df), time.perf_counter() - start, os.getpid()
+
 
 class FileDownloader():
-    def __init__(self, base_url, files_to_download, download_directory):
+    '''
+    Downloads the yearly NHAMCS spss zip files and converts them to one
+    parquet file per year.
+
+    base_url can be the CDC ftp server (http/https), a file:// url or a plain
+    local directory that mirrors the server, which lets the whole ingest
+    path run offline.
+
+    Downloads run concurrently (max_workers at a time) over a pooled session.
+    Each file is streamed in chunks to a '.part' file which is renamed into
+    place only once it is complete, so an interrupted download never leaves
+    a truncated zip behind and is resumed with an HTTP Range request on the
+    next run.
+
+    Each year is then unzipped and converted in its own process
+    (convert_workers processes, default one per year).
+    '''
+
+    def __init__(self, base_url, files_to_download, download_directory,
+                 max_workers=4, chunk_size=1024 * 1024, convert_workers=None):
         self.base_url = base_url
         self.files_to_download = files_to_download
         self.download_directory = download_directory
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.convert_workers = convert_workers
         self.zip_filenames = []
-        self.spss_filenames = []
+        self.parquet_filenames = []
 
     def check_directory(self, directory):
         if not os.path.exists(directory):
             os.makedirs(directory)
 
+    def get_mirror_directory(self):
+        '''
+        returns the local directory for a file:// or directory base_url,
+        otherwise None
+        '''
+        parsed = urlparse(self.base_url)
+        if parsed.scheme == 'file':
+            return url2pathname(parsed.path)
+        if parsed.scheme in ('http', 'https', 'ftp'):
+            return None
+        if os.path.isdir(self.base_url):
+            return self.base_url
+        return None
+
+    def build_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers,
+                              pool_maxsize=self.max_workers,
+                              max_retries=3)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def copy_from_mirror(self, mirror_directory, file, local_file):
+        part_file = local_file + '.part'
+        shutil.copyfile(os.path.join(mirror_directory, file), part_file)
+        os.replace(part_file, local_file)
+
+    def stream_download(self, session, file, local_file):
+        '''
+        stream a single file to disk, resuming from a partial '.part' file
+        if one exists
+        '''
+        url = f'{self.base_url}{file}'
+        part_file = local_file + '.part'
+        resume_from = os.path.getsize(
+            part_file) if os.path.exists(part_file) else 0
+        headers = {'Range': f'bytes={resume_from}-'} if resume_from else {}
+
+        with session.get(url, headers=headers, stream=True,
+                         timeout=60) as response:
+            if response.status_code == 416:
+                # nothing left to send, the partial file is only complete
+                # if its size is the total in Content-Range 'bytes */<total>'
+                total = response.headers.get(
+                    'Content-Range', '').rpartition('/')[2]
+                if not (total.isdigit() and int(total) == resume_from):
+                    # not a prefix of the archive, download it again
+                    os.remove(part_file)
+                    return self.stream_download(session, file, local_file)
+            else:
+                response.raise_for_status()
+                # the server ignored the range request, start over
+                mode = 'ab' if response.status_code == 206 else 'wb'
+                with open(part_file, mode) as f:
+                    for chunk in response.iter_content(
+                            chunk_size=self.chunk_size):
+                        f.write(chunk)
+        os.replace(part_file, local_file)
+
+    def download_file(self, session, mirror_directory, file):
+        local_file = os.path.join(
+            self.download_directory, 'zipped_files', file)
+        print(f'Downloading {file}...')
+        if mirror_directory is not None:
+            self.copy_from_mirror(mirror_directory, file, local_file)
+        else:
+            self.stream_download(session, file, local_file)
+        print(f'Finished downloading {file}')
+        return local_file
+
     def download_zipped_files(self):
+        mirror_directory = self.get_mirror_directory()
+        to_download = []
         for file in self.files_to_download:
-            url = f'{self.base_url}{file}'
             local_file = os.path.join(
                 self.download_directory, 'zipped_files', file)
             self.zip_filenames.append(local_file)
-
             if not os.path.exists(local_file):
-                print(f'Downloading {file}...')
-                response = requests.get(url)
-                with open(local_file, 'wb') as f:
-                    f.write(response.content)
-                print(f'Finished downloading {file}')
-
-    def file_unzipper(self):
-        spss_file = os.path.join(self.download_directory, 'spss_files')
-        sav_files = [x.replace('.zip', '.sav') for x in self.files_to_download]
-
-        for file, sav_file in zip(self.zip_filenames, sav_files):
-
-            self.spss_filenames.append(os.path.join(spss_file, sav_file))
-            with ZipFile(file, 'r') as zip_ref:
-                print(f'Unzipping {file}...')
-                zip_ref.extractall(spss_file)
-                print(f'Finished unzipping {file}.')
-
-    def file_pickler(self):
-
-        pkl_files = [x.replace('.zip', '.pkl') for x in self.files_to_download]
-        for file, pkl_file in zip(self.spss_filenames, pkl_files):
-            pickle_root = os.path.join(
-                self.download_directory, 'pickled_files'
-            )
-            pickle_file = os.path.join(pickle_root, pkl_file)
-            print(f'Pickling {pickle_root}...')
-            if not os.path.exists(pickle_file):
-                df = pd.read_spss(file)
-                df.to_pickle(pickle_file)
-            print(f'Finished pickling {pickle_root}...')
+                to_download.append(file)
+
+        if not to_download:
+            return
+
+        with self.build_session() as session:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(
+                        self.download_file, session, mirror_directory, file)
+                    for file in to_download
+                ]
+                # surface the first failure after the others have finished
+                for future in as_completed(futures):
+                    future.result()
+
+    def file_converter(self):
+        '''
+        convert each yearly spss zip file to a parquet file. Parquet is
+        columnar, so later loads can read just the columns they need instead
+        of the full ~1000 column survey.
+
+        pd.read_spss is single threaded, so each year is unzipped and
+        converted in its own worker process.
+        '''
+        parquet_root = os.path.join(self.download_directory, 'parquet_files')
+        tasks = []
+        for zip_file in self.zip_filenames:
+            parquet_file = os.path.join(
+                parquet_root,
+                os.path.basename(zip_file).replace('.zip', '.parquet'))
+            self.parquet_filenames.append(parquet_file)
+            if not os.path.exists(parquet_file):
+                tasks.append((zip_file, parquet_file))
+
+        if not tasks:
+            return
+
+        max_workers = self.convert_workers or len(tasks)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(convert_zipped_spss, zip_file, parquet_file)
+                for zip_file, parquet_file in tasks
+            ]
+            for future in as_completed(futures):
+                zip_file, n_rows, seconds, pid = future.result()
+                print(f'[worker {pid}] Finished converting {zip_file} '
+                      f'({n_rows} rows) in {seconds:.0f}s')
 
     def run(self):
         # make sure the base directory exists + make it if needed
@@ -62,21 +227,15 @@ class FileDownloader():
         # make sure the zip directory exists + make it if needed
         self.check_directory(os.path.join(
             self.download_directory, 'zipped_files'))
-        # make sure the spss directory exists + make it if needed
-        self.check_directory(os.path.join(
-            self.download_directory, 'spss_files'))
-        # make sure the pickle directory exists + make it if needed
+        # make sure the parquet directory exists + make it if needed
         self.check_directory(os.path.join(
-            self.download_directory, 'pickled_files'))
+            self.download_directory, 'parquet_files'))
         # download files
         print(f'Downloading spss zip files from: {self.base_url}')
         self.download_zipped_files()
-        # unzip files
-        print('Unzipping spss files')
-        self.file_unzipper()
-        # pickle files
-        print('Converting spss files to pickled dataframes')
-        self.file_pickler()
+        # convert files
+        print('Converting spss files to parquet files')
+        self.file_converter()
 
     def __call__(self):
         self.run()
@@ -0,0 +1,197 @@
+'''
+Registry of the derived columns of the working dataframe.
+
+Each feature declares the columns it produces, the columns it reads and a
+vectorized function that computes them. A FeatureFrame wraps the cleaned
+base dataframe and only computes a feature (and the features it depends on)
+the first time one of its columns is asked for, so an analysis that uses
+five variables only pays for those five.
+
+Features are resolved in registration order, the same way an .assign chain
+works: an input refers to the latest feature registered *before* the one
+reading it that produces that column, otherwise to the base dataframe. This
+means a feature can overwrite a raw column (e.g. ADMITHOS 'Yes'/'No' ->
+bool) while earlier features still see the raw values.
+
+Example use:
+FEATURES = FeatureRegistry()
+FEATURES.add('HX_HTN', ['HTN'], lambda df: (df.HTN == 'Yes').astype(int))
+FEATURES.add(['STROKE', 'MI'], DIAG_COLUMNS, get_diagnoses,
+             args=(outcome_ICD,), cached=True, name='DIAGNOSES')
+
+frame = FeatureFrame(base_df, FEATURES, cache)
+frame['HX_HTN']                         # computes HX_HTN only
+frame.require(['STROKE', 'PATWT'])      # dataframe with just these columns
+frame.to_frame()                        # every column, like the old chain
+'''
+import pandas as pd
+from column_cache import cached_column
+from schema import apply_schema
+
+
+class Feature():
+    '''
+    outputs - column name or list of column names produced by func
+    inputs - columns func reads, raw columns missing from the base
+    dataframe are skipped
+    func - func(df, *args) returning a series (single output) or a
+    dataframe with the output columns
+    args - extra arguments for func, or a function returning them when they
+    are expensive to build (e.g. read from a file)
+    cached - store the result in the ColumnCache, keyed by name
+    '''
+
+    def __init__(self, outputs, inputs, func, args=(), cached=False,
+                 name=None):
+        self.outputs = [outputs] if isinstance(outputs, str) else list(outputs)
+        self.inputs = list(inputs)
+        self.func = func
+        self.args = args
+        self.cached = cached
+        self.name = name or self.outputs[0]
+
+    def get_args(self):
+        return self.args() if callable(self.args) else tuple(self.args)
+
+    def compute(self, df, cache=None):
+        if self.cached:
+            result = cached_column(cache, self.name, df, list(df.columns),
+                                   self.func, *self.get_args())
+        else:
+            result = self.func(df, *self.get_args())
+        if isinstance(result, pd.Series):
+            result = result.to_frame(self.outputs[0])
+        return result[self.outputs]
+
+
+class FeatureRegistry():
+    def __init__(self):
+        self.features = []
+
+    def add(self, outputs, inputs, func, args=(), cached=False, name=None):
+        feature = Feature(outputs, inputs, func, args, cached, name)
+        self.features.append(feature)
+        return feature
+
+    def outputs(self):
+        '''
+        every column produced by a feature, in registration order
+        '''
+        return list(dict.fromkeys(
+            col for feature in self.features for col in feature.outputs))
+
+    def provider(self, column, before=None):
+        '''
+        index of the last feature registered before position 'before' that
+        produces column, None if column comes from the base dataframe
+        '''
+        before = len(self.features) if before is None else before
+        for idx in range(before - 1, -1, -1):
+            if column in self.features[idx].outputs:
+                return idx
+        return None
+
+    def resolve(self, columns):
+        '''
+        indices of the features needed for columns, in an order that they
+        can be computed in (dependencies are always registered first)
+        '''
+        needed = set()
+        stack = [self.provider(col) for col in columns]
+        while stack:
+            idx = stack.pop()
+            if idx is None or idx in needed:
+                continue
+            needed.add(idx)
+            stack.extend(self.provider(col, idx)
+                         for col in self.features[idx].inputs)
+        return sorted(needed)
+
+
+class FeatureFrame():
+    '''
+    Lazy dataframe of a base dataframe plus the features of a registry.
+    Columns can be read with frame['COL'], frame.COL or frame.require([...]),
+    CategoricalStats, OutcomeStats and the plotting functions accept one in
+    place of the working dataframe.
+    '''
+
+    def __init__(self, base, registry, cache=None, schema=None):
+        self.base = base
+        self.registry = registry
+        self.cache = cache
+        self.schema = schema
+        self.values = {}  # feature index -> computed dataframe
+
+    def __len__(self):
+        return len(self.base)
+
+    @property
+    def index(self):
+        return self.base.index
+
+    @property
+    def columns(self):
+        return pd.Index(list(dict.fromkeys(
+            list(self.base.columns) + self.registry.outputs())))
+
+    def get_column(self, column, before=None):
+        idx = self.registry.provider(column, before)
+        if idx is None:
+            return self.base[column]
+        return self.values[idx][column]
+
+    def compute(self, idx):
+        if idx in self.values:
+            return
+        feature = self.registry.features[idx]
+        df = pd.DataFrame({
+            col: self.get_column(col, idx) for col in feature.inputs
+            if self.registry.provider(col, idx) is not None
+            or col in self.base.columns
+        }, index=self.base.index)
+        self.values[idx] = feature.compute(df, self.cache)
+
+    def require(self, columns):
+        '''
+        compute whatever columns needs and return them as a dataframe
+        '''
+        for idx in self.registry.resolve(columns):
+            self.compute(idx)
+        df = pd.DataFrame({col: self.get_column(col) for col in columns},
+                          index=self.base.index)
+        return df if self.schema is None else apply_schema(df, self.schema)
+
+    def to_frame(self):
+        '''
+        compute every feature, the columns are in the same order as if the
+        features had been .assign'ed to the base dataframe one by one
+        '''
+        df = self.base
+        for idx, feature in enumerate(self.registry.features):
+            self.compute(idx)
+            df = df.assign(**{
+                col: self.values[idx][col] for col in feature.outputs})
+        return df if self.schema is None else apply_schema(df, self.schema)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.require([key])[key]
+        return self.require(list(key))
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in ('base', 'registry'):
+            raise AttributeError(name)
+        if name in self.columns:
+            return self[name]
+        raise AttributeError(name)
+
+
+def select_columns(df, columns):
+    '''
+    materialise columns of a FeatureFrame as a dataframe, a regular dataframe
+    is returned as it is
+    '''
+    if isinstance(df, FeatureFrame):
+        return df.require(list(dict.fromkeys(columns)))
+    return df
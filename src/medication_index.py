@@ -0,0 +1,208 @@
+'''
+Inverted index over the medication slots (MED1-MED30 with GPMED1-GPMED30)
+of the working dataframe.
+
+Each distinct medication name is normalised (lower case, single spaces) and
+gets a posting list of (visit row, slot, GPMED code), stored CSR style:
+the postings are sorted by name and offsets[i]:offsets[i + 1] are the
+postings of names[i]. build_dataframe saves the index next to the working
+dataset, so "which visits got labetalol", weighted counts per drug and
+drug co-occurrence only touch the postings of the drugs asked about.
+
+Rows are positions in the working dataframe (which has a RangeIndex). The
+index is built from the MedicationTable of the working dataset (see the
+medication_table module).
+
+Example use:
+index = MedicationIndex.load()
+rows = index.visits(['labetalol', 'hydralazine'], GPMED_STATUS['given'])
+counts = index.weighted_counts(df.PATWT, htn_def.get_triage_htn())
+'''
+import os
+import numpy as np
+import pandas as pd
+from medication_table import MedicationTable, EMPTY_SLOT_LABELS, normalise_name
+
+MEDICATION_INDEX = './outputs/medication_index.npz'
+
+
+class MedicationIndex():
+    '''
+    names - normalised medication names (sorted)
+    offsets - len(names) + 1 offsets into the posting arrays
+    rows, slots, gp_codes - the postings, gp_codes index gp_labels (-1 is
+    missing)
+    n_rows - number of visits in the indexed dataframe
+    '''
+
+    def __init__(self, names, offsets, rows, slots, gp_codes, gp_labels,
+                 n_rows):
+        self.names = np.asarray(names, dtype=object)
+        self.offsets = np.asarray(offsets)
+        self.rows = np.asarray(rows)
+        self.slots = np.asarray(slots)
+        self.gp_codes = np.asarray(gp_codes)
+        self.gp_labels = np.asarray(gp_labels, dtype=object)
+        self.n_rows = int(n_rows)
+        self.name_ids = {name: idx for idx, name in enumerate(self.names)}
+
+    @classmethod
+    def from_table(cls, table):
+        '''
+        invert a MedicationTable (grouped by visit) into postings grouped by
+        name
+        '''
+        # med label -> normalised name id, empty slots -> -1
+        normalised = [normalise_name(name) for name in table.med_labels]
+        names = np.array(sorted(
+            set(normalised) - EMPTY_SLOT_LABELS), dtype=object)
+        lookup = np.append(pd.Index(names).get_indexer(normalised), -1)
+        entry_names = lookup[table.med_codes]
+        keep = entry_names >= 0
+        entry_names = entry_names[keep]
+
+        # stable, so each posting list stays sorted by row
+        order = np.argsort(entry_names, kind='stable')
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(entry_names, minlength=len(names)),
+                  out=offsets[1:])
+        return cls(
+            names, offsets,
+            table.visit_ids()[keep][order].astype(np.int32),
+            table.slots[keep][order],
+            table.gp_codes[keep][order],
+            table.gp_labels, table.n_visits)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        return cls.from_table(MedicationTable.from_dataframe(df))
+
+    def save(self, path=MEDICATION_INDEX):
+        part_file = path + '.part.npz'
+        np.savez(part_file, names=self.names.astype(str),
+                 offsets=self.offsets, rows=self.rows, slots=self.slots,
+                 gp_codes=self.gp_codes,
+                 gp_labels=self.gp_labels.astype(str),
+                 n_rows=np.array(self.n_rows))
+        os.replace(part_file, path)
+
+    @classmethod
+    def load(cls, path=MEDICATION_INDEX):
+        with np.load(path) as arrays:
+            return cls(arrays['names'].astype(object), arrays['offsets'],
+                       arrays['rows'], arrays['slots'], arrays['gp_codes'],
+                       arrays['gp_labels'].astype(object),
+                       arrays['n_rows'])
+
+    def match(self, pattern):
+        '''
+        names matching a regex (case insensitive), only the names are
+        searched
+        '''
+        text = pd.Series(self.names, dtype=object)
+        return list(self.names[text.str.contains(
+            pattern, case=False, regex=True).to_numpy()])
+
+    def get_name_ids(self, drugs):
+        if isinstance(drugs, str):
+            drugs = [drugs]
+        ids = [self.name_ids.get(normalise_name(drug)) for drug in drugs]
+        return np.array([idx for idx in ids if idx is not None], dtype=int)
+
+    def postings(self, drug):
+        '''
+        dataframe of the (row, slot, GPMED) postings of a single drug
+        '''
+        idx = self.name_ids.get(normalise_name(drug))
+        if idx is None:
+            return pd.DataFrame({'row': [], 'slot': [], 'GPMED': []})
+        start, stop = self.offsets[idx], self.offsets[idx + 1]
+        gp = self.gp_codes[start:stop]
+        return pd.DataFrame({
+            'row': self.rows[start:stop],
+            'slot': self.slots[start:stop],
+            'GPMED': np.where(gp >= 0, self.gp_labels[np.maximum(gp, 0)],
+                              None),
+        })
+
+    def posting_slices(self, name_ids):
+        '''
+        (name id per posting, posting positions) for the given names
+        '''
+        starts, stops = self.offsets[name_ids], self.offsets[name_ids + 1]
+        lengths = stops - starts
+        positions = (np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+                     + np.arange(lengths.sum()))
+        return np.repeat(name_ids, lengths), positions
+
+    def select_postings(self, name_ids, gp_labels=None):
+        '''
+        (name id per posting, posting positions) of the given names, if
+        gp_labels is given only postings whose GPMED is one of those labels
+        '''
+        names, positions = self.posting_slices(name_ids)
+        if gp_labels is not None:
+            # the trailing False is for a missing GPMED (code -1)
+            allowed = np.append(np.isin(self.gp_labels, list(gp_labels)),
+                                False)
+            keep = allowed[self.gp_codes[positions]]
+            names, positions = names[keep], positions[keep]
+        return names, positions
+
+    def visit_mask(self, drugs, gp_labels=None):
+        '''
+        boolean array over the rows, true where any of the drugs is in a
+        slot (and, if gp_labels is given, its GPMED is one of those labels,
+        e.g. GPMED_STATUS['given'] from build_dataframe)
+        '''
+        _, positions = self.select_postings(self.get_name_ids(drugs), gp_labels)
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[self.rows[positions]] = True
+        return mask
+
+    def visits(self, drugs, gp_labels=None):
+        '''
+        sorted rows where any of the drugs was given/prescribed, see
+        visit_mask
+        '''
+        return np.flatnonzero(self.visit_mask(drugs, gp_labels))
+
+    def weighted_counts(self, weights, exposure, drugs=None, gp_labels=None):
+        '''
+        weighted number of visits (in millions) with each drug, split by a
+        boolean exposure (e.g. htn_def.get_triage_htn()). Default every
+        drug in the index, gp_labels is as in visit_mask.
+        '''
+        weights = np.asarray(weights, dtype=float)
+        exposure = np.asarray(exposure, dtype=bool)
+        name_ids = (np.arange(len(self.names)) if drugs is None
+                    else self.get_name_ids(drugs))
+        names, positions = self.select_postings(name_ids, gp_labels)
+        # a drug in two slots of the same visit counts once
+        keys = np.unique(names.astype(np.int64) * self.n_rows
+                         + self.rows[positions])
+        names, rows = keys // self.n_rows, keys % self.n_rows
+        exposed = exposure[rows]
+        counts = pd.DataFrame({
+            'n_nohtn': np.bincount(names, weights=weights[rows] * ~exposed,
+                                   minlength=len(self.names))[name_ids],
+            'n_htn': np.bincount(names, weights=weights[rows] * exposed,
+                                 minlength=len(self.names))[name_ids],
+        }, index=pd.Index(self.names[name_ids], name='medication')) / 1e6
+        counts['n_total'] = counts.n_nohtn + counts.n_htn
+        return counts[['n_total', 'n_nohtn', 'n_htn']]
+
+    def co_occurrence(self, drugs, weights=None, gp_labels=None):
+        '''
+        (drugs x drugs) dataframe of the number of visits (or weighted
+        visits) that had both drugs, the diagonal is the visits with each
+        drug
+        '''
+        columns = [self.visit_mask(drug, gp_labels) for drug in drugs]
+        indicator = np.column_stack(columns).astype(float)
+        if weights is not None:
+            weighted = indicator * np.asarray(weights, dtype=float)[:, None]
+        else:
+            weighted = indicator
+        return pd.DataFrame(weighted.T @ indicator, index=drugs,
+                            columns=drugs)
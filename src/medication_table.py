@@ -0,0 +1,202 @@
+'''
+Long (sparse) representation of the medication slots MED1-MED30 and
+GPMED1-GPMED30.
+
+Most of the 30 slots of a visit are empty ('NO ENTRY MADE' or missing), so
+rather than 60 wide columns the working dataset keeps one entry per filled
+slot: (visit, slot, med code, GP code), grouped by visit CSR style. The
+entries of visit i are indptr[i]:indptr[i + 1], med codes index med_labels
+and GP codes index gp_labels (-1 is a missing GPMED).
+
+Questions like "was any med in this set given in the ED" are answered with
+one vectorized pass over the filled entries:
+hits per distinct label -> hits per entry -> any per visit.
+
+Example use:
+table = MedicationTable.from_dataframe(df)
+med_hits = table.match_meds(['labetalol', 'hydralazine'])
+given = table.any_given(med_hits, table.match_status(GPMED_STATUS['given']))
+'''
+import os
+import re
+import numpy as np
+import pandas as pd
+from vocabulary_matching import code_matrix, match_vocabulary
+
+MEDICATION_TABLE = './outputs/medication_table.npz'
+# slot labels that mean no medication was recorded
+EMPTY_SLOT_LABELS = {'', 'no entry made', 'blank'}
+
+
+def normalise_name(name):
+    return re.sub(r'\s+', ' ', str(name)).strip().lower()
+
+
+def get_slot_columns(df, prefix):
+    columns = [col for col in df.columns if re.search(rf'^{prefix}\d+$', col)]
+    return sorted(columns, key=lambda col: int(col[len(prefix):]))
+
+
+def remap_codes(codes, labels, new_labels):
+    '''
+    codes into labels -> codes into new_labels, -1 stays -1
+    '''
+    lookup = np.append(pd.Index(new_labels).get_indexer(labels), -1)
+    return lookup[codes]
+
+
+class MedicationTable():
+    '''
+    indptr - n_visits + 1 offsets into the entries
+    slots - slot number (1-30) of each entry
+    med_codes, gp_codes - label codes of each entry, gp_codes is -1 where
+    GPMED is missing
+    med_labels, gp_labels - the MED and GPMED labels
+    '''
+
+    def __init__(self, indptr, slots, med_codes, gp_codes, med_labels,
+                 gp_labels):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.slots = np.asarray(slots, dtype=np.int8)
+        self.med_codes = np.asarray(med_codes, dtype=np.int32)
+        self.gp_codes = np.asarray(gp_codes, dtype=np.int16)
+        self.med_labels = np.asarray(med_labels, dtype=object)
+        self.gp_labels = np.asarray(gp_labels, dtype=object)
+
+    @property
+    def n_visits(self):
+        return len(self.indptr) - 1
+
+    def __len__(self):
+        return len(self.med_codes)
+
+    @classmethod
+    def from_dataframe(cls, df, empty_labels=EMPTY_SLOT_LABELS):
+        '''
+        build the table from the wide MED{i}/GPMED{i} columns of df, the
+        visits are the rows of df in order. MED labels in empty_labels
+        (normalised, see normalise_name) are left out.
+        '''
+        med_columns = get_slot_columns(df, 'MED')
+        gp_columns = get_slot_columns(df, 'GPMED')
+        med_codes, med_labels = code_matrix(df, med_columns)
+        gp_codes, gp_labels = code_matrix(df, gp_columns)
+
+        empty = np.append(np.array(
+            [normalise_name(label) in empty_labels for label in med_labels],
+            dtype=bool), True)
+        # row major, so the entries come out grouped by visit
+        rows, columns = np.nonzero(~empty[med_codes])
+        indptr = np.zeros(len(df) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(df)), out=indptr[1:])
+
+        # GPMED1-30 line up with MED1-30 by slot number
+        gp_columns_of_slot = pd.Index(
+            [int(col[5:]) for col in gp_columns]).get_indexer(
+            [int(col[3:]) for col in med_columns])[columns]
+        gp = np.where(gp_columns_of_slot >= 0,
+                      gp_codes[rows, np.maximum(gp_columns_of_slot, 0)], -1)
+        slot_numbers = np.array([int(col[3:]) for col in med_columns])
+        return cls(indptr, slot_numbers[columns], med_codes[rows, columns],
+                   gp, med_labels, gp_labels)
+
+    @classmethod
+    def concat(cls, tables):
+        '''
+        stack the visits of several tables (e.g. the partitions of each
+        year), the labels are unioned
+        '''
+        med_labels = pd.Index(np.concatenate(
+            [table.med_labels for table in tables])).unique()
+        gp_labels = pd.Index(np.concatenate(
+            [table.gp_labels for table in tables])).unique()
+        counts = np.concatenate([np.diff(table.indptr) for table in tables])
+        indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(
+            indptr,
+            np.concatenate([table.slots for table in tables]),
+            np.concatenate([
+                remap_codes(table.med_codes, table.med_labels, med_labels)
+                for table in tables]),
+            np.concatenate([
+                remap_codes(table.gp_codes, table.gp_labels, gp_labels)
+                for table in tables]),
+            med_labels, gp_labels)
+
+    def save(self, path=MEDICATION_TABLE):
+        part_file = path + '.part.npz'
+        np.savez(part_file, indptr=self.indptr, slots=self.slots,
+                 med_codes=self.med_codes, gp_codes=self.gp_codes,
+                 med_labels=self.med_labels.astype(str),
+                 gp_labels=self.gp_labels.astype(str))
+        os.replace(part_file, path)
+
+    @classmethod
+    def load(cls, path=MEDICATION_TABLE):
+        with np.load(path) as arrays:
+            return cls(arrays['indptr'], arrays['slots'], arrays['med_codes'],
+                       arrays['gp_codes'], arrays['med_labels'].astype(object),
+                       arrays['gp_labels'].astype(object))
+
+    def visit_ids(self):
+        '''
+        visit (row of the working dataframe) of each entry
+        '''
+        return np.repeat(np.arange(self.n_visits), np.diff(self.indptr))
+
+    def to_frame(self):
+        '''
+        the entries as a long dataframe (VISIT, SLOT, MED, GPMED)
+        '''
+        return pd.DataFrame({
+            'VISIT': self.visit_ids(),
+            'SLOT': self.slots,
+            'MED': pd.Categorical.from_codes(self.med_codes, self.med_labels),
+            'GPMED': pd.Categorical.from_codes(self.gp_codes, self.gp_labels),
+        })
+
+    def match_meds(self, patterns, case=False):
+        '''
+        (len(med_labels) + 1 x len(patterns)) boolean hits of regexes on the
+        MED labels, see match_vocabulary. A single regex gives 1-d hits.
+        '''
+        if isinstance(patterns, str):
+            return match_vocabulary(self.med_labels, [patterns], case)[:, 0]
+        return match_vocabulary(self.med_labels, patterns, case)
+
+    def match_status(self, statuses):
+        '''
+        (len(gp_labels) + 1) boolean hits of a list of GPMED labels, the
+        last entry (missing) is False
+        '''
+        return np.append(pd.Index(self.gp_labels).isin(statuses), False)
+
+    def any_given(self, med_hits, gp_hits=None):
+        '''
+        Reduce label hits to visits. med_hits is (len(med_labels) + 1 x
+        n_patterns) and gp_hits (len(gp_labels) + 1 x n_statuses), either
+        can also be 1-d.
+
+        Returns an (n_visits x n_patterns x n_statuses) boolean array, true
+        where a single entry of the visit matched both the pattern and the
+        status (1-d hits drop their axis). Without gp_hits the GPMED status
+        isn't looked at.
+        '''
+        med_hits = np.asarray(med_hits, dtype=bool)
+        entry_hits = med_hits[self.med_codes]
+        if gp_hits is None:
+            shape = med_hits.shape[1:]
+        else:
+            gp_hits = np.asarray(gp_hits, dtype=bool)
+            shape = med_hits.shape[1:] + gp_hits.shape[1:]
+            entry_hits = np.logical_and(
+                entry_hits.reshape(entry_hits.shape + (1,) * (gp_hits.ndim - 1)),
+                gp_hits[self.gp_codes].reshape(
+                    (len(self),) + (1,) * (med_hits.ndim - 1)
+                    + gp_hits.shape[1:]))
+        entry_hits = entry_hits.reshape(len(self), -1)
+        entries, columns = np.nonzero(entry_hits)
+        matched = np.zeros((self.n_visits, entry_hits.shape[1]), dtype=bool)
+        matched[self.visit_ids()[entries], columns] = True
+        return matched.reshape((self.n_visits,) + shape)
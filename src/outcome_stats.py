@@ -2,9 +2,11 @@
 For patients +/- hypertension, get the relative risk for outcomes
 '''
 import pandas as pd
-from stats import weighted_relative_risk, weighted_mean_difference_and_ci
+from stats import weighted_relative_risks, weighted_mean_differences
 from blood_pressure import Htn_definition
 from plot_category_by_bp import plot_category
+from shared_dataset import load_working_dataframe
+from feature_registry import select_columns
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -21,15 +23,15 @@ class OutcomeStats():
     outcome vs blood pressure plots for multiple outcomes.
 
     Parameters:
-    df = modified dataframe from the build_dataframe module
+    df = modified dataframe from the build_dataframe module, or a
+    FeatureFrame in which case only the outcome columns are computed
     htn_definition = class the holds bp cutoff variables and can create
     a boolean filter for if a patient has hypertension.
     queries = list of lists containing [['outcome col name',
     'categorical|numeric']]
 
     EXAMPLE:
-    df = pd.read_pickle(
-        ('./outputs/working_dataframe.pkl'))
+    df = load_working_dataframe()
     queries = [
         ['DIED', 'categorical'],
         ['BPSYS', 'numeric'],
@@ -43,7 +45,9 @@ class OutcomeStats():
     '''
 
     def __init__(self, df, htn_definition, queries):
-        self.df = df
+        # BPSYS is needed for plot_queries
+        self.df = select_columns(
+            df, [outcome for outcome, _ in queries] + ['PATWT', 'BPSYS'])
         self.htn_definition = htn_definition
         self.queries = self.build_queries(queries)
         self.stats_table = None
@@ -65,36 +69,45 @@ class OutcomeStats():
         process a categorical query (binomial or multinomial) and return the
         RR, LCI, UCI of the RR
         '''
-        print(f'Processing outcome - {query.outcome}, {query.kind}')
-        exposure = self.htn_definition.get_triage_htn()  # boolean of some HTN cutoff
-        outcome = self.df[query.outcome]  # boolean of some outcome
-        weights = self.df['PATWT']
+        return tuple(self.process_categorical_queries([query]).iloc[0])
 
-        ser1 = outcome[~exposure]  # boolean outcome in NOT exposed
-        ser2 = outcome[exposure]  # boolean outcome in exposed
-        w1 = weights[ser1.index]
-        w2 = weights[ser2.index]
-        RR, LCI, UCI = weighted_relative_risk(ser1, ser2, w1, w2)
-
-        return RR, LCI, UCI
+    def process_categorical_queries(self, queries):
+        '''
+        RR, LCI and UCI of several categorical outcomes at once, a dataframe
+        indexed by outcome
+        '''
+        outcomes = [query.outcome for query in queries]
+        print(f'Processing outcomes - {", ".join(outcomes)}, categorical')
+        exposure = self.htn_definition.get_triage_htn()  # boolean of some HTN cutoff
+        RR, LCI, UCI = weighted_relative_risks(
+            self.df[outcomes].to_numpy(dtype=float),  # boolean outcomes
+            self.df['PATWT'].to_numpy(dtype=float),
+            exposure.to_numpy(dtype=bool))
+        return pd.DataFrame(
+            {'RR/DIFF': RR[0], 'LCI': LCI[0], 'UCI': UCI[0]}, index=outcomes)
 
     def process_numeric_query(self, query):
         '''
         return the weighted difference between two numeric series and
         also the CI for the difference
         '''
-        print(f'Processing outcome - {query.outcome}, {query.kind}')
-        exposure = self.htn_definition.get_triage_htn()  # boolean of some HTN cutoff
-        outcome = self.df[query.outcome]  # numeric series of some value
-        weights = self.df['PATWT']
+        return tuple(self.process_numeric_queries([query]).iloc[0])
 
-        ser1 = outcome[~exposure].dropna()  # outcome when NOT exposed
-        ser2 = outcome[exposure].dropna()  # outcome when exposed
-        w1 = weights.loc[ser1.index]
-        w2 = weights.loc[ser2.index]
-        mean_difference, LCI, UCI = weighted_mean_difference_and_ci(
-            ser1, ser2, w1, w2)
-        return mean_difference, LCI, UCI
+    def process_numeric_queries(self, queries):
+        '''
+        weighted mean difference (exposed - not exposed) and its CI of
+        several numeric outcomes at once, missing values are left out
+        '''
+        outcomes = [query.outcome for query in queries]
+        print(f'Processing outcomes - {", ".join(outcomes)}, numeric')
+        exposure = self.htn_definition.get_triage_htn()  # boolean of some HTN cutoff
+        mean_difference, LCI, UCI = weighted_mean_differences(
+            self.df[outcomes].to_numpy(dtype=float),
+            self.df['PATWT'].to_numpy(dtype=float),
+            exposure.to_numpy(dtype=bool))
+        return pd.DataFrame(
+            {'RR/DIFF': mean_difference[0], 'LCI': LCI[0], 'UCI': UCI[0]},
+            index=outcomes)
 
     def categorical_query_counts(self, query):
         '''
@@ -145,18 +158,29 @@ class OutcomeStats():
             'LCI': '-',
             'UCI': '-',
         }, index=['TOTAL'])
+
+        # RR/DIFF of every query of a kind in one batch
+        effects = []
+        for kind, process in [('categorical', self.process_categorical_queries),
+                              ('numeric', self.process_numeric_queries)]:
+            queries = [query for query in self.queries if query.kind == kind]
+            if queries:
+                effects.append(process(queries))
+        if effects:
+            effects = pd.concat(effects)
+
+        tables = [table]
         for query in self.queries:
             if query.kind == 'categorical':
-                RR_OR_DIFF, LCI, UCI = self.process_categorical_query(query)
                 not_exposed_value, exposed_value = self.categorical_query_counts(
                     query)
             elif query.kind == 'numeric':
                 # DIFF = mean_difference
-                RR_OR_DIFF, LCI, UCI = self.process_numeric_query(query)
                 not_exposed_value, exposed_value = self.numeric_mean_values(
                     query)
             else:
                 return ValueError()
+            RR_OR_DIFF, LCI, UCI = effects.loc[query.outcome]
             new_row = pd.DataFrame({
                 'KIND': query.kind,
                 'NOT_EXPOSED': not_exposed_value,
@@ -165,7 +189,8 @@ class OutcomeStats():
                 'LCI': LCI,
                 'UCI': UCI,
             }, index=[query.outcome])
-            table = pd.concat([table, new_row])
+            tables.append(new_row)
+        table = pd.concat(tables)
         self.stats_table = table
         return table
 
@@ -198,8 +223,7 @@ class OutcomeStats():
 
 
 if __name__ == "__main__":
-    df = pd.read_pickle(
-        ('./outputs/working_dataframe.pkl'))
+    df = load_working_dataframe()
     queries = [
         ['DIED', 'categorical'],
         ['ADMITHOS', 'categorical'],
@@ -5,6 +5,8 @@ categories. Used the OutcomeStats class in the outcome_stats module.
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+from shared_dataset import load_working_dataframe
+from feature_registry import select_columns
 
 
 def weighted_average(df, category):
@@ -14,6 +16,7 @@ def weighted_average(df, category):
 
 
 def plot_category(df, ax, category, kind):
+    df = select_columns(df, [category, 'BPSYS', 'PATWT'])
     bins = [60, 80, 100, 120, 140, 160, 180, 200, 220, 300]
     binned_sbp = pd.cut(df.BPSYS, bins)
     G = df.groupby(binned_sbp, observed=False)
@@ -44,8 +47,7 @@ def plot_category(df, ax, category, kind):
 
 
 if __name__ == "__main__":
-    df = pd.read_pickle(
-        ('./outputs/working_dataframe.pkl'))
+    df = load_working_dataframe()
     fig, ax = plt.subplots(figsize=(12, 6))
     plot_category(df, ax, 'ED_LOS', 'numeric')
     plt.tight_layout()
@@ -0,0 +1,108 @@
+'''
+Row filters that are pushed down into the parquet reader.
+
+A RowFilter keeps the rows where predicate(parse(column)) is true. Rather
+than parsing the column for every row, the filter is planned per file: the
+distinct raw values of the column are read (for categorical columns that is
+just the dictionary), parsed and tested once, and the values that pass
+become a pyarrow 'isin' expression. The reader then only hands over the
+surviving rows, so nothing downstream (the RFV/MED/DIAG features) is
+computed for rows that would be thrown away.
+
+Example use:
+adults = RowFilter('AGE', lambda age: age >= 18, parse=parse_age)
+expression = filter_expression('ed2015.parquet', [adults])
+table = pq.read_table('ed2015.parquet', filters=expression)
+'''
+import hashlib
+import inspect
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+def func_source(func):
+    '''
+    source of a function for hashing, builtins (e.g. int or np.isfinite)
+    have none so their qualified name stands in for it
+    '''
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        name = getattr(func, '__qualname__', None) or repr(func)
+        return f"{getattr(func, '__module__', None) or ''}.{name}"
+
+
+class RowFilter():
+    '''
+    column - raw column the filter is on
+    predicate - vectorized function of the parsed values returning booleans
+    parse - vectorized function turning raw values into what the predicate
+    expects, e.g. pd.to_numeric (default the raw values)
+    '''
+
+    def __init__(self, column, predicate, parse=None):
+        self.column = column
+        self.predicate = predicate
+        self.parse = parse
+
+    def keep_values(self, values):
+        '''
+        boolean array, true for the values (a series) the filter keeps
+        '''
+        parsed = values if self.parse is None else self.parse(values)
+        keep = pd.Series(self.predicate(pd.Series(parsed)))
+        return keep.fillna(False).to_numpy(dtype=bool)
+
+    def signature(self):
+        '''
+        hash of the filter's definition, so that partitions built with a
+        different filter are rebuilt
+        '''
+        source = self.column
+        for func in [self.predicate, self.parse]:
+            if func is not None:
+                source += func_source(func)
+        return hashlib.sha256(source.encode()).hexdigest()
+
+
+def distinct_values(file, column):
+    '''
+    the distinct values of a column of a parquet file as an arrow array,
+    only that column is read
+    '''
+    values = pq.read_table(file, columns=[column]).column(column)
+    if not pa.types.is_dictionary(values.type):
+        return pc.unique(values)
+    # the dictionaries hold every distinct value, only missing is extra
+    unique = pc.unique(pa.chunked_array(
+        [chunk.dictionary for chunk in values.chunks],
+        values.type.value_type))
+    if values.null_count > 0:
+        unique = pa.concat_arrays([unique, pa.nulls(1, unique.type)])
+    return unique
+
+
+def filter_expression(file, row_filters, column_names=None):
+    '''
+    Plan row_filters for a parquet file, returns a pyarrow expression that
+    keeps the rows every filter keeps (None if there are no filters).
+
+    column_names maps a filter's column to its name in the file, for
+    columns that were renamed (see COLUMN_ALIASES in build_dataframe).
+    '''
+    column_names = column_names or {}
+    expression = None
+    for row_filter in row_filters:
+        column = column_names.get(row_filter.column, row_filter.column)
+        values = distinct_values(file, column)
+        keep = row_filter.keep_values(
+            pd.Series(values.to_pylist(), dtype=object))
+        is_null = values.is_null().to_numpy(zero_copy_only=False)
+        kept_values = values.filter(pa.array(keep & ~is_null))
+        condition = pc.field(column).isin(kept_values)
+        if (keep & is_null).any():
+            condition = condition | pc.field(column).is_null()
+        expression = condition if expression is None else expression & condition
+    return expression
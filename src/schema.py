@@ -0,0 +1,102 @@
+'''
+Explicit dtypes for the working dataframe.
+
+tweak_df leaves many columns in wasteful dtypes (0/1 indicators as int64,
+text as object, blood pressures as float64). apply_schema is run at the end
+of tweak_df so that the working dataframe, and every copy of it made for a
+blood pressure cutoff, is as small as possible.
+
+- binary indicators are int8 (0/1) or bool
+- blood pressure, pulse, age and lengths of stay are float32, they are all
+  small whole numbers so float32 holds them exactly
+- text columns (DIAG, RFV, MED, GPMED, ...) are categorical
+- survey design variables (PATWT, CSTRATM, CPSUM) stay float64
+
+A float column that is still categorical (e.g. HOSP_LOS, the raw LOS
+labels) is parsed label by label, labels that aren't numbers (missing value
+labels such as 'Blank' or 'Not Applicable') become NaN.
+'''
+import numpy as np
+import pandas as pd
+
+INDICATOR_COLUMNS = [
+    'XRAY', 'MRI', 'CATSCAN', 'CBC', 'TROPONIN', 'ATTENDING', 'RESIDENT',
+    'HX_HTN', 'MIDLEVEL', 'DYSPNEA_VISIT', 'CHEST_PAIN_VISIT',
+    'ABDOMINAL_PAIN_VISIT', 'TYLENOL_GIVEN', 'ANTIHYPERTENSIVE_GIVEN',
+    'ANTIHYPERTENSIVE_RX',
+]
+
+BOOLEAN_COLUMNS = [
+    'ADMITHOS', 'LWBS', 'ADMITS_COMBINED', 'DISCHARGED_COMBINED', 'LEFT_AMA',
+    'TRIAGE_TACHYCARDIA', 'NO_TRIAGE_BP', 'STROKE', 'MI', 'HTNEMERGENCY',
+    'HTN_COMPLICATION', 'DIED',
+]
+
+FLOAT32_COLUMNS = [
+    'AGE', 'BPSYS', 'BPSYSD', 'BPDIAS', 'BPDIASD', 'PULSE', 'ED_LOS',
+    'HOSP_LOS',
+]
+
+CATEGORY_COLUMNS = (
+    ['ARRTIME', 'LOS', 'LOV']
+    + [f'DIAG{i}' for i in range(1, 6)]
+    + [f'RFV{i}' for i in range(1, 6)]
+    + [f'MED{i}' for i in range(1, 31)]
+    + [f'GPMED{i}' for i in range(1, 31)]
+)
+
+WORKING_SCHEMA = {
+    'YEAR': 'int16',
+    **{col: 'int8' for col in INDICATOR_COLUMNS},
+    **{col: 'bool' for col in BOOLEAN_COLUMNS},
+    **{col: 'float32' for col in FLOAT32_COLUMNS},
+    **{col: 'category' for col in CATEGORY_COLUMNS},
+}
+
+
+def parse_numeric_categories(ser):
+    '''
+    float values of a categorical of number labels ('3.0' or 3.0), parsed
+    once per category. Labels that aren't numbers are NaN.
+    '''
+    numbers = pd.to_numeric(
+        pd.Series(ser.cat.categories, dtype=object), errors='coerce')
+    values = np.append(numbers.to_numpy(dtype=float), np.nan)
+    return pd.Series(values[ser.cat.codes], index=ser.index, name=ser.name)
+
+
+def apply_schema(df, schema=WORKING_SCHEMA):
+    '''
+    cast the columns of df that are in the schema, other columns are left
+    as they are
+    '''
+    dtypes = {}
+    for col, dtype in schema.items():
+        if col not in df.columns or df[col].dtype == dtype:
+            continue
+        if dtype.startswith('float') and df[col].dtype == 'category':
+            # e.g. HOSP_LOS which is still the raw LOS labels
+            df = df.assign(**{col: parse_numeric_categories(df[col])})
+        dtypes[col] = dtype
+    return df.astype(dtypes)
+
+
+def memory_audit(before, after):
+    '''
+    compare the deep memory usage of a dataframe before and after
+    apply_schema, one row per column that changed plus a TOTAL row, in MB
+    '''
+    audit = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'mb_before': before.memory_usage(deep=True, index=False) / 1e6,
+        'dtype_after': after.dtypes.astype(str),
+        'mb_after': after.memory_usage(deep=True, index=False) / 1e6,
+    })
+    audit = audit[audit.dtype_before != audit.dtype_after]
+    totals = pd.DataFrame({
+        'dtype_before': '-',
+        'mb_before': before.memory_usage(deep=True).sum() / 1e6,
+        'dtype_after': '-',
+        'mb_after': after.memory_usage(deep=True).sum() / 1e6,
+    }, index=['TOTAL'])
+    return pd.concat([audit, totals])
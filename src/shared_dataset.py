@@ -0,0 +1,89 @@
+'''
+Memory-mappable copy of the working dataframe.
+
+build_dataframe writes the working dataframe as an uncompressed Arrow IPC
+(feather v2) file next to the pickle. Opening it memory-maps the file, so
+numeric columns are used in place without being deserialised and every
+process that opens the file shares the same physical pages through the OS
+page cache.
+
+Float columns are stored with NaN rather than Arrow nulls, otherwise pyarrow
+has to copy them to fill the NaNs back in. Categorical columns only copy
+their (small) integer codes.
+
+A file written in several record batches (export_shared_batches, used by the
+memory budgeted build) is still memory-mapped, but its columns are copied
+into one array each when it is read as a dataframe.
+'''
+import os
+import pandas as pd
+import pyarrow as pa
+
+WORKING_PICKLE = './outputs/working_dataframe.pkl'
+SHARED_DATASET = './outputs/working_dataframe.arrow'
+
+
+def to_arrow_array(ser):
+    if pd.api.types.is_float_dtype(ser.dtype):
+        # keep NaN as a value so the column can be read zero-copy
+        return pa.array(ser.to_numpy(), from_pandas=False)
+    return pa.array(ser)
+
+
+def to_record_batch(df):
+    return pa.RecordBatch.from_arrays(
+        [to_arrow_array(df[col]) for col in df.columns],
+        names=[str(col) for col in df.columns])
+
+
+def export_shared_dataset(df, path=SHARED_DATASET):
+    '''
+    write df as an uncompressed Arrow IPC file, the index is not stored
+    (the working dataframe has a RangeIndex)
+    '''
+    export_shared_batches([df], path)
+
+
+def export_shared_batches(dfs, path=SHARED_DATASET):
+    '''
+    write an iterable of dataframes as one Arrow IPC file, a record batch
+    per dataframe. They need the same columns and dtypes (categoricals with
+    the same categories). Only one dataframe is converted at a time, so the
+    dataframes never have to fit in memory together.
+    '''
+    part_file = path + '.part'
+    with pa.OSFile(part_file, 'wb') as sink:
+        writer = None
+        for df in dfs:
+            batch = to_record_batch(df)
+            if writer is None:
+                writer = pa.ipc.new_file(sink, batch.schema)
+            writer.write_batch(batch)
+        if writer is None:
+            raise ValueError('no dataframes to export')
+        writer.close()
+    os.replace(part_file, path)
+
+
+def open_shared_dataset(path=SHARED_DATASET, columns=None):
+    '''
+    memory-map the Arrow file and return it as a dataframe, optionally only
+    some of the columns. Numeric columns are read-only views on the mapped
+    file.
+    '''
+    source = pa.memory_map(path, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas(split_blocks=True)
+
+
+def load_working_dataframe(columns=None):
+    '''
+    open the shared Arrow copy of the working dataframe if it exists,
+    otherwise fall back to the pickle
+    '''
+    if os.path.exists(SHARED_DATASET):
+        return open_shared_dataset(columns=columns)
+    df = pd.read_pickle(WORKING_PICKLE)
+    return df if columns is None else df[columns]
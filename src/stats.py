@@ -1,87 +1,175 @@
 '''
 Contains many functions that calculate weighted/unweighted statistics
 for the dataset.
+
+The array kernels (weighted_moments, weighted_proportions,
+weighted_relative_risks, weighted_mean_differences, ...) take numpy arrays
+and do many outcomes for many groups at once: outcomes is an
+(n_rows x n_outcomes) matrix, groups/exposure an (n_rows x n_groups)
+boolean matrix and the results are (n_groups x n_outcomes) arrays. A 1-d
+array counts as a single column. The functions that take pandas Series are
+thin wrappers around them.
 '''
 import pandas as pd
 import numpy as np
 from scipy.stats import chi2_contingency
-from scipy.stats import t, norm
+from scipy.stats import t, norm, chi2
 from statsmodels.stats.proportion import proportion_confint
 
 
-def weighted_mean_and_ci(df):
-    # calculate the weighted mean and CI for pandas dataframe
-    # loc[:, 0] needs to be the series
-    # loc[:, 1] needs to be the weights
-    df = df.dropna()
-    data = df.iloc[:, 0]
-    weights = df.iloc[:, 1]
-    normalized_weights = weights / sum(weights)
-
-    # Calculate the weighted mean
-    weighted_mean = np.average(data, weights=normalized_weights)
+def as_columns(values):
+    '''
+    float (n_rows x n_columns) array, a 1-d array is a single column
+    '''
+    values = np.asarray(values, dtype=float)
+    return values[:, None] if values.ndim == 1 else values
 
-    # Calculate the weighted standard error
-    # sample size is actually sum of weights, not the length of dataset
-    sample_size = sum(weights)
-    weighted_variance = sum(normalized_weights * (data - weighted_mean)**2)
-    weighted_std = np.sqrt(weighted_variance)
 
-    # Calculate the sample size
+def group_weights(weights, groups=None):
+    '''
+    (n_rows x n_groups) weights of the rows in each group and zero outside
+    it, groups None is a single group of every row
+    '''
+    weights = np.asarray(weights, dtype=float)
+    if groups is None:
+        return weights[:, None]
+    return as_columns(groups) * weights[:, None]
 
-    # Define the desired confidence level
-    confidence_level = 0.95
 
-    # Calculate the critical value based on the t-distribution
+def weighted_moments(outcomes, weights, groups=None):
+    '''
+    (sum of weights, weighted mean, weighted variance) of each outcome in
+    each group, all (n_groups x n_outcomes). Missing (NaN) outcomes and
+    weights are left out. The variance is sum(w * (x - mean)**2) / sum(w)
+    like everywhere else in this module.
+    '''
+    outcomes = as_columns(outcomes)
+    weights = np.asarray(weights, dtype=float)
+    present = ~np.isnan(outcomes) & ~np.isnan(weights)[:, None]
+    W = np.nan_to_num(group_weights(weights, groups))
+    # centre on the plain mean so the variance doesn't lose precision
+    shift = (np.where(present, outcomes, 0.0).sum(axis=0)
+             / np.maximum(present.sum(axis=0), 1))
+    centred = np.where(present, outcomes - shift, 0.0)
+    total = W.T @ present
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (W.T @ centred) / total
+        variance = (W.T @ centred**2) / total - mean**2
+    return total, mean + shift, np.maximum(variance, 0)
+
+
+def weighted_means_and_cis(outcomes, weights, groups=None,
+                           confidence_level=0.95):
+    '''
+    weighted mean of each outcome in each group and its t distribution
+    confidence interval, (mean, lower, upper). The sample size is the sum
+    of the weights.
+    '''
+    total, mean, variance = weighted_moments(outcomes, weights, groups)
     # critical value is how many standard errors to go out
-    z = t.ppf((1 + confidence_level) / 2, df=sample_size - 1)
+    z = t.ppf((1 + confidence_level) / 2, df=total - 1)
+    SE = np.sqrt(variance) / np.sqrt(total)
+    return mean, mean - z*SE, mean + z*SE
+
+
+def weighted_proportions(outcomes, weights, groups=None):
+    '''
+    weighted proportion of each 0/1 outcome in each group
+    '''
+    W = group_weights(weights, groups)
+    return (W.T @ as_columns(outcomes)) / W.sum(axis=0)[:, None]
+
+
+def relative_risks_from_counts(a, n_exposed, b, n_not_exposed):
+    '''
+    relative risk and its 95% CI from (weighted) counts, elementwise:
+    a - exposed with outcome, b - not exposed with outcome
+    '''
+    RR = (a / n_exposed) / (b / n_not_exposed)
+    log_RR = np.log(RR)
+
+    # gives the z value for 0.975 on the normal Z-distribution
+    z = norm.ppf(0.975)  # 95% using Z-distribution
+    # standard error of log relative risk
+    SE = np.sqrt((1/a) - (1/n_exposed) + (1/b) - (1/n_not_exposed))
+    return RR, np.exp(log_RR - z*SE), np.exp(log_RR + z*SE)
+
+
+def weighted_relative_risks(outcomes, weights, exposure):
+    '''
+    relative risk (exposed vs not exposed) of each 0/1 outcome for each
+    exposure definition, (RR, LCI, UCI). exposure is a boolean array or an
+    (n_rows x n_exposures) matrix, e.g. one column per blood pressure
+    cutoff.
+    '''
+    exposure = as_columns(exposure)
+    outcomes = as_columns(outcomes)
+    exposed = group_weights(weights, exposure)
+    not_exposed = group_weights(weights, 1 - exposure)
+    return relative_risks_from_counts(
+        exposed.T @ outcomes, exposed.sum(axis=0)[:, None],
+        not_exposed.T @ outcomes, not_exposed.sum(axis=0)[:, None])
 
-    # Calculate the margin of error
-    SE = weighted_std / np.sqrt(sample_size)
 
-    # Calculate the lower and upper bounds of the confidence interval
-    lower_bound = weighted_mean - z*SE
-    upper_bound = weighted_mean + z*SE
+def mean_differences_from_moments(n1, mean1, variance1, n2, mean2, variance2):
+    '''
+    difference of the means (group 2 - group 1) and its 95% CI from the
+    weighted moments of the two groups, elementwise
+    '''
+    mean_difference = mean2 - mean1
+    SE_difference = np.sqrt(variance1/n1 + variance2/n2)
+    return (mean_difference, mean_difference - 1.96*SE_difference,
+            mean_difference + 1.96*SE_difference)
+
 
-    return weighted_mean, lower_bound, upper_bound
+def weighted_mean_differences(outcomes, weights, exposure):
+    '''
+    weighted difference of the mean of each outcome (exposed - not
+    exposed) for each exposure definition, (difference, LCI, UCI). Missing
+    outcomes are left out.
+    '''
+    exposure = as_columns(exposure)
+    return mean_differences_from_moments(
+        *weighted_moments(outcomes, weights, 1 - exposure),
+        *weighted_moments(outcomes, weights, exposure))
+
+
+def weighted_mean_and_ci(df):
+    # calculate the weighted mean and CI for pandas dataframe
+    # loc[:, 0] needs to be the series
+    # loc[:, 1] needs to be the weights
+    df = df.dropna()
+    mean, lower, upper = weighted_means_and_cis(df.iloc[:, 0], df.iloc[:, 1])
+    return mean[0, 0], lower[0, 0], upper[0, 0]
 
 
 def weighted_mean_and_std(ser, weights):
     ser = ser.dropna()
-    weights = weights[ser.index]
-    normalized_weights = weights / sum(weights)
-    weighted_mean = np.average(ser, weights=normalized_weights)
-
-    # Calculate the weighted standard deviation
-    # sample size is actually sum of weights, not the length of dataset
-    sample_size = sum(weights)
-    weighted_variance = sum(normalized_weights * (ser - weighted_mean)**2)
-    weighted_std = np.sqrt(weighted_variance)
+    _, mean, variance = weighted_moments(ser, weights[ser.index])
+    return mean[0, 0], np.sqrt(variance[0, 0])
 
-    # Calculate the lower and upper bounds of the confidence interval
 
-    return weighted_mean, weighted_std
+def align_weights(ser, weights):
+    '''
+    weights matched to the values of ser by index when both are pandas
+    Series, otherwise by position
+    '''
+    if isinstance(ser, pd.Series) and isinstance(weights, pd.Series):
+        return weights[ser.index]
+    return weights
 
 
 def weighted_mean_difference_and_ci(ser1, ser2, weights1, weights2):
     assert len(ser1) == len(weights1)
     assert len(ser2) == len(weights2)
-    normalized_weights1 = weights1 / sum(weights1)
-    normalized_weights2 = weights2 / sum(weights2)
-    x1 = np.average(ser1, weights=weights1)
-    x2 = np.average(ser2, weights=weights2)
-    n1 = sum(weights1)
-    n2 = sum(weights2)
-    v1 = sum(normalized_weights1 * (ser1 - x1)**2)
-    v2 = sum(normalized_weights2 * (ser2 - x2)**2)
-    s1 = np.sqrt(v1)
-    s2 = np.sqrt(v2)
-
-    mean_difference = x2 - x1
-    SE_difference = np.sqrt(s1**2/n1 + s2**2/n2)
-    LCI = mean_difference - 1.96*SE_difference
-    UCI = mean_difference + 1.96*SE_difference
-    return mean_difference, LCI, UCI
+    # a missing value makes the result missing (weighted_moments would
+    # leave it out), drop them first to ignore them
+    if np.isnan(as_columns(ser1)).any() or np.isnan(as_columns(ser2)).any():
+        return np.nan, np.nan, np.nan
+    mean_difference, LCI, UCI = mean_differences_from_moments(
+        *weighted_moments(ser1, align_weights(ser1, weights1)),
+        *weighted_moments(ser2, align_weights(ser2, weights2)))
+    return mean_difference[0, 0], LCI[0, 0], UCI[0, 0]
 
 
 def calculate_proportions_and_CI(df, col):
@@ -115,29 +203,16 @@ def calculate_proportions_and_CI(df, col):
 
 
 def weighted_relative_risk(ser2, ser1, w2, w1):
-    a = sum(ser1 * w1)  # exposed with outcome
-    b = sum(ser2 * w2)  # not_exposed with outcome
-    c = sum(w1) - a    # exposed without outcome
-    d = sum(w2) - b    # not_exposed without outcome
-    RR = (a / (a + c)) / (b / (b + d))
-    log_RR = np.log(RR)
-
-    # gives the z value for 0.975 on the normal Z-distribution
-    z = norm.ppf(0.975)  # 95% using Z-distribution
-    # standard error of log relative risk
-    SE = np.sqrt((1/a) - (1/(a+c)) + (1/b) - (1/(b+d)))
-    log_LCI = log_RR - z*SE
-    log_UCI = log_RR + z*SE
-    LCI = np.exp(log_LCI)
-    UCI = np.exp(log_UCI)
-
-    return RR, LCI, UCI
+    # ser1/w1 are exposed, ser2/w2 not exposed
+    w1 = np.asarray(align_weights(ser1, w1), dtype=float)
+    w2 = np.asarray(align_weights(ser2, w2), dtype=float)
+    a = np.asarray(ser1, dtype=float) @ w1  # exposed with outcome
+    b = np.asarray(ser2, dtype=float) @ w2  # not_exposed with outcome
+    return relative_risks_from_counts(a, w1.sum(), b, w2.sum())
 
 
 def weighted_proportion(ser, weights):
-    positives = sum(ser*weights)
-    total = sum(weights)
-    return positives / total
+    return weighted_proportions(ser, align_weights(ser, weights))[0, 0]
 
 
 def contingency(ser1, ser2):
@@ -169,6 +244,44 @@ def weighted_chi2(ser1, ser2, weights):
     return p_value
 
 
+def chi2_2x2(true1, false1, true2, false2):
+    '''
+    vectorized chi square p values for many 2x2 tables
+    [[true1, false1], [true2, false2]] (arrays of the same length), the
+    same test as chi2_contingency including the Yates correction
+    '''
+    observed = np.stack([
+        np.asarray(true1, dtype=float), np.asarray(false1, dtype=float),
+        np.asarray(true2, dtype=float), np.asarray(false2, dtype=float),
+    ])  # 4 x n_tables, the cells in row major order
+    row1 = observed[0] + observed[1]
+    row2 = observed[2] + observed[3]
+    col1 = observed[0] + observed[2]
+    col2 = observed[1] + observed[3]
+    total = row1 + row2
+    expected = np.stack([row1 * col1, row1 * col2,
+                         row2 * col1, row2 * col2]) / total
+    # Yates: move each cell up to 0.5 towards its expected value
+    difference = np.abs(observed - expected)
+    difference = difference - np.minimum(0.5, difference)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        statistic = (difference ** 2 / expected).sum(axis=0)
+    return chi2.sf(statistic, 1)
+
+
+def weighted_category_counts(codes, weights, n_categories):
+    '''
+    weighted count of each category from an array of category codes (-1 is
+    missing and isn't counted), one bincount whatever the number of
+    categories
+    '''
+    codes = np.asarray(codes)
+    present = codes >= 0
+    return np.bincount(codes[present],
+                       weights=np.asarray(weights, dtype=float)[present],
+                       minlength=n_categories)
+
+
 def weighted_contingency(ser1, ser2, weights):
     '''
     create the weighted contingency table between two series
@@ -182,10 +295,9 @@ def weighted_contingency(ser1, ser2, weights):
     ), "All indices of ser2 must be included in weights' index"
     assert (ser1.cat.categories == ser2.cat.categories).all()
     categories = ser1.cat.categories
-    table = pd.DataFrame(index=categories, columns=[
-                         'ser1', 'ser2']).astype(float)
-
-    for c in categories:
-        table.loc[c, 'ser1'] = ((ser1 == c) * weights[ser1.index]).sum()
-        table.loc[c, 'ser2'] = ((ser2 == c) * weights[ser2.index]).sum()
-    return table
+    return pd.DataFrame({
+        'ser1': weighted_category_counts(
+            ser1.cat.codes, weights[ser1.index], len(categories)),
+        'ser2': weighted_category_counts(
+            ser2.cat.codes, weights[ser2.index], len(categories)),
+    }, index=categories)
@@ -1,13 +1,6 @@
 import re
-
-
-def diagnosis_filter(df, pattern):
-    # create a single column boolean indicator that marks if a text
-    # sequence was in any of the DIAG columns
-    data = df[['DIAG1', 'DIAG2', 'DIAG3', 'DIAG4', 'DIAG5']]
-    indicator = data.apply(lambda col: col.str.contains(
-        pattern, regex=True, case=False)).any(axis=1)
-    return indicator
+import numpy as np
+import pandas as pd
 
 
 def unmeasured_bps(raw_df, col):
@@ -56,9 +49,168 @@ def column_equivelancy(dfs, column_regex):
 
 
 def map_timerange(time):
-    if time >= 7 and time < 15:
-        return '7a-3p'
-    elif time >= 15 and time < 23:
-        return '3p-11p'
+    # single hour version of bin_timerange
+    return bin_timerange([time])[0]
+
+
+def bin_timerange(hours):
+    '''
+    shift of an array of hours: '7a-3p' (7-14), '3p-11p' (15-22) or
+    '11p-7a' (everything else, missing hours included)
+    '''
+    hours = np.asarray(hours, dtype=float)
+    return np.select(
+        [(hours >= 7) & (hours < 15), (hours >= 15) & (hours < 23)],
+        ['7a-3p', '3p-11p'],
+        '11p-7a').astype(object)
+
+
+def parse_distinct(ser, parse):
+    '''
+    Run parse (a vectorized function of a series, e.g. pd.to_numeric) on
+    each distinct value of ser once and broadcast the results back to the
+    rows through the codes, so parsing costs O(unique values) instead of
+    O(rows). parse is also given one missing value, what it returns for it is
+    used for the missing rows.
+
+    Example use:
+    age = parse_distinct(df.AGE, lambda ser: pd.to_numeric(
+        ser.replace({'Under one year': 0.0})))
+    '''
+    if isinstance(ser.dtype, pd.CategoricalDtype):
+        codes, uniques = ser.cat.codes.to_numpy(), ser.cat.categories
     else:
-        return '11p-7a'
+        codes, uniques = pd.factorize(ser)
+    # the trailing NaN is what code -1 (missing) maps to
+    distinct = pd.Series(list(uniques) + [np.nan], dtype=object)
+    parsed = pd.Series(parse(distinct)).to_numpy()
+    return pd.Series(parsed[codes], index=ser.index, name=ser.name)
+
+
+def recode_categories(ser, recode):
+    '''
+    Recode a categorical series with a dict {old label: new label} at the
+    category level, only the categories and the integer codes are touched,
+    never the values.
+
+    - labels that end up the same are merged
+    - labels recoded to NaN become missing (e.g. 'Blank')
+    - the key None gives a label for missing values (like fillna)
+
+    Example use:
+    recode_categories(df.ARREMS, {'Blank': 'Unknown', None: 'Unknown'})
+    '''
+    if not isinstance(ser.dtype, pd.CategoricalDtype):
+        ser = ser.astype('category')
+    fill = recode.get(None)
+    categories = ser.cat.categories
+    renamed = pd.Index([recode.get(c, c) for c in categories])
+    is_missing = renamed.isna()
+    if renamed.is_unique and not is_missing.any() and fill is None:
+        return ser.cat.rename_categories(renamed)
+
+    # a label merged into an existing category takes that category's place
+    # (like Series.replace), otherwise the place of its first old label
+    positions = {}
+    for idx, (old, new) in enumerate(zip(categories, renamed)):
+        if is_missing[idx]:
+            continue
+        if old == new:
+            positions[new] = idx
+        else:
+            positions.setdefault(new, idx)
+    new_categories = pd.Index(sorted(positions, key=positions.get))
+    if fill is not None and fill not in new_categories:
+        new_categories = new_categories.append(pd.Index([fill]))
+    fill_code = -1 if fill is None else new_categories.get_loc(fill)
+    # old code -> new code, the trailing entry is for missing values (code -1)
+    lookup = np.append(new_categories.get_indexer(renamed), -1)
+    codes = lookup[ser.cat.codes.to_numpy()]
+    codes[codes == -1] = fill_code
+    return pd.Series(
+        pd.Categorical.from_codes(codes, new_categories,
+                                  ordered=ser.cat.ordered),
+        index=ser.index, name=ser.name)
+
+
+def harmonise_categories(ser, aliases):
+    '''
+    Rename the categories of a categorical series with an aliases dict
+    {old label: new label}. Labels that end up the same are merged, which
+    only touches the categories and the integer codes, never the values.
+    '''
+    return recode_categories(ser, aliases)
+
+
+def union_categories(sers):
+    '''
+    return the union of the categories of several categorical series in the
+    order they are first seen. If every input is sorted the union is sorted
+    too, which matches what astype('category') gives on the combined data.
+    '''
+    categories = [ser.cat.categories for ser in sers]
+    union = categories[0].append(categories[1:]).unique()
+    if all(c.is_monotonic_increasing for c in categories):
+        try:
+            union = union.sort_values()
+        except TypeError:
+            pass
+    return union
+
+
+def concat_categorical(dfs, codebook=None):
+    '''
+    Concatenate dataframes (e.g. NHAMCS years) so that columns that are
+    categorical in every frame stay categorical. pd.concat turns them into
+    object dtype as soon as the category sets differ.
+
+    codebook is an optional dict {column: {old label: new label}} used to
+    harmonise labels that are spelled differently between years before the
+    category sets are unioned.
+    '''
+    codebook = codebook or {}
+    # shallow, the recoded columns are swapped in without touching the input
+    dfs = [df.copy(deep=False) for df in dfs]
+    columns = pd.Index([]).append([df.columns for df in dfs]).unique()
+    for col in columns:
+        present = [df for df in dfs if col in df.columns]
+        if not all(isinstance(df[col].dtype, pd.CategoricalDtype)
+                   for df in present):
+            continue
+        if col in codebook:
+            for df in present:
+                df[col] = harmonise_categories(df[col], codebook[col])
+        dtype = pd.CategoricalDtype(
+            union_categories([df[col] for df in present]),
+            ordered=present[0][col].cat.ordered)
+        for df in dfs:
+            if col in df.columns:
+                df[col] = df[col].cat.set_categories(dtype.categories)
+            else:
+                # e.g. dropped as all missing for a year
+                df[col] = pd.Categorical([None] * len(df), dtype=dtype)
+    return pd.concat(dfs, axis=0)
+
+
+def concat_memory_report(dfs, codebook=None):
+    '''
+    Compare the memory used by a plain pd.concat of the frames with
+    concat_categorical. Returns a table with one row per column that
+    changed plus a TOTAL row, sizes in MB.
+    '''
+    plain = pd.concat(dfs, axis=0)
+    harmonised = concat_categorical(dfs, codebook)
+    report = pd.DataFrame({
+        'dtype_concat': plain.dtypes.astype(str),
+        'mb_concat': plain.memory_usage(deep=True, index=False) / 1e6,
+        'dtype_categorical': harmonised.dtypes.astype(str),
+        'mb_categorical': harmonised.memory_usage(deep=True, index=False) / 1e6,
+    })
+    report = report[report.dtype_concat != report.dtype_categorical]
+    totals = pd.DataFrame({
+        'dtype_concat': '-',
+        'mb_concat': plain.memory_usage(deep=True).sum() / 1e6,
+        'dtype_categorical': '-',
+        'mb_categorical': harmonised.memory_usage(deep=True).sum() / 1e6,
+    }, index=['TOTAL'])
+    return pd.concat([report, totals])
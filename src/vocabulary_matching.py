@@ -0,0 +1,178 @@
+'''
+Regex matching over groups of text columns that share one vocabulary, such
+as RFV1-RFV5, DIAG1-DIAG5 or MED1-MED30.
+
+Rather than running str.contains over every row of every column, each
+pattern is evaluated once per distinct value and the results are mapped
+back to the rows through the categorical codes. The vocabulary is a few
+thousand strings at most, so the cost no longer grows with the number of
+visits times the number of patterns.
+
+Example use:
+indicators = vocabulary_indicators(df, ['RFV1', 'RFV2'], {
+    'CHEST_PAIN_VISIT': 'chest pain',
+    'ABDOMINAL_PAIN_VISIT': 'abdominal pain',
+})
+'''
+import re
+import numpy as np
+import pandas as pd
+from utility_functions import union_categories
+
+
+def as_categorical(ser):
+    if isinstance(ser.dtype, pd.CategoricalDtype):
+        return ser
+    return ser.astype('category')
+
+
+def code_matrix(df, columns):
+    '''
+    Encode columns against their shared vocabulary.
+
+    Returns (codes, vocabulary) where codes is an (n_rows x n_columns)
+    integer array indexing into vocabulary and -1 marks a missing value.
+    '''
+    sers = [as_categorical(df[col]) for col in columns]
+    vocabulary = union_categories(sers)
+    codes = np.empty((len(df), len(columns)), dtype=np.int32)
+    for j, ser in enumerate(sers):
+        # category code -> vocabulary code, the trailing -1 keeps missing
+        lookup = np.append(vocabulary.get_indexer(ser.cat.categories), -1)
+        codes[:, j] = lookup[ser.cat.codes.to_numpy()]
+    return codes, vocabulary
+
+
+def match_vocabulary(vocabulary, patterns, case=False):
+    '''
+    Evaluate each regex in patterns once per vocabulary entry.
+
+    Returns a (len(vocabulary) + 1 x len(patterns)) boolean array. The extra
+    last row is all False so that a code of -1 (missing) never matches.
+    '''
+    text = pd.Series(np.asarray(vocabulary, dtype=object))
+    hits = np.zeros((len(vocabulary) + 1, len(patterns)), dtype=bool)
+    for j, pattern in enumerate(patterns):
+        hits[:-1, j] = text.str.contains(
+            pattern, case=case, regex=True, na=False).to_numpy()
+    return hits
+
+
+def any_match(codes, hits):
+    '''
+    reduce an (n_rows x n_columns) code matrix and a vocabulary hit table
+    to an (n_rows x n_patterns) boolean array, true if any column matched
+    '''
+    matched = np.zeros((codes.shape[0], hits.shape[1]), dtype=bool)
+    for j in range(codes.shape[1]):
+        matched |= hits[codes[:, j]]
+    return matched
+
+
+def vocabulary_indicators(df, columns, patterns, case=False):
+    '''
+    For a dict of {name: regex} return a boolean dataframe with one column
+    per name that is true where the regex matches any of the columns.
+    '''
+    codes, vocabulary = code_matrix(df, columns)
+    hits = match_vocabulary(vocabulary, list(patterns.values()), case)
+    return pd.DataFrame(any_match(codes, hits), index=df.index,
+                        columns=list(patterns))
+
+
+def literal_prefix(pattern):
+    '''
+    If pattern is an anchored literal prefix such as r'^Intracerebral
+    hemorrhage' or r'^ST elevation \(STEMI\)' return the unescaped prefix,
+    otherwise None.
+    '''
+    if not pattern.startswith('^'):
+        return None
+    prefix = []
+    escaped = False
+    for char in pattern[1:]:
+        if escaped:
+            if char.isalnum():
+                # \d, \s, ... are character classes, not literals
+                return None
+            prefix.append(char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char in '.^$*+?{}[]|()':
+            return None
+        else:
+            prefix.append(char)
+    if escaped:
+        return None
+    return ''.join(prefix)
+
+
+class PrefixClassifier():
+    '''
+    Compiles any number of named lists of anchored prefix patterns (such as
+    the ICD lists in build_dataframe) into one prefix trie. Classifying a
+    string walks the trie once and reports every group with a pattern that
+    is a prefix of it, so adding groups costs almost nothing.
+
+    Patterns that aren't literal prefixes fall back to a regex search.
+
+    Example use:
+    classifier = PrefixClassifier({'STROKE': stroke_ICD, 'MI': cardiac_arrest_ICD})
+    hits = classifier.classify(vocabulary)
+    '''
+
+    def __init__(self, groups, case=False):
+        self.group_names = list(groups)
+        self.case = case
+        self.trie = {}
+        self.fallback = []
+        flags = 0 if case else re.IGNORECASE
+        for group_idx, patterns in enumerate(groups.values()):
+            for pattern in patterns:
+                prefix = literal_prefix(pattern)
+                if prefix is None:
+                    self.fallback.append(
+                        (group_idx, re.compile(pattern, flags)))
+                else:
+                    self.insert(self.normalise(prefix), group_idx)
+
+    def normalise(self, text):
+        return text if self.case else text.lower()
+
+    def insert(self, prefix, group_idx):
+        node = self.trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        # None marks the end of a prefix and holds its groups
+        node.setdefault(None, set()).add(group_idx)
+
+    def match(self, text):
+        '''
+        return the set of group indices that match a single string
+        '''
+        groups = set()
+        node = self.trie
+        for char in self.normalise(text):
+            groups |= node.get(None, set())
+            node = node.get(char)
+            if node is None:
+                break
+        else:
+            groups |= node.get(None, set())
+        for group_idx, regex in self.fallback:
+            if regex.search(text):
+                groups.add(group_idx)
+        return groups
+
+    def classify(self, vocabulary):
+        '''
+        Returns a (len(vocabulary) + 1 x n_groups) boolean array, in the
+        same layout as match_vocabulary.
+        '''
+        hits = np.zeros((len(vocabulary) + 1, len(self.group_names)),
+                        dtype=bool)
+        for i, text in enumerate(vocabulary):
+            if isinstance(text, str):
+                hits[i, list(self.match(text))] = True
+        return hits
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+from numpy.testing import assert_array_equal
+from antihypertensive_list import (
+    build_cardiovascular_med_filter, build_drug_class_filters,
+    get_category_codes)
+
+
+def make_raw_df():
+    return pd.DataFrame({
+        'RX1CAT1': ['Cardiovascular agents', 'Analgesics', None],
+        'RX1V1C2': ['Blank', 'Cardiovas agents', 'Anticoagulants'],
+        'RX3CAT2': pd.Series(['Blank', 'Anticoagulants', 'Cardiovascular agents'],
+                             dtype='category'),
+    })
+
+
+def test_cardiovascular_med_filter():
+    F = build_cardiovascular_med_filter(make_raw_df())
+
+    expected = np.zeros((3, 30), dtype=bool)
+    expected[0, 0] = expected[1, 0] = expected[2, 2] = True
+    assert_array_equal(F, expected)
+
+
+def test_drug_class_filters():
+    filters = build_drug_class_filters(make_raw_df(), {
+        'ANTICOAGULANT': r'Anticoagulants',
+        'ANALGESIC': r'Analgesics',
+    })
+
+    assert_array_equal(filters['ANTICOAGULANT'][:, [0, 2]],
+                       [[False, False], [False, True], [True, False]])
+    assert_array_equal(filters['ANALGESIC'].sum(axis=1), [0, 1, 0])
+
+
+def test_filters_without_rx_columns():
+    raw_df = pd.DataFrame({'MED1': ['Labetalol', 'Aspirin']})
+
+    codes, vocabulary = get_category_codes(raw_df)
+    assert codes.shape == (2, 30, 16)
+    assert (codes == -1).all()
+    assert len(vocabulary) == 0
+    assert not build_cardiovascular_med_filter(raw_df).any()
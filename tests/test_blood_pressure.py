@@ -1,6 +1,6 @@
 from pytest import approx
 from statsmodels.stats.weightstats import DescrStatsW
-from scipy.stats import t
+from scipy.stats import t, chi2_contingency
 from numpy.testing import assert_array_equal, assert_array_almost_equal
 import numpy as np
 import pandas as pd
@@ -22,6 +22,68 @@ def test_get_triage_htn():
     assert_array_equal(triage_htn, expected_values)
 
 
+def test_binomial_queries_batch():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'BPSYS': rng.uniform(90, 220, 200),
+        'BPDIAS': rng.uniform(50, 130, 200),
+        'BPSYSD': np.nan,
+        'BPDIASD': np.nan,
+        'CBC': rng.integers(0, 2, 200),
+        'XRAY': rng.integers(0, 2, 200),
+        'PATWT': rng.uniform(1000, 5000, 200),
+    })
+    htn_def = Htn_definition(df, 160, 100)
+    stats = CategoricalStats(
+        df, {'CBC': 'binomial', 'XRAY': 'binomial'}, htn_def).get_stats()
+    assert list(stats.index) == ['TOTALS', 'CBC', 'XRAY']
+
+    htn = htn_def.get_triage_htn()
+    for col in ['CBC', 'XRAY']:
+        w = df.PATWT
+        n_htn = (df[col] * w)[htn].sum()
+        n_nohtn = (df[col] * w)[~htn].sum()
+        _, p_value, _, _ = chi2_contingency([
+            [n_htn, w[htn].sum() - n_htn],
+            [n_nohtn, w[~htn].sum() - n_nohtn]])
+        assert_array_almost_equal(stats.loc[col].values, [
+            (n_htn + n_nohtn) / 1e6, n_nohtn / 1e6, n_htn / 1e6,
+            (n_htn + n_nohtn) / w.sum(), n_nohtn / w[~htn].sum(),
+            n_htn / w[htn].sum(), p_value])
+
+
+def test_multinomial_query():
+    df = pd.DataFrame({
+        'BPSYS': [170.0, 120.0, 180.0, 110.0, 190.0, 130.0, 165.0, 100.0],
+        'BPDIAS': [90.0] * 8,
+        'BPSYSD': np.nan,
+        'BPDIASD': np.nan,
+        'REGION': pd.Categorical(
+            ['West', 'South', None, 'West', 'South', 'Midwest', 'West',
+             'South'], categories=['Midwest', 'Northeast', 'South', 'West']),
+        'PATWT': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0],
+    })
+    htn_def = Htn_definition(df, 160, 100)
+    stats = CategoricalStats(df, {'REGION': 'multinomial'}, htn_def).get_stats()
+
+    # order of appearance, missing gets an all zero row
+    assert list(stats.index) == [
+        'TOTALS', 'REGION_West', 'REGION_South', 'REGION_nan',
+        'REGION_Midwest']
+    htn = htn_def.get_triage_htn()
+    for category in ['West', 'South', 'Midwest']:
+        is_category = df.REGION == category
+        w = df.PATWT
+        assert_array_almost_equal(stats.loc[f'REGION_{category}'].values[:6], [
+            w[is_category].sum() / 1e6,
+            w[is_category & ~htn].sum() / 1e6,
+            w[is_category & htn].sum() / 1e6,
+            w[is_category].sum() / w.sum(),
+            w[is_category & ~htn].sum() / w[~htn].sum(),
+            w[is_category & htn].sum() / w[htn].sum()])
+    assert (stats.loc['REGION_nan'].values[:6] == 0).all()
+
+
 def test_HTN_totals():
     df = pd.read_pickle('./outputs/working_dataframe.pkl')
     htn = (df.BPSYS > 200) | (df.BPDIAS > 120)
@@ -0,0 +1,205 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+import build_dataframe
+from column_cache import ColumnCache
+from build_dataframe import read_year, get_empty_columns
+from medication_table import MedicationTable
+from shared_dataset import WORKING_PICKLE, SHARED_DATASET, open_shared_dataset
+
+
+def test_read_year_reads_old_column_names(tmp_path):
+    file = tmp_path / 'ed2005.parquet'
+    pd.DataFrame({
+        'YEAR': [2005, 2005],
+        'RACEETH': ['White', 'Black'],
+        'PAYTYPE': ['Medicare', 'Self-pay'],
+        'AGE': [40, 50],
+    }).to_parquet(file)
+
+    df = read_year(file, columns=['YEAR', 'RACERETH', 'PAYTYPER', 'IMMEDR'])
+
+    assert list(df.columns) == ['YEAR', 'RACERETH', 'PAYTYPER']
+    assert df.RACERETH.tolist() == ['White', 'Black']
+
+
+def test_get_empty_columns_matches_dropna(tmp_path):
+    file = tmp_path / 'ed2015.parquet'
+    df = pd.DataFrame({
+        'AGE': [40.0, np.nan, 50.0],
+        'MED30': pd.Series([None, None, None], dtype=object),
+        'BPSYS': [np.nan, np.nan, np.nan],
+    })
+    df.to_parquet(file, row_group_size=2)
+
+    dropped = set(df.columns) - set(df.dropna(axis=1, how='all').columns)
+    assert get_empty_columns(file) == dropped
+
+
+def fake_build_partition(year, cache_directory=None, memory_budget=None,
+                         row_filters=None):
+    # a one row partition, so the test only exercises the manifest logic
+    fake_build_partition.built.append(year)
+    file, medication_file = f'working_{year}_0.pkl', f'medications_{year}_0.npz'
+    pd.DataFrame({'YEAR': [year], 'AGE': [40.0]}).to_pickle(
+        os.path.join(build_dataframe.WORKING_DIRECTORY, file))
+    MedicationTable.from_dataframe(pd.DataFrame({
+        'MED1': ['Aspirin'], 'GPMED1': ['Given in ED']})).save(
+        os.path.join(build_dataframe.WORKING_DIRECTORY, medication_file))
+    return {'files': [file], 'medication_files': [medication_file], 'rows': 1,
+            'source': build_dataframe.get_source_signature(year)}
+
+
+def test_build_dataframe_only_rebuilds_stale_years(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('outputs/parquet')
+    monkeypatch.setattr(build_dataframe, 'PARQUET_DIRECTORY', 'outputs/parquet')
+    monkeypatch.setattr(build_dataframe, 'WORKING_DIRECTORY', 'outputs/working')
+    pipeline_module = tmp_path / 'tweaks.py'
+    pipeline_module.write_text('x = 1\n')
+    monkeypatch.setattr(build_dataframe, 'PIPELINE_FILES',
+                        [str(pipeline_module)])
+    monkeypatch.setattr(build_dataframe, 'build_partition',
+                        fake_build_partition)
+    fake_build_partition.built = []
+
+    def write_source(year, rows):
+        pd.DataFrame({'YEAR': [year] * rows}).to_parquet(
+            build_dataframe.get_parquet_file(year))
+
+    def build(years):
+        fake_build_partition.built = []
+        build_dataframe.build_dataframe(years=years, cache_directory=None)
+        return fake_build_partition.built
+
+    write_source(2015, 1)
+    write_source(2016, 1)
+    assert build([2015]) == [2015]
+    assert build([2015]) == []
+    # a new year
+    assert build([2015, 2016]) == [2016]
+    df = pd.read_pickle('outputs/working_dataframe.pkl')
+    assert df.YEAR.tolist() == [2015, 2016]
+    # the source of a year changed
+    write_source(2015, 2)
+    assert build([2015, 2016]) == [2015]
+    # the pipeline changed
+    pipeline_module.write_text('x = 2\n')
+    assert build([2015, 2016]) == [2015, 2016]
+    assert build([2015, 2016]) == []
+
+
+def test_pipeline_files_cover_the_partition_modules():
+    files = {os.path.basename(file) for file in build_dataframe.PIPELINE_FILES}
+    # every src module build_dataframe uses to make a partition
+    for module in ['build_dataframe', 'utility_functions', 'schema',
+                   'vocabulary_matching', 'feature_registry',
+                   'medication_table', 'column_cache', 'row_filters']:
+        assert f'{module}.py' in files
+    assert all(os.path.exists(file) for file in
+               build_dataframe.PIPELINE_FILES if file.endswith('.py'))
+
+
+def test_medication_cache_follows_gpmed_status(tmp_path, monkeypatch):
+    df = pd.DataFrame({
+        'MED1': ['Tylenol', 'Tylenol', 'Aspirin'],
+        'GPMED1': ['Given in  ED', 'RX at discharge', 'Given in  ED'],
+    })
+    monkeypatch.setattr(build_dataframe, 'get_medication_queries', lambda: {
+        'TYLENOL_GIVEN': ('given', ['tylenol']),
+        'ANTIHYPERTENSIVE_GIVEN': ('given', ['labetalol']),
+        'ANTIHYPERTENSIVE_RX': ('rx', ['labetalol']),
+    })
+    feature = next(feature for feature in build_dataframe.FEATURES.features
+                   if feature.name == 'MEDICATIONS')
+    cache = ColumnCache(str(tmp_path))
+
+    assert feature.compute(df, cache).TYLENOL_GIVEN.tolist() == [1, 0, 0]
+    # redefining 'given' has to invalidate the cached columns
+    monkeypatch.setitem(build_dataframe.GPMED_STATUS, 'given',
+                        ['Given in  ED', 'RX at discharge'])
+    assert feature.compute(df, cache).TYLENOL_GIVEN.tolist() == [1, 1, 0]
+    assert_frame_equal(feature.compute(df, cache), feature.compute(df))
+
+
+@pytest.fixture
+def synthetic_years(tmp_path, monkeypatch):
+    '''
+    2500 visits each for 2015 and 2016 in outputs/parquet, the raw chunks go
+    into the partitions as they are
+    '''
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('outputs/parquet')
+    monkeypatch.setattr(build_dataframe, 'PARQUET_DIRECTORY', 'outputs/parquet')
+    monkeypatch.setattr(build_dataframe, 'WORKING_DIRECTORY', 'outputs/working')
+    monkeypatch.setattr(build_dataframe, 'PIPELINE_FILES', [])
+    monkeypatch.setattr(build_dataframe, 'raw_columns',
+                        ['YEAR', 'AGE', 'SEX', 'BPSYS', 'MED1', 'GPMED1'])
+    monkeypatch.setattr(build_dataframe, 'tweak_df',
+                        lambda df, cache=None: df.reset_index(drop=True))
+    rng = np.random.default_rng(0)
+    for year, sexes in [(2015, ['Female', 'Male']),
+                        (2016, ['Female', 'Male', 'Unknown'])]:
+        pd.DataFrame({
+            'YEAR': year,
+            'AGE': rng.integers(18, 90, 2500).astype(float),
+            'SEX': pd.Categorical(rng.choice(sexes, 2500)),
+            'BPSYS': np.where(rng.random(2500) < 0.1, np.nan,
+                              rng.normal(140, 20, 2500)),
+            'MED1': rng.choice(['Tylenol', 'Labetalol'], 2500),
+            'GPMED1': 'Given in  ED',
+        }).to_parquet(build_dataframe.get_parquet_file(year))
+    return [2015, 2016]
+
+
+def test_parallel_build_matches_serial(synthetic_years, monkeypatch):
+    # the workers are forked, so they see the patched tweak_df too
+    built = {}
+    for max_workers in [1, 2]:
+        monkeypatch.setattr(build_dataframe, 'WORKING_DIRECTORY',
+                            f'outputs/working_{max_workers}')
+        build_dataframe.build_dataframe(years=synthetic_years,
+                                        cache_directory=None,
+                                        max_workers=max_workers)
+        built[max_workers] = (build_dataframe.load_partitions(),
+                              build_dataframe.read_manifest())
+
+    serial, serial_manifest = built[1]
+    parallel, parallel_manifest = built[2]
+    assert len(serial) == 5000
+    assert_frame_equal(parallel, serial)
+    assert_frame_equal(pd.DataFrame(parallel_manifest['partitions']),
+                       pd.DataFrame(serial_manifest['partitions']))
+
+
+def test_memory_budget_build_streams_parts(synthetic_years):
+    pd.DataFrame({'OLD': [1]}).to_pickle(WORKING_PICKLE)
+
+    # the smallest chunk is 1000 rows
+    build_dataframe.build_dataframe(years=synthetic_years, cache_directory=None,
+                                    memory_budget=1)
+
+    manifest = build_dataframe.read_manifest()
+    assert manifest['partitions']['2016']['files'] == [
+        'working_2016_0.pkl', 'working_2016_1.pkl', 'working_2016_2.pkl']
+    assert not os.path.exists(WORKING_PICKLE)
+    shared = open_shared_dataset(SHARED_DATASET)
+    assert_frame_equal(shared, build_dataframe.load_partitions())
+    assert len(shared) == 5000
+    assert list(shared.SEX.cat.categories) == ['Female', 'Male', 'Unknown']
+    assert MedicationTable.load().n_visits == 5000
+
+
+def test_column_cache_depends_on_the_pipeline_modules(tmp_path):
+    cache = build_dataframe.get_column_cache(str(tmp_path))
+    other = ColumnCache(str(tmp_path))
+    assert cache.dependencies_hash != other.dependencies_hash
+    files = {os.path.basename(file)
+             for file in build_dataframe.PIPELINE_MODULE_FILES}
+    # the helpers of the cached DIAG/RFV/MED features
+    assert {'vocabulary_matching.py', 'medication_table.py',
+            'utility_functions.py'} <= files
+    # editing an ICD list in build_dataframe only invalidates its feature
+    assert 'build_dataframe.py' not in files
@@ -0,0 +1,89 @@
+import glob
+import os
+import pandas as pd
+import pytest
+from pandas.testing import assert_series_equal
+from column_cache import ColumnCache
+
+calls = []
+
+
+def count_matches(df, pattern):
+    calls.append(pattern)
+    return df.RFV1.str.contains(pattern)
+
+
+@pytest.fixture
+def rfv_df():
+    return pd.DataFrame({
+        'RFV1': ['Chest pain', 'Headache', 'Chest pain and cough'],
+        'AGE': [30.0, 40.0, 50.0],
+    })
+
+
+def test_hit_when_nothing_changed(rfv_df, tmp_path):
+    cache = ColumnCache(str(tmp_path))
+    calls.clear()
+    first = cache.get_or_compute('CHEST', rfv_df, ['RFV1'],
+                                 count_matches, 'Chest')
+    second = cache.get_or_compute('CHEST', rfv_df, ['RFV1'],
+                                  count_matches, 'Chest')
+
+    assert calls == ['Chest']
+    assert_series_equal(first, second)
+    # a fresh cache object over the same directory hits too
+    ColumnCache(str(tmp_path)).get_or_compute(
+        'CHEST', rfv_df, ['RFV1'], count_matches, 'Chest')
+    assert calls == ['Chest']
+
+
+def test_miss_when_args_or_inputs_change(rfv_df, tmp_path):
+    cache = ColumnCache(str(tmp_path))
+    calls.clear()
+    df = rfv_df
+    cache.get_or_compute('CHEST', df, ['RFV1'], count_matches, 'Chest')
+
+    cache.get_or_compute('CHEST', df, ['RFV1'], count_matches, 'Head')
+    assert calls == ['Chest', 'Head']
+
+    df.loc[1, 'RFV1'] = 'Chest pain'
+    result = cache.get_or_compute('CHEST', df, ['RFV1'], count_matches, 'Head')
+    assert calls == ['Chest', 'Head', 'Head']
+    assert result.tolist() == [False, False, False]
+
+    # columns that aren't inputs don't invalidate the entry
+    df['AGE'] = 0.0
+    cache.get_or_compute('CHEST', df, ['RFV1'], count_matches, 'Head')
+    assert len(calls) == 3
+
+
+def test_stale_entries_are_removed(rfv_df, tmp_path):
+    cache = ColumnCache(str(tmp_path))
+    df = rfv_df
+    cache.get_or_compute('CHEST', df, ['RFV1'], count_matches, 'Chest')
+    cache.get_or_compute('OTHER', df, ['RFV1'], count_matches, 'cough')
+    cache.get_or_compute('CHEST', df, ['RFV1'], count_matches, 'pain')
+
+    entries = sorted(os.path.basename(path)
+                     for path in glob.glob(str(tmp_path / '*.pkl')))
+    assert len(entries) == 2
+    assert [entry.split('-')[0] for entry in entries] == ['CHEST', 'OTHER']
+    assert not glob.glob(str(tmp_path / '*.part'))
+
+
+def test_miss_when_a_dependency_changes(rfv_df, tmp_path):
+    helper = tmp_path / 'helpers.py'
+    helper.write_text("PATTERN = 'Chest'\n")
+    cache_directory = str(tmp_path / 'cache')
+    calls.clear()
+    ColumnCache(cache_directory, [str(helper)]).get_or_compute(
+        'CHEST', rfv_df, ['RFV1'], count_matches, 'Chest')
+    ColumnCache(cache_directory, [str(helper)]).get_or_compute(
+        'CHEST', rfv_df, ['RFV1'], count_matches, 'Chest')
+    assert len(calls) == 1
+
+    # count_matches and its args are the same, the helper source is not
+    helper.write_text("PATTERN = 'chest'\n")
+    ColumnCache(cache_directory, [str(helper)]).get_or_compute(
+        'CHEST', rfv_df, ['RFV1'], count_matches, 'Chest')
+    assert len(calls) == 2
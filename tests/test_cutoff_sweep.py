@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from numpy.testing import assert_allclose
+from blood_pressure import Htn_definition
+from cutoff_sweep import CutoffSweep
+from stats import weighted_relative_risks, weighted_mean_differences
+
+
+def make_df():
+    rng = np.random.default_rng(0)
+    n = 400
+    df = pd.DataFrame({
+        # whole numbers so plenty of patients sit exactly on a cutoff
+        'BPSYS': rng.integers(90, 230, n).astype(float),
+        'BPDIAS': rng.integers(50, 140, n).astype(float),
+        'BPSYSD': np.nan,
+        'BPDIASD': np.nan,
+        'DIED': rng.integers(0, 2, n),
+        'ADMITHOS': rng.random(n) < 0.3,
+        'ED_LOS': rng.gamma(2, 100, n),
+        'PATWT': rng.uniform(1000, 5000, n),
+    })
+    df.loc[::13, 'BPSYS'] = np.nan
+    df.loc[::17, 'BPDIAS'] = np.nan
+    df.loc[::7, 'ED_LOS'] = np.nan
+    return df
+
+
+def test_sweep_matches_single_cutoffs():
+    df = make_df()
+    queries = [['DIED', 'categorical'], ['ADMITHOS', 'categorical'],
+               ['ED_LOS', 'numeric']]
+    sweep = CutoffSweep(df, queries, range(100, 221, 5), range(60, 131, 5))
+
+    for sbp, dbp in [(160, 100), (120, 80), (100, 130), (220, 60)]:
+        exposure = Htn_definition(df, sbp, dbp).get_triage_htn().to_numpy()
+        assert_allclose(sweep.exposure_totals().loc[sbp, dbp],
+                        df.PATWT[exposure].sum() / 1e6)
+
+        RR = weighted_relative_risks(
+            df[['DIED', 'ADMITHOS']].to_numpy(dtype=float), df.PATWT,
+            exposure)
+        for j, outcome in enumerate(['DIED', 'ADMITHOS']):
+            assert_allclose(
+                [value.loc[sbp, dbp] for value in sweep.effect(outcome)],
+                [value[0, j] for value in RR])
+
+        difference = weighted_mean_differences(df.ED_LOS, df.PATWT, exposure)
+        assert_allclose(
+            [value.loc[sbp, dbp] for value in sweep.effect('ED_LOS')],
+            [value[0, 0] for value in difference])
+
+    table = sweep.to_frame()
+    assert len(table) == 3 * 25 * 15
+    curve = sweep.dose_response('DIED')
+    assert_allclose(curve['RR/DIFF'], sweep.effect('DIED')[0][130.0])
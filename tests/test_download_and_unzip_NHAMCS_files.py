@@ -0,0 +1,200 @@
+import os
+import pandas as pd
+import pyreadstat
+import pytest
+import requests
+from zipfile import ZipFile, BadZipFile
+from download_and_unzip_NHAMCS_files import FileDownloader, convert_zipped_spss
+
+ARCHIVE = b'0123456789' * 100
+
+
+class FakeResponse():
+    def __init__(self, status_code, body=b'', headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} error')
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+
+class FakeServer():
+    '''
+    stands in for requests.Session, serves ARCHIVE and records the Range
+    headers. ignore_range answers range requests with the whole file.
+    '''
+
+    def __init__(self, ignore_range=False):
+        self.ignore_range = ignore_range
+        self.ranges = []
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        requested = (headers or {}).get('Range')
+        self.ranges.append(requested)
+        if requested is None or self.ignore_range:
+            return FakeResponse(200, ARCHIVE)
+        start = int(requested[len('bytes='):-1])
+        if start >= len(ARCHIVE):
+            return FakeResponse(
+                416, headers={'Content-Range': f'bytes */{len(ARCHIVE)}'})
+        return FakeResponse(206, ARCHIVE[start:])
+
+
+def download(tmp_path, session, part=None):
+    downloader = FileDownloader('https://example.org/', ['ed2015-spss.zip'],
+                                str(tmp_path), chunk_size=64)
+    local_file = str(tmp_path / 'ed2015-spss.zip')
+    if part is not None:
+        with open(local_file + '.part', 'wb') as f:
+            f.write(part)
+    downloader.stream_download(session, 'ed2015-spss.zip', local_file)
+    assert not os.path.exists(local_file + '.part')
+    with open(local_file, 'rb') as f:
+        return f.read()
+
+
+def test_stream_download(tmp_path):
+    session = FakeServer()
+    assert download(tmp_path, session) == ARCHIVE
+    assert session.ranges == [None]
+
+
+def test_stream_download_resumes_with_range(tmp_path):
+    # 206, the rest is appended
+    session = FakeServer()
+    assert download(tmp_path, session, part=ARCHIVE[:300]) == ARCHIVE
+    assert session.ranges == ['bytes=300-']
+
+
+def test_stream_download_restarts_when_range_is_ignored(tmp_path):
+    # 200, the partial file is overwritten
+    session = FakeServer(ignore_range=True)
+    assert download(tmp_path, session, part=ARCHIVE[:300]) == ARCHIVE
+    assert session.ranges == ['bytes=300-']
+
+
+def test_stream_download_already_complete(tmp_path):
+    # 416 and the partial file is the whole archive
+    session = FakeServer()
+    assert download(tmp_path, session, part=ARCHIVE) == ARCHIVE
+    assert session.ranges == [f'bytes={len(ARCHIVE)}-']
+
+
+def test_stream_download_416_with_wrong_size_starts_over(tmp_path):
+    # longer than the archive, so it can't be a partial download of it
+    session = FakeServer()
+    assert download(tmp_path, session, part=ARCHIVE + b'junk') == ARCHIVE
+    assert session.ranges == [f'bytes={len(ARCHIVE) + 4}-', None]
+
+
+def test_stream_download_raises_http_errors(tmp_path):
+    class MissingFile(FakeServer):
+        def get(self, url, headers=None, stream=False, timeout=None):
+            return FakeResponse(404)
+
+    with pytest.raises(requests.HTTPError):
+        download(tmp_path, MissingFile())
+
+
+def test_copy_from_mirror(tmp_path):
+    mirror = tmp_path / 'mirror'
+    mirror.mkdir()
+    (mirror / 'ed2015-spss.zip').write_bytes(ARCHIVE)
+    download_directory = tmp_path / 'data'
+
+    for base_url in [str(mirror), mirror.as_uri()]:
+        downloader = FileDownloader(base_url, ['ed2015-spss.zip'],
+                                    str(download_directory))
+        assert downloader.get_mirror_directory() == str(mirror)
+        downloader.check_directory(str(download_directory / 'zipped_files'))
+        downloader.download_zipped_files()
+
+        local_file = download_directory / 'zipped_files' / 'ed2015-spss.zip'
+        assert local_file.read_bytes() == ARCHIVE
+        assert not os.path.exists(str(local_file) + '.part')
+        os.remove(local_file)
+
+
+def write_spss_zip(zip_file, year, ages):
+    sav_file = str(zip_file).replace('.zip', '.sav')
+    pyreadstat.write_sav(
+        pd.DataFrame({
+            'YEAR': float(year),
+            'AGE': ages,
+            'BPSYS': [120.0, -9.0, 140.0, 131.0][:len(ages)],
+        }),
+        sav_file,
+        variable_value_labels={
+            'AGE': {0.0: 'Under one year', 93.0: '93 years and over'},
+            'BPSYS': {-9.0: 'Blank'},
+        })
+    with ZipFile(zip_file, 'w') as zip_ref:
+        zip_ref.write(sav_file, f'ED{year}.sav')
+    os.remove(sav_file)
+
+
+def test_convert_zipped_spss_round_trip(tmp_path):
+    zip_file = str(tmp_path / 'ed2015-spss.zip')
+    write_spss_zip(zip_file, 2015, [0.0, 40.0, 93.0, 40.0])
+    parquet_file = str(tmp_path / 'ed2015-spss.parquet')
+
+    convert_zipped_spss(zip_file, parquet_file)
+    df = pd.read_parquet(parquet_file)
+
+    # labelled and plain values mix in one column, so the categories are
+    # stored as strings
+    assert df.AGE.dtype == 'category'
+    assert list(df.AGE.cat.categories) == [
+        '40.0', '93 years and over', 'Under one year']
+    assert df.AGE.tolist() == [
+        'Under one year', '40.0', '93 years and over', '40.0']
+    assert df.BPSYS.tolist() == ['120.0', 'Blank', '140.0', '131.0']
+    assert df.YEAR.tolist() == [2015.0] * 4
+    assert not os.path.exists(parquet_file + '.part')
+
+
+def convert(download_directory, zip_files, convert_workers):
+    downloader = FileDownloader('unused', [], str(download_directory),
+                                convert_workers=convert_workers)
+    downloader.check_directory(str(download_directory / 'parquet_files'))
+    downloader.zip_filenames = zip_files
+    downloader.file_converter()
+    return [pd.read_parquet(file) for file in downloader.parquet_filenames]
+
+
+def test_file_converter_parallel_matches_serial(tmp_path):
+    zip_files = [str(tmp_path / 'ed2015-spss.zip'),
+                 str(tmp_path / 'ed2016-spss.zip')]
+    write_spss_zip(zip_files[0], 2015, [0.0, 40.0, 93.0, 40.0])
+    write_spss_zip(zip_files[1], 2016, [25.0, 0.0, 61.0])
+
+    serial = convert(tmp_path / 'serial', zip_files, 1)
+    parallel = convert(tmp_path / 'parallel', zip_files, 2)
+
+    assert [len(df) for df in parallel] == [4, 3]
+    for expected, df in zip(serial, parallel):
+        pd.testing.assert_frame_equal(df, expected)
+
+
+def test_file_converter_raises_worker_errors(tmp_path):
+    zip_file = tmp_path / 'ed2015-spss.zip'
+    write_spss_zip(str(zip_file), 2015, [0.0, 40.0, 93.0, 40.0])
+    broken = tmp_path / 'ed2016-spss.zip'
+    broken.write_bytes(b'not a zip file')
+
+    with pytest.raises(BadZipFile):
+        convert(tmp_path / 'data', [str(zip_file), str(broken)], 2)
+    assert not os.path.exists(
+        tmp_path / 'data' / 'parquet_files' / 'ed2016-spss.parquet')
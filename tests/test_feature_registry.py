@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+from feature_registry import FeatureRegistry, FeatureFrame, select_columns
+
+
+def make_registry(calls):
+    def count(name, func):
+        def wrapped(df):
+            calls.append(name)
+            return func(df)
+        return wrapped
+
+    registry = FeatureRegistry()
+    registry.add('ADMITTED', ['ADMITHOS', 'OBSHOS'], count(
+        'ADMITTED', lambda df: (df.ADMITHOS == 'Yes') | (df.OBSHOS == 'Yes')))
+    # overwrites the raw column, ADMITTED above still sees 'Yes'/'No'
+    registry.add('ADMITHOS', ['ADMITHOS'], count(
+        'ADMITHOS', lambda df: df.ADMITHOS == 'Yes'))
+    registry.add('NOT_ADMITTED', ['ADMITTED'], count(
+        'NOT_ADMITTED', lambda df: ~df.ADMITTED))
+    return registry
+
+
+@pytest.fixture
+def base():
+    return pd.DataFrame({
+        'ADMITHOS': ['Yes', 'No', 'No'],
+        'OBSHOS': ['No', 'Yes', 'No'],
+        'PATWT': [1.0, 2.0, 3.0],
+    })
+
+
+def test_only_required_features_are_computed(base):
+    calls = []
+    frame = FeatureFrame(base, make_registry(calls))
+
+    df = frame.require(['NOT_ADMITTED', 'PATWT'])
+
+    assert df.NOT_ADMITTED.tolist() == [False, False, True]
+    assert calls == ['ADMITTED', 'NOT_ADMITTED']
+    frame['ADMITTED']
+    assert calls == ['ADMITTED', 'NOT_ADMITTED']
+
+
+def test_to_frame_matches_assign_chain(base):
+    calls = []
+    frame = FeatureFrame(base, make_registry(calls))
+
+    expected = (
+        base
+        .assign(
+            ADMITTED=lambda df: (df.ADMITHOS == 'Yes') | (df.OBSHOS == 'Yes'),
+            ADMITHOS=lambda df: df.ADMITHOS == 'Yes',
+            NOT_ADMITTED=lambda df: ~df.ADMITTED,
+        )
+    )
+    assert_frame_equal(frame.to_frame(), expected)
+    assert_frame_equal(select_columns(frame, ['ADMITHOS', 'PATWT']),
+                       expected[['ADMITHOS', 'PATWT']])
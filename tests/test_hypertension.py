@@ -0,0 +1,72 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from NHAMCS_hypertension import (
+    export_cutoffs, categorical_queries, outcome_queries)
+from shared_dataset import export_shared_dataset
+
+
+@pytest.fixture
+def working_df():
+    '''
+    a small working dataframe with the columns the cutoff export reads
+    '''
+    rng = np.random.default_rng(0)
+    n = 600
+    df = pd.DataFrame({
+        'YEAR': rng.integers(2015, 2019, n).astype('int16'),
+        'PATWT': rng.uniform(1000, 5000, n),
+    })
+    # every bin of plot_category needs visits
+    for col in ['BPSYS', 'BPSYSD']:
+        df[col] = rng.integers(61, 300, n).astype('float32')
+    for col in ['BPDIAS', 'BPDIASD']:
+        df[col] = rng.integers(50, 140, n).astype('float32')
+    df.loc[::13, 'BPSYS'] = np.nan
+    df.loc[::17, 'BPDIAS'] = np.nan
+    for col, query in categorical_queries.items():
+        if query == 'multinomial':
+            df[col] = pd.Categorical(rng.choice(['A', 'B', 'C'], n))
+        else:
+            df[col] = rng.integers(0, 2, n).astype('int8')
+    for col, query in outcome_queries:
+        if col in df:
+            continue
+        if query == 'categorical':
+            df[col] = rng.random(n) < 0.3
+        else:
+            df[col] = rng.gamma(2, 100, n).astype('float32')
+    return df
+
+
+def export(directory, df, max_workers):
+    os.makedirs(directory / 'outputs')
+    os.chdir(directory)
+    # the workers open the shared dataset themselves
+    export_shared_dataset(df)
+    export_cutoffs([[140, 90], [160, 100]], df, max_workers)
+    return {
+        os.path.relpath(os.path.join(root, file), directory / 'outputs')
+        for root, _, files in os.walk(directory / 'outputs')
+        for file in files
+    }
+
+
+def test_parallel_export_matches_serial(working_df, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    serial = export(tmp_path / 'serial', working_df, 1)
+    parallel = export(tmp_path / 'parallel', working_df, 2)
+
+    assert parallel == serial
+    assert 'category_by_bp.png' in serial
+    tables = sorted(file for file in serial if file.endswith('.csv'))
+    assert tables == [
+        os.path.join('stats_HTN_140_ 90', 'baseline_characteristics.csv'),
+        os.path.join('stats_HTN_140_ 90', 'outcome_stats.csv'),
+        os.path.join('stats_HTN_160_ 100', 'baseline_characteristics.csv'),
+        os.path.join('stats_HTN_160_ 100', 'outcome_stats.csv'),
+    ]
+    for file in tables:
+        assert ((tmp_path / 'parallel' / 'outputs' / file).read_text() ==
+                (tmp_path / 'serial' / 'outputs' / file).read_text())
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_array_equal
+from medication_index import MedicationIndex
+
+
+@pytest.fixture
+def slots_df():
+    return pd.DataFrame({
+        'MED1': pd.Series(['Labetalol', 'Aspirin', 'Blank', None],
+                          dtype='category'),
+        'MED2': ['Hydralazine', 'labetalol', 'Labetalol', 'Aspirin'],
+        'MED10': ['Aspirin', None, 'Labetalol', None],
+        'GPMED1': ['Given in  ED', 'RX at discharge', None, None],
+        'GPMED2': ['RX at discharge', 'Given in  ED', 'RX at discharge',
+                   'Given in  ED'],
+        'GPMED10': ['Given in  ED', None, 'RX at discharge', None],
+        'PATWT': [1e6, 2e6, 3e6, 4e6],
+    })
+
+
+def test_visits(slots_df, tmp_path):
+    index = MedicationIndex.from_dataframe(slots_df)
+    index.save(str(tmp_path / 'index.npz'))
+    index = MedicationIndex.load(str(tmp_path / 'index.npz'))
+
+    assert list(index.names) == ['aspirin', 'hydralazine', 'labetalol']
+    assert_array_equal(index.visits('Labetalol'), [0, 1, 2])
+    assert_array_equal(index.visits(['hydralazine', 'aspirin']), [0, 1, 3])
+    assert_array_equal(index.visits('labetalol', ['Given in  ED']), [0, 1])
+    assert len(index.visits('unknown drug')) == 0
+    postings = index.postings('labetalol')
+    assert list(postings.slot) == [1, 2, 2, 10]
+    assert list(postings.GPMED) == [
+        'Given in  ED', 'Given in  ED', 'RX at discharge', 'RX at discharge']
+
+
+def test_weighted_counts_and_co_occurrence(slots_df):
+    df = slots_df
+    index = MedicationIndex.from_dataframe(df)
+    exposure = np.array([True, False, True, False])
+
+    counts = index.weighted_counts(df.PATWT, exposure)
+    # labetalol is in two slots of visit 2 but only counts once
+    assert counts.loc['labetalol'].tolist() == [6.0, 2.0, 4.0]
+    assert counts.loc['aspirin'].tolist() == [7.0, 6.0, 1.0]
+    given = index.weighted_counts(df.PATWT, exposure, ['labetalol'],
+                                  ['Given in  ED'])
+    assert given.loc['labetalol'].tolist() == [3.0, 2.0, 1.0]
+
+    co = index.co_occurrence(['labetalol', 'aspirin'])
+    assert_array_equal(co.to_numpy(), [[3, 2], [2, 3]])
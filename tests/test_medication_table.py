@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_array_equal
+from medication_table import MedicationTable
+
+
+@pytest.fixture
+def slots_df():
+    return pd.DataFrame({
+        'MED1': pd.Series(['Labetalol', 'Tylenol', 'NO ENTRY MADE', None],
+                          dtype='category'),
+        'MED2': ['Hydralazine', 'NO ENTRY MADE', 'Labetalol', 'Aspirin'],
+        'GPMED1': ['Given in  ED', 'RX at discharge', 'Not applicable', None],
+        'GPMED2': ['RX at discharge', 'Not applicable', 'Given in  ED',
+                   'Both given and RX marked'],
+    })
+
+
+def test_from_dataframe_drops_empty_slots(slots_df, tmp_path):
+    table = MedicationTable.from_dataframe(slots_df)
+    table.save(str(tmp_path / 'table.npz'))
+    table = MedicationTable.load(str(tmp_path / 'table.npz'))
+
+    assert table.n_visits == 4
+    long = table.to_frame()
+    assert list(long.VISIT) == [0, 0, 1, 2, 3]
+    assert list(long.SLOT) == [1, 2, 1, 2, 2]
+    assert list(long.MED) == [
+        'Labetalol', 'Hydralazine', 'Tylenol', 'Labetalol', 'Aspirin']
+    assert list(long.GPMED) == [
+        'Given in  ED', 'RX at discharge', 'RX at discharge', 'Given in  ED',
+        'Both given and RX marked']
+
+
+def test_any_given_matches_slot_scan(slots_df):
+    df = slots_df
+    table = MedicationTable.concat([
+        MedicationTable.from_dataframe(df.iloc[:2]),
+        MedicationTable.from_dataframe(df.iloc[2:]),
+    ])
+    patterns = ['labetalol|hydralazine', 'aspirin']
+    statuses = [['Given in  ED', 'Both given and RX marked'],
+                ['RX at discharge', 'Both given and RX marked']]
+    gp_hits = np.column_stack(
+        [table.match_status(status) for status in statuses])
+    matched = table.any_given(table.match_meds(patterns), gp_hits)
+
+    assert matched.shape == (4, 2, 2)
+    for p, pattern in enumerate(patterns):
+        for q, status in enumerate(statuses):
+            expected = np.zeros(4, dtype=bool)
+            for slot in [1, 2]:
+                expected |= (
+                    df[f'MED{slot}'].astype(object).str.contains(
+                        pattern, case=False, na=False)
+                    & df[f'GPMED{slot}'].isin(status)).to_numpy()
+            assert_array_equal(matched[:, p, q], expected)
+
+    assert_array_equal(table.any_given(table.match_meds('labetalol')),
+                       [True, False, True, False])
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+from row_filters import RowFilter, filter_expression
+
+
+def parse_age(ser):
+    return pd.to_numeric(ser.replace({'Under one year': 0.0,
+                                      '93 years and over': 94.0}))
+
+
+def test_filter_expression_matches_pandas_filter(tmp_path):
+    file = tmp_path / 'ed2015.parquet'
+    df = pd.DataFrame({
+        'AGE': pd.Series(['Under one year', '17', '18', '93 years and over',
+                          None, '40'], dtype='category'),
+        'SEX': ['Male', 'Female', 'Female', 'Male', 'Female', 'Male'],
+        'PULSE': [80.0, np.nan, 120.0, 90.0, 70.0, 101.0],
+    })
+    df.to_parquet(file)
+    row_filters = [
+        RowFilter('AGE', lambda age: age >= 18, parse=parse_age),
+        RowFilter('PULSE', lambda pulse: ~(pulse <= 100)),
+    ]
+
+    expression = filter_expression(file, row_filters)
+    filtered = pd.read_parquet(file, filters=expression)
+
+    age = parse_age(df.AGE.astype(object))
+    expected = df[(age >= 18) & ~(df.PULSE <= 100)]
+    assert filtered.SEX.tolist() == expected.SEX.tolist()
+    assert filtered.AGE.astype(object).tolist() == ['18', '40']
+
+
+def is_study_year(year):
+    return year >= 2015
+
+
+def test_signature_of_builtins():
+    year_filter = RowFilter('YEAR', is_study_year, parse=int)
+
+    assert year_filter.signature() == RowFilter(
+        'YEAR', is_study_year, parse=int).signature()
+    assert year_filter.signature() != RowFilter(
+        'YEAR', is_study_year, parse=float).signature()
+    assert RowFilter('PULSE', np.isfinite).signature() != RowFilter(
+        'PULSE', np.isnan).signature()
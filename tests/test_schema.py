@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+from schema import apply_schema, memory_audit, parse_numeric_categories
+
+
+def make_df():
+    return pd.DataFrame({
+        'YEAR': [2015, 2016, 2016],
+        'XRAY': [0, 1, 1],
+        'DIED': [False, True, False],
+        'BPSYS': [120.0, np.nan, 181.0],
+        'HOSP_LOS': pd.Series(['3.0', 'Blank', '12.0'], dtype='category'),
+        'DIAG1': ['Stroke', 'Chest pain', 'Stroke'],
+        'PATWT': [1000.5, 2000.25, 3000.125],
+        'NOT_IN_SCHEMA': ['a', 'b', 'c'],
+    })
+
+
+def test_apply_schema_casts_dtypes():
+    df = make_df()
+    cast = apply_schema(df)
+
+    assert cast.YEAR.dtype == 'int16'
+    assert cast.XRAY.dtype == 'int8'
+    assert cast.DIED.dtype == 'bool'
+    assert cast.BPSYS.dtype == 'float32'
+    assert cast.DIAG1.dtype == 'category'
+    assert cast.DIAG1.tolist() == df.DIAG1.tolist()
+    np.testing.assert_array_equal(cast.BPSYS, [120.0, np.nan, 181.0])
+    # stray labels in a categorical float column are missing
+    assert cast.HOSP_LOS.dtype == 'float32'
+    np.testing.assert_array_equal(cast.HOSP_LOS, [3.0, np.nan, 12.0])
+    # input is not modified
+    assert df.YEAR.dtype == 'int64'
+
+
+def test_apply_schema_leaves_other_columns():
+    df = make_df()
+    cast = apply_schema(df, {'YEAR': 'int16', 'MISSING_COLUMN': 'int8'})
+
+    assert list(cast.columns) == list(df.columns)
+    assert cast.YEAR.dtype == 'int16'
+    for col in ['NOT_IN_SCHEMA', 'PATWT', 'BPSYS', 'HOSP_LOS']:
+        pd.testing.assert_series_equal(cast[col], df[col])
+
+
+def test_parse_numeric_categories():
+    ser = pd.Series(pd.Categorical(['3.0', None, 'Not Applicable', 7.0, '3.0']))
+    np.testing.assert_array_equal(parse_numeric_categories(ser),
+                                  [3.0, np.nan, np.nan, 7.0, 3.0])
+
+
+def test_memory_audit():
+    df = make_df()
+    audit = memory_audit(df, apply_schema(df))
+
+    assert audit.index[-1] == 'TOTAL'
+    # only the columns whose dtype changed are listed
+    assert set(audit.index[:-1]) == {
+        'YEAR', 'XRAY', 'BPSYS', 'HOSP_LOS', 'DIAG1'}
+    assert audit.loc['YEAR', 'dtype_before'] == 'int64'
+    assert audit.loc['YEAR', 'dtype_after'] == 'int16'
+    assert audit.loc['YEAR', 'mb_after'] == audit.loc['YEAR', 'mb_before'] / 4
+    assert audit.loc['TOTAL', 'mb_after'] < audit.loc['TOTAL', 'mb_before']
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from shared_dataset import export_shared_dataset, open_shared_dataset
+
+
+def make_df():
+    return pd.DataFrame({
+        'BPSYS': [120.0, np.nan, 180.0],
+        'AGE': np.array([30, 45, 90], dtype=np.int8),
+        'DIED': [False, True, False],
+        'RACERETH': pd.Categorical(['White', None, 'Hispanic'],
+                                   categories=['Hispanic', 'White']),
+        'VDATE': pd.to_datetime(['2015-01-01', None, '2016-06-30']),
+    })
+
+
+def test_round_trip(tmp_path):
+    df = make_df()
+    path = str(tmp_path / 'working_dataframe.arrow')
+    export_shared_dataset(df, path)
+
+    shared = open_shared_dataset(path)
+
+    assert_frame_equal(shared, df)
+    assert not shared.BPSYS.to_numpy().flags.writeable
+    assert_frame_equal(open_shared_dataset(path, columns=['AGE', 'RACERETH']),
+                       df[['AGE', 'RACERETH']])
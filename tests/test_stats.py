@@ -1,5 +1,7 @@
 from stats import (weighted_contingency, weighted_mean_and_ci, weighted_chi2,
-                   weighted_mean_difference_and_ci, weighted_relative_risk)
+                   weighted_mean_difference_and_ci, weighted_relative_risk,
+                   chi2_2x2, weighted_relative_risks, weighted_mean_differences,
+                   weighted_proportions, weighted_proportion)
 from pandas.api.types import CategoricalDtype
 import pandas as pd
 import numpy as np
@@ -185,3 +187,90 @@ def test_weighted_chi2_2():
     expected = 0.104276  # with yates correction
     calculated = weighted_chi2(ser1, ser2, weights)
     assert abs(expected - calculated) < 0.05
+
+
+def test_chi2_2x2_matches_chi2_contingency():
+    tables = np.array([
+        [13, 6, 7, 12],
+        [4, 6, 7, 3],
+        [10.5, 0.2, 9.7, 0.4],  # small cells, the Yates correction is capped
+        [1e6, 2e6, 1.5e6, 2.5e6],
+    ])
+    calculated = chi2_2x2(*tables.T)
+    for table, p_value in zip(tables, calculated):
+        _, expected, _, _ = chi2_contingency(table.reshape(2, 2))
+        assert abs(expected - p_value) < 1e-12
+
+
+def test_batch_kernels_match_series_functions():
+    rng = np.random.default_rng(0)
+    n = 300
+    weights = rng.uniform(1, 10, n)
+    outcomes = rng.integers(0, 2, (n, 3))
+    values = rng.normal(150, 20, (n, 2))
+    values[::5, 0] = np.nan
+    # two exposure definitions
+    exposure = np.column_stack([values[:, 1] > 160, values[:, 1] > 140])
+
+    RR, LCI, UCI = weighted_relative_risks(outcomes, weights, exposure)
+    difference, diff_LCI, diff_UCI = weighted_mean_differences(
+        values, weights, exposure)
+    proportions = weighted_proportions(outcomes, weights, exposure)
+    assert RR.shape == proportions.shape == (2, 3)
+    assert difference.shape == (2, 2)
+
+    for i in range(2):
+        e = exposure[:, i]
+        for j in range(3):
+            expected = weighted_relative_risk(
+                pd.Series(outcomes[~e, j]), pd.Series(outcomes[e, j]),
+                pd.Series(weights[~e]), pd.Series(weights[e]))
+            np.testing.assert_allclose(
+                [RR[i, j], LCI[i, j], UCI[i, j]], expected)
+            np.testing.assert_allclose(
+                proportions[i, j],
+                weighted_proportion(pd.Series(outcomes[e, j]),
+                                    pd.Series(weights[e])))
+        for j in range(2):
+            present = ~np.isnan(values[:, j])
+            expected = weighted_mean_difference_and_ci(
+                pd.Series(values[~e & present, j]),
+                pd.Series(values[e & present, j]),
+                pd.Series(weights[~e & present]),
+                pd.Series(weights[e & present]))
+            np.testing.assert_allclose(
+                [difference[i, j], diff_LCI[i, j], diff_UCI[i, j]], expected)
+
+
+def test_series_functions_align_weights_by_index():
+    ser1 = pd.Series([1, 0, 0, 1], index=[10, 11, 12, 13])
+    ser2 = pd.Series([0, 0, 1, 0], index=[20, 21, 22, 23])
+    w1 = pd.Series([1.0, 2.0, 3.0, 4.0], index=ser1.index)
+    w2 = pd.Series([2.0, 1.0, 2.0, 1.0], index=ser2.index)
+    # the same weights in a different row order
+    shuffled1 = w1[[13, 11, 10, 12]]
+    shuffled2 = w2[[22, 20, 23, 21]]
+
+    np.testing.assert_allclose(
+        weighted_relative_risk(ser2, ser1, shuffled2, shuffled1),
+        weighted_relative_risk(ser2, ser1, w2, w1))
+    np.testing.assert_allclose(
+        weighted_mean_difference_and_ci(
+            ser1.astype(float), ser2.astype(float), shuffled1, shuffled2),
+        weighted_mean_difference_and_ci(
+            ser1.astype(float), ser2.astype(float), w1, w2))
+    assert weighted_proportion(ser1, shuffled1) == weighted_proportion(ser1, w1)
+
+
+def test_weighted_mean_difference_and_ci_missing_values():
+    ser1 = pd.Series([1.0, np.nan, 3.0])
+    ser2 = pd.Series([2.0, 4.0, 6.0])
+    weights = pd.Series([1.0, 1.0, 1.0])
+
+    assert np.isnan(
+        weighted_mean_difference_and_ci(ser1, ser2, weights, weights)).all()
+    # dropping them gives the difference of the present values
+    present = ser1.notna()
+    mean_difference, _, _ = weighted_mean_difference_and_ci(
+        ser1[present], ser2, weights[present], weights)
+    assert abs(mean_difference - 2.0) < 1e-12
@@ -0,0 +1,96 @@
+import pandas as pd
+import numpy as np
+from pandas.testing import assert_series_equal
+from utility_functions import (
+    harmonise_categories, recode_categories, concat_categorical,
+    concat_memory_report, parse_distinct, bin_timerange, map_timerange)
+
+
+def test_harmonise_categories_merges_labels():
+    ser = pd.Series(['No charge/Charity', 'No charge/charity', None, 'Medicare'],
+                    dtype='category')
+    harmonised = harmonise_categories(
+        ser, {'No charge/charity': 'No charge/Charity'})
+
+    assert harmonised.dtype == 'category'
+    assert list(harmonised.cat.categories) == ['Medicare', 'No charge/Charity']
+    assert harmonised.tolist()[:2] == ['No charge/Charity'] * 2
+    assert pd.isna(harmonised[2])
+    assert harmonised[3] == 'Medicare'
+
+
+def test_recode_categories_matches_replace():
+    ser = pd.Series(['Yes', 'Blank', None, 'No', 'Unknown', 'DOA'],
+                    dtype='category')
+    recode = {'Blank': 'Unknown', 'DOA': np.nan, None: 'Unknown'}
+
+    recoded = recode_categories(ser, recode)
+
+    assert recoded.tolist() == ['Yes', 'Unknown', 'Unknown', 'No', 'Unknown',
+                                'Unknown']
+    # 'Blank' is merged into the existing 'Unknown' category
+    assert list(recoded.cat.categories) == ['No', 'Unknown', 'Yes']
+
+
+def test_concat_categorical_keeps_category_dtype():
+    df1 = pd.DataFrame({
+        'PAYTYPER': pd.Series(['Medicaid', 'Self-pay'], dtype='category'),
+        'AGE': [30.0, 40.0],
+    })
+    df2 = pd.DataFrame({
+        'PAYTYPER': pd.Series(['Medicaid or CHIP', 'Self-pay', 'Medicare'],
+                              dtype='category'),
+        'AGE': [50.0, 60.0, 70.0],
+    })
+    df3 = pd.DataFrame({'AGE': [80.0]})
+
+    concatenated = concat_categorical(
+        [df1, df2, df3], {'PAYTYPER': {'Medicaid': 'Medicaid or CHIP'}})
+
+    assert concatenated.PAYTYPER.dtype == 'category'
+    assert list(concatenated.PAYTYPER.cat.categories) == [
+        'Medicaid or CHIP', 'Medicare', 'Self-pay']
+    assert concatenated.PAYTYPER.tolist()[:5] == [
+        'Medicaid or CHIP', 'Self-pay', 'Medicaid or CHIP', 'Self-pay',
+        'Medicare']
+    assert pd.isna(concatenated.PAYTYPER.iloc[5])
+    np.testing.assert_array_equal(
+        concatenated.AGE, [30.0, 40.0, 50.0, 60.0, 70.0, 80.0])
+    # the input frames are left alone
+    assert list(df1.PAYTYPER.cat.categories) == ['Medicaid', 'Self-pay']
+
+
+def test_concat_memory_report():
+    df1 = pd.DataFrame({
+        'PAYTYPER': pd.Series(['Medicaid', 'Self-pay'] * 50, dtype='category'),
+        'AGE': np.arange(100.0),
+    })
+    df2 = pd.DataFrame({
+        'PAYTYPER': pd.Series(['Medicare', 'Self-pay'] * 50, dtype='category'),
+        'AGE': np.arange(100.0),
+    })
+
+    report = concat_memory_report([df1, df2])
+
+    # AGE has the same dtype either way so only PAYTYPER is listed
+    assert list(report.index) == ['PAYTYPER', 'TOTAL']
+    assert report.loc['PAYTYPER', 'dtype_concat'] == 'object'
+    assert report.loc['PAYTYPER', 'dtype_categorical'] == 'category'
+    assert (report.mb_categorical < report.mb_concat).all()
+
+
+def test_parse_distinct_matches_row_wise_parse():
+    ser = pd.Series(['120', 'Blank', None, '95', '120'], dtype='category')
+    parse = lambda ser: ser.replace('Blank', np.nan).astype(float)
+
+    parsed = parse_distinct(ser, parse)
+
+    assert_series_equal(parsed, parse(ser.astype(object)))
+
+
+def test_bin_timerange():
+    hours = [0, 6, 7, 14, 15, 22, 23, np.nan]
+    expected = ['11p-7a', '11p-7a', '7a-3p', '7a-3p', '3p-11p', '3p-11p',
+                '11p-7a', '11p-7a']
+    assert list(bin_timerange(hours)) == expected
+    assert [map_timerange(h) for h in hours] == expected
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+from numpy.testing import assert_array_equal
+from vocabulary_matching import (
+    code_matrix, vocabulary_indicators, PrefixClassifier)
+
+
+def test_code_matrix():
+    df = pd.DataFrame({
+        'RFV1': pd.Series(['Cough', 'Chest pain', None], dtype='category'),
+        'RFV2': ['Chest pain', None, 'Vomiting'],
+    })
+    codes, vocabulary = code_matrix(df, ['RFV1', 'RFV2'])
+
+    decoded = np.where(codes >= 0, np.asarray(vocabulary)[codes], None)
+    assert_array_equal(decoded, [
+        ['Cough', 'Chest pain'],
+        ['Chest pain', None],
+        [None, 'Vomiting'],
+    ])
+
+
+def test_vocabulary_indicators_match_row_wise_search():
+    df = pd.DataFrame({
+        'RFV1': pd.Series(['Cough', 'Chest pain, NOS', 'Blank',
+                           'Shortness of breath', None], dtype='category'),
+        'RFV2': pd.Series(['Abdominal pain, cramps', 'Blank', 'Blank',
+                           'Chest Pain', 'Dyspnea'], dtype='category'),
+    })
+    patterns = {
+        'DYSPNEA_VISIT': 'shortness of breath|dyspnea',
+        'CHEST_PAIN_VISIT': 'chest pain',
+        'ABDOMINAL_PAIN_VISIT': 'abdominal pain',
+    }
+    indicators = vocabulary_indicators(df, ['RFV1', 'RFV2'], patterns)
+
+    for name, regex in patterns.items():
+        expected = (
+            df.apply(lambda col: col.astype(object).str.contains(
+                regex, regex=True, case=False, na=False))
+            .any(axis=1)
+        )
+        assert_array_equal(indicators[name], expected)
+
+
+def test_prefix_classifier_matches_regex():
+    groups = {
+        'STROKE': [
+            r'^Cerebral artery occlusion, unspec, wi\.\.\.',
+            r'^Cerebral infarction',
+        ],
+        'MI': [
+            r'^ST elevation \(STEMI\) myocardial infarction of unsp site',
+            r'^Cardiac arrest',
+        ],
+        # not a literal prefix, uses the regex fallback
+        'OTHER': [r'^Hypertensive (urgency|emergency)'],
+    }
+    vocabulary = [
+        'Cerebral artery occlusion, unspec, wi...',
+        'Cerebral artery occlusion, unspec, w/...',
+        'cerebral infarction, unspecified',
+        'Other cerebral infarction',
+        'ST elevation (STEMI) myocardial infarction of unsp site',
+        'Cardiac arrest, cause unspecified',
+        'Cardiac',
+        'Hypertensive emergency',
+        'Hypertensive crisis',
+    ]
+    classifier = PrefixClassifier(groups)
+    hits = classifier.classify(vocabulary)
+
+    assert hits.shape == (len(vocabulary) + 1, len(groups))
+    assert not hits[-1].any()
+    for j, patterns in enumerate(groups.values()):
+        expected = pd.Series(vocabulary).str.contains(
+            '|'.join(patterns), case=False, regex=True)
+        assert_array_equal(hits[:-1, j], expected)